@@ -1,15 +1,22 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import copy
+import json
+import os
+import time
 
-from source.langgraph_parts import create_beckn_context
+from source.APIclasses.beckn_callbacks import ACK, CALLBACK_ACTIONS, get_callback_registry, nack
+from source.langgraph_parts import create_beckn_context, warm_up
+from source.metrics import metrics
+from source.session_store import create_session_store
 
 # --- Import LangGraph components ---
+# The graph is compiled on the first chat turn (or by warm_up()), not when this module is imported
 try:
-    from source.langgraph_parts import app as langgraph_app
+    from source.langgraph_parts import get_app as get_langgraph_app
     try:
         from source.langgraph_parts import INITIAL_STATE as LANGGRAPH_INITIAL_STATE
     except ImportError:
@@ -30,6 +37,8 @@ try:
             "beckn_context": create_beckn_context(),
             "error_message": None,
             "latest_tool_output_summary": None,
+            "history_summary": None,
+            "summarized_message_count": 0,
         }
 
     if "input" not in LANGGRAPH_INITIAL_STATE:
@@ -40,7 +49,7 @@ try:
 
 except ImportError as e:
     print(f"Critical Error importing LangGraph components: {e}")
-    print("Ensure source.langgraph_parts.py exists and defines 'app' and 'INITIAL_STATE'.")
+    print("Ensure source.langgraph_parts.py exists and defines 'get_app' and 'INITIAL_STATE'.")
 
     # Fallback dummy app and initial state
     def dummy_langgraph_app(state):
@@ -50,87 +59,121 @@ except ImportError as e:
         })
         return state
 
-    langgraph_app = dummy_langgraph_app
+    def get_langgraph_app():
+        return dummy_langgraph_app
+
     LANGGRAPH_INITIAL_STATE = {"chat_history": [], "input": None}
 
 # Initialize Flask app and enable CORS
 app = Flask(__name__)
 CORS(app)
 
-# In-memory session state store (consider Redis/db for production)
-session_states = {}
+# Session state store: bounded in-process LRU by default, SESSION_STORE=sqlite to share it
+# between worker processes and keep sessions across restarts
+session_store = create_session_store()
 
+# The LLM client is otherwise created on the first chat turn; WARM_UP_ON_START=true does it at boot
+if os.getenv("WARM_UP_ON_START", "false").lower() == "true":
+    warm_up()
 
-@app.route("/api/chat", methods=["POST"])
-def chat_endpoint():
-    data = request.json or {}
+# CHAT_DEBUG_INFO=true adds "debug" (end stage, tools called) to chat responses; the load generator sets it
+CHAT_DEBUG_INFO = os.getenv("CHAT_DEBUG_INFO", "false").lower() == "true"
 
+
+def _prepare_turn(data):
+    """
+    Validates a chat request and returns (session_id, state) with the user's message applied,
+    or (None, error_response) if the request is invalid.
+    """
     user_message = data.get("user_message")
     session_id = data.get("session_id")
 
     if not user_message:
-        return jsonify({"error": "user_message is required"}), 400
+        return None, (jsonify({"error": "user_message is required"}), 400)
     if not session_id:
-        return jsonify({"error": "session_id is required"}), 400
+        return None, (jsonify({"error": "session_id is required"}), 400)
+
+    state = session_store.get(session_id)
 
     # Initialize session state if new session
-    if session_id not in session_states:
+    if state is None:
         print(f"Initializing new session: {session_id}")
-        session_states[session_id] = copy.deepcopy(LANGGRAPH_INITIAL_STATE)
+        state = copy.deepcopy(LANGGRAPH_INITIAL_STATE)
 
-    state = session_states[session_id]
+    # The graph's handle_user_input node adds the HumanMessage to chat_history (once)
+    state["input"] = user_message
 
-    # Append user message to chat history using langchain_core or fallback dict
-    try:
-        from langchain_core.messages import HumanMessage
-        state["chat_history"].append(HumanMessage(content=user_message))
-    except ImportError:
-        print("Warning: langchain_core not available, using dict for message.")
-        state["chat_history"].append({"role": "user", "content": user_message})
+    return session_id, state
+
+
+def _extract_ai_responses(state, updated_state):
+    """Collects the non-empty AI messages added to chat history by a graph run."""
+    ai_responses = []
+    pre_invoke_len = len(state["chat_history"])
+
+    for msg in updated_state["chat_history"][pre_invoke_len:]:
+        is_ai_message = False
+        try:
+            from langchain_core.messages import AIMessage
+            if isinstance(msg, AIMessage):
+                is_ai_message = True
+        except ImportError:
+            pass
+
+        if is_ai_message and msg.content and msg.content.strip():
+            ai_responses.append(msg.content.strip())
+        elif isinstance(msg, dict) and msg.get("role") == "ai" and msg.get("content"):
+            ai_responses.append(msg["content"].strip())
+
+    # Fallback: check last message if no new AI responses found
+    if not ai_responses and updated_state["chat_history"]:
+        last_msg = updated_state["chat_history"][-1]
+        try:
+            from langchain_core.messages import AIMessage
+            if isinstance(last_msg, AIMessage) and last_msg.content.strip():
+                ai_responses.append(last_msg.content.strip())
+        except ImportError:
+            if isinstance(last_msg, dict) and last_msg.get("role") == "ai" and last_msg.get("content"):
+                ai_responses.append(last_msg["content"].strip())
 
-    # Update 'input' field if exists
-    if "input" in state:
-        state["input"] = user_message
+    if not ai_responses:
+        print("No AI responses found after LangGraph invocation.")
+
+    return ai_responses
+
+
+def _turn_debug(state, updated_state):
+    """Stage the graph run ended in and the tools it called, e.g. for load tests to check the journey."""
+    tool_calls = [
+        tool_call.get("name")
+        for msg in updated_state["chat_history"][len(state["chat_history"]):]
+        for tool_call in getattr(msg, "tool_calls", None) or []
+    ]
+    return {"stage": updated_state.get("current_stage"), "tool_calls": tool_calls}
+
+
+@app.route("/api/chat", methods=["POST"])
+def chat_endpoint():
+    data = request.json or {}
+
+    session_id, state = _prepare_turn(data)
+    if session_id is None:
+        return state
 
     print(f"\n--- Invoking LangGraph for session {session_id} ---")
 
     try:
-        updated_state = langgraph_app.invoke(state)
-        session_states[session_id] = updated_state
-
-        # Extract new AI responses from chat history
-        ai_responses = []
-        pre_invoke_len = len(state["chat_history"])
-
-        for msg in updated_state["chat_history"][pre_invoke_len - 1:]:
-            is_ai_message = False
-            try:
-                from langchain_core.messages import AIMessage
-                if isinstance(msg, AIMessage):
-                    is_ai_message = True
-            except ImportError:
-                pass
-
-            if is_ai_message and msg.content and msg.content.strip():
-                ai_responses.append(msg.content.strip())
-            elif isinstance(msg, dict) and msg.get("role") == "ai" and msg.get("content"):
-                ai_responses.append(msg["content"].strip())
-
-        # Fallback: check last message if no new AI responses found
-        if not ai_responses and updated_state["chat_history"]:
-            last_msg = updated_state["chat_history"][-1]
-            try:
-                from langchain_core.messages import AIMessage
-                if isinstance(last_msg, AIMessage) and last_msg.content.strip():
-                    ai_responses.append(last_msg.content.strip())
-            except ImportError:
-                if isinstance(last_msg, dict) and last_msg.get("role") == "ai" and last_msg.get("content"):
-                    ai_responses.append(last_msg["content"].strip())
-
-        if not ai_responses:
-            print("No AI responses found after LangGraph invocation.")
-
-        return jsonify({"ai_responses": ai_responses, "session_id": session_id})
+        langgraph_app = get_langgraph_app()
+        with metrics.timed("chat_turn_seconds", endpoint="chat"):
+            updated_state = langgraph_app.invoke(state)
+        session_store.put(session_id, updated_state)
+
+        ai_responses = _extract_ai_responses(state, updated_state)
+
+        response = {"ai_responses": ai_responses, "session_id": session_id}
+        if CHAT_DEBUG_INFO:
+            response["debug"] = _turn_debug(state, updated_state)
+        return jsonify(response)
 
     except Exception as e:
         print(f"Error invoking LangGraph for session {session_id}: {e}")
@@ -145,5 +188,163 @@ def chat_endpoint():
         )
 
 
+def _sse(event, data):
+    """Formats one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _token_text(content):
+    """Text of a streamed message chunk; Gemini may stream a list of content parts."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return ""
+
+
+@app.route("/api/chat/stream", methods=["POST"])
+def chat_stream_endpoint():
+    """
+    Streaming variant of /api/chat (Server-Sent Events). Emits, in order of production:
+      node       - a graph node finished ({"node", "stage"})
+      tool_start - the agent requested a tool call ({"name", "args", "id"})
+      tool_end   - a tool call returned ({"id", "ok", "summary"})
+      token      - LLM text from the agent node as it is generated ({"content"})
+      done       - final AI responses, same shape as /api/chat
+      error      - the run failed ({"error", "detail"})
+    """
+    data = request.json or {}
+
+    session_id, state = _prepare_turn(data)
+    if session_id is None:
+        return state
+
+    print(f"\n--- Streaming LangGraph for session {session_id} ---")
+
+    def generate():
+        yield _sse("start", {"session_id": session_id})
+        started = time.perf_counter()
+        try:
+            langgraph_app = get_langgraph_app()
+            if not hasattr(langgraph_app, "stream"):
+                updated_state = langgraph_app(state)
+            else:
+                updated_state = None
+                for mode, chunk in langgraph_app.stream(state, stream_mode=["updates", "messages", "values"]):
+                    if mode == "messages":
+                        message_chunk, metadata = chunk
+                        text = _token_text(getattr(message_chunk, "content", ""))
+                        if metadata.get("langgraph_node") == "agent" and text:
+                            yield _sse("token", {"content": text})
+                    elif mode == "updates":
+                        for node, update in chunk.items():
+                            update = update or {}
+                            yield _sse("node", {"node": node, "stage": update.get("current_stage")})
+                            if node == "agent":
+                                for message in update.get("chat_history", [])[-1:]:
+                                    for tool_call in getattr(message, "tool_calls", None) or []:
+                                        yield _sse("tool_start", {"name": tool_call.get("name"), "args": tool_call.get("args"), "id": tool_call.get("id")})
+                            elif node == "call_tool":
+                                for tool_message in update.get("tool_output") or []:
+                                    yield _sse("tool_end", {"id": tool_message.tool_call_id, "ok": update.get("current_stage") != "error", "summary": update.get("latest_tool_output_summary")})
+                    elif mode == "values":
+                        updated_state = chunk
+
+            metrics.observe("chat_turn_seconds", time.perf_counter() - started, endpoint="chat_stream")
+            session_store.put(session_id, updated_state)
+            done = {"ai_responses": _extract_ai_responses(state, updated_state), "session_id": session_id}
+            if CHAT_DEBUG_INFO:
+                done["debug"] = _turn_debug(state, updated_state)
+            yield _sse("done", done)
+
+        except Exception as e:
+            print(f"Error streaming LangGraph for session {session_id}: {e}")
+            metrics.increment("chat_turn_seconds_errors_total", endpoint="chat_stream")
+            yield _sse("error", {"error": "Internal error processing your message.", "detail": str(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/beckn/<action>", methods=["POST"])
+def beckn_callback_endpoint(action):
+    """
+    Receives the asynchronous on_search / on_select / on_init / on_confirm / on_status callbacks
+    of the BPPs (BECKN_BAP_URI must point at /beckn) and wakes the tool call waiting for them.
+    """
+    if action not in CALLBACK_ACTIONS:
+        return jsonify(nack("UNKNOWN_ACTION", f"Unsupported callback {action}")), 404
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("context"), dict):
+        return jsonify(nack("BAD_REQUEST", "Callback body must be a JSON object with a context")), 400
+    outcome = get_callback_registry().deliver(action, body)
+    if outcome != "matched":
+        print(f"Beckn {action} callback {outcome}: transaction {body['context'].get('transaction_id')}, message {body['context'].get('message_id')}")
+    # Beckn ACKs receipt even when nobody waits for the callback any more
+    return jsonify(ACK)
+
+
+@app.route("/api/enrollments", methods=["POST"])
+def create_enrollment_endpoint():
+    """
+    Starts a bulk household enrollment. Body: {"households": [...], "job_id": optional,
+    "concurrency": optional}, or the households as CSV (text/csv) / JSONL. Re-posting a job_id
+    resumes that job from its journal. Poll GET /api/enrollments/<job_id> for progress.
+    """
+    from source.bulk_enrollment import ENROLLMENT_CONCURRENCY, normalize_household, parse_households, start_enrollment_job
+
+    options = request.args.to_dict()
+    try:
+        if request.is_json:
+            data = request.get_json()
+            options.update({key: value for key, value in data.items() if key != "households"})
+            households = [normalize_household(record) for record in data.get("households") or []]
+        else:
+            households = parse_households(request.get_data(as_text=True), request.content_type or "")
+        if not households:
+            return jsonify({"error": "No households given"}), 400
+        job_id = start_enrollment_job(households, os.getenv("WORLD_ENGINE_BASE_URL"), job_id=options.get("job_id"),
+                                      concurrency=int(options.get("concurrency") or ENROLLMENT_CONCURRENCY))
+    except (ValueError, KeyError) as e:
+        return jsonify({"error": f"Invalid households: {e}"}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+    return jsonify({"job_id": job_id, "households": len(households)}), 202
+
+
+@app.route("/api/enrollments/<job_id>", methods=["GET"])
+def get_enrollment_endpoint(job_id):
+    from source.bulk_enrollment import get_enrollment_job
+
+    job = get_enrollment_job(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown enrollment job {job_id}"}), 404
+    return jsonify(job)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """
+    Latency histograms and counters for graph nodes, LLM calls, tools and outbound HTTP.
+    Prometheus text format by default; ?format=json returns p50/p95/p99 per series plus
+    HTTP pool, catalog cache and session store stats.
+    """
+    if request.args.get("format") == "json":
+        from source.APIclasses.catalog_cache import get_catalog_cache
+        from source.APIclasses.http_transport import get_shared_transport
+
+        return jsonify({
+            **metrics.snapshot(),
+            "http_transport": get_shared_transport().stats(),
+            "catalog_cache": get_catalog_cache().stats(),
+            "session_store": session_store.stats(),
+            "beckn_callbacks": get_callback_registry().stats(),
+        })
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     app.run(debug=True, port=5000)
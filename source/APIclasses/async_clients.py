@@ -0,0 +1,202 @@
+import asyncio
+
+from source.APIclasses.becknAPI import BecknClient
+from source.APIclasses.beckn_payloads import JSON_HEADERS, BecknPayloadBuilder
+from source.APIclasses.beckn_callbacks import callback_registry_from_env, is_ack
+from source.APIclasses.beckn_discovery import DISCOVERY_SEARCHES, merge_catalogs
+from source.APIclasses.world_engine_client import WorldEngineClient
+from source.APIclasses.catalog_cache import FRESH, MISS, get_catalog_cache
+from source.APIclasses.grid_loads import GridLoads
+from source.APIclasses.grid_topology import get_topology_cache
+from source.APIclasses.meter_store import get_meter_store
+from source.APIclasses.http_transport import get_shared_async_transport
+from source.metrics import metrics
+
+
+class AsyncBecknClient(BecknClient):
+    """
+    asyncio variant of BecknClient with the same method surface.
+
+    Every public method (search_solar_retail, confirm_subsidy, status_dfp, ...) builds the same
+    payload as BecknClient and returns a coroutine, so callers simply `await` it:
+
+        client = AsyncBecknClient(base_url, bap_id, bap_uri, bpp_id, bpp_uri)
+        catalog = await client.search_solar_retail()
+    """
+
+    def __init__(self, base_url, bap_id, bap_uri, bpp_id, bpp_uri, transport=None, catalog_cache=None, callbacks=None):
+        self.base_url = base_url
+        self.bap_id = bap_id
+        self.bap_uri = bap_uri
+        self.bpp_id = bpp_id
+        self.bpp_uri = bpp_uri
+        # None means "the shared transport of whichever event loop awaits the call"
+        self._transport = transport
+        # Same catalog cache as the sync client, so both warm it for each other
+        self.catalog_cache = catalog_cache or get_catalog_cache()
+        self.payloads = BecknPayloadBuilder(bap_id, bap_uri, bpp_id, bpp_uri)
+        self.callbacks = callbacks or callback_registry_from_env()
+        self._background_refreshes = set()
+
+    @property
+    def transport(self):
+        return self._transport or get_shared_async_transport()
+
+    async def _post(self, url, payload):
+        pending = self.callbacks.expect_payload(payload) if self.callbacks else None
+        try:
+            with metrics.timed("beckn_request_seconds", domain=payload.domain, action=payload.action):
+                response = await self.transport.post(url, content=payload.body, headers=JSON_HEADERS)
+                response.raise_for_status() # Raise httpx.HTTPStatusError for 4xx / 5xx, like the sync tools
+                response = response.json()
+                if pending is not None and is_ack(response):
+                    return await self.callbacks.wait_async(pending)
+            return response
+        finally:
+            if pending is not None:
+                self.callbacks.discard(pending)
+
+    async def _refresh_search(self, key, url, payload):
+        try:
+            value = await self._post(url, payload)
+        except Exception as e:
+            self.catalog_cache.end_refresh(key, error=e)
+        else:
+            self.catalog_cache.end_refresh(key, value)
+
+    async def _cached_search(self, url, payload):
+        cache = self.catalog_cache
+        if not cache.enabled:
+            return await self._post(url, payload)
+        key = self._search_cache_key(payload)
+        value, status = cache.lookup(key)
+        if status == FRESH:
+            return value
+        if status == MISS:
+            value = await self._post(url, payload)
+            cache.store(key, value)
+            return value
+        # Stale: answer now and revalidate in the background
+        if cache.begin_refresh(key):
+            task = asyncio.create_task(self._refresh_search(key, url, payload))
+            self._background_refreshes.add(task)
+            task.add_done_callback(self._background_refreshes.discard)
+        return value
+
+    async def discover(self, searches=None, timeout=None):
+        """
+        Same as BecknClient.discover, with the searches gathered on the running event loop.
+        """
+        names = list(searches or DISCOVERY_SEARCHES)
+        calls = [getattr(self, DISCOVERY_SEARCHES[name][0])() for name in names]
+        with metrics.timed("beckn_discovery_seconds"):
+            if timeout is not None:
+                calls = [asyncio.wait_for(call, timeout) for call in calls]
+            results = await asyncio.gather(*calls, return_exceptions=True)
+        return merge_catalogs(dict(zip(names, results)))
+
+    def prefetch_discovery(self, searches=None):
+        """
+        Schedules discover() as a task on the running event loop and returns it.
+        """
+        task = asyncio.create_task(self.discover(searches))
+        self._background_refreshes.add(task)
+        task.add_done_callback(self._background_refreshes.discard)
+        return task
+
+
+class AsyncWorldEngineClient(WorldEngineClient):
+    """
+    asyncio variant of WorldEngineClient with the same method surface.
+
+    Every public method (get_utilities_detailed, create_meter, toggle_der_switching, ...)
+    returns a coroutine and raises httpx.HTTPStatusError for bad status codes.
+    """
+
+    def __init__(self, base_url, transport=None):
+        self.base_url = base_url
+        # None means "the shared transport of whichever event loop awaits the call"
+        self._transport = transport
+        self.topology_cache = get_topology_cache(base_url)
+
+    @property
+    def transport(self):
+        return self._transport or get_shared_async_transport()
+
+    async def _request(self, method, url, **kwargs):
+        response = await self.transport.request(method, url, **kwargs)
+        response.raise_for_status() # Raise an exception for bad status codes
+        return response.json()
+
+    async def get_utilities_detailed(self, refresh=False):
+        return (await self.get_topology(refresh=refresh)).raw
+
+    async def get_topology(self, refresh=False):
+        return await self.topology_cache.aget(self._fetch_utilities_detailed, refresh=refresh)
+
+    async def reset_data(self):
+        result = await super().reset_data()
+        # Invalidate again in case the topology was reloaded while the reset was in flight
+        self.topology_cache.invalidate()
+        return result
+
+    async def get_grid_load_analytics(self):
+        return GridLoads.from_payload(await self.get_grid_loads())
+
+    @property
+    def meter_store(self):
+        # Synced explicitly in get_meter_series, since fetching here is a coroutine
+        return get_meter_store(self.base_url)
+
+    async def get_meter_series(self, meter_dataset_id, start=None, end=None, columns=None):
+        store = self.meter_store
+        if store.needs_sync(meter_dataset_id):
+            store.append(meter_dataset_id, await self.get_meter_historical_data(meter_dataset_id))
+        return store.series(meter_dataset_id, start, end, columns=columns, sync=False)
+
+    async def _get_meter_page(self, page, page_size, populate, fields, sort):
+        url = f"{self.base_url}/meters"
+        return await self._request("GET", url, params=self._meter_page_params(page, page_size, populate, fields, sort))
+
+    async def iter_meter_pages(self, page_size=100, populate=(), fields=None, sort="id:asc", concurrency=1, max_pages=None):
+        """
+        Async generator with the same behaviour as WorldEngineClient.iter_meter_pages, using tasks
+        on the running event loop for the fetch-ahead window.
+        """
+        populate, fields = tuple(populate or ()), tuple(fields or ())
+        window = max(1, concurrency)
+        in_flight = []
+        next_page = 1
+        page_count = max_pages
+        exhausted = False
+
+        def top_up():
+            nonlocal next_page
+            while len(in_flight) < window and not exhausted and (page_count is None or next_page <= page_count):
+                in_flight.append(asyncio.create_task(self._get_meter_page(next_page, page_size, populate, fields, sort)))
+                next_page += 1
+
+        try:
+            top_up()
+            while in_flight:
+                response = await in_flight.pop(0)
+                meters = response.get("data") or []
+                pagination = (response.get("meta") or {}).get("pagination") or {}
+                if pagination.get("pageCount") is not None:
+                    page_count = min(pagination["pageCount"], max_pages or pagination["pageCount"])
+                if len(meters) < page_size:
+                    exhausted = True
+                    for task in in_flight:
+                        task.cancel()
+                    in_flight.clear()
+                top_up() # the next pages download while the caller works on this one
+                if meters:
+                    yield meters, pagination
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    async def iter_meters(self, page_size=100, populate=(), fields=None, sort="id:asc", concurrency=1, max_pages=None):
+        async for meters, _ in self.iter_meter_pages(page_size, populate, fields, sort, concurrency, max_pages):
+            for meter in meters:
+                yield meter
@@ -1,487 +1,205 @@
-import requests
-import json
-import uuid
-from datetime import datetime
+from source.APIclasses.http_transport import get_shared_transport
+from source.APIclasses.catalog_cache import MISS, catalog_key, get_catalog_cache
+from source.APIclasses.beckn_payloads import DEFAULT_CITY_CODE, JSON_HEADERS, BecknPayloadBuilder
+from source.APIclasses.beckn_callbacks import callback_registry_from_env, is_ack
+from source.APIclasses.beckn_discovery import DISCOVERY_SEARCHES, get_discovery_executor, merge_catalogs
+from source.metrics import metrics
 
 class BecknClient:
-    def __init__(self, base_url, bap_id, bap_uri, bpp_id, bpp_uri):
+    def __init__(self, base_url, bap_id, bap_uri, bpp_id, bpp_uri, transport=None, catalog_cache=None, callbacks=None):
         self.base_url = base_url
         self.bap_id = bap_id
         self.bap_uri = bap_uri
         self.bpp_id = bpp_id
         self.bpp_uri = bpp_uri
-
-    def _generate_context(self, action, domain="deg:service", city_code="NANP:628"):
-        return {
-            "domain": domain,
-            "action": action,
-            "location": {
-                "country": {
-                    "code": "USA"
-                },
-                "city": {
-                    "code": city_code
-                }
-            },
-            "version": "1.1.0",
-            "bap_id": self.bap_id,
-            "bap_uri": self.bap_uri,
-            "bpp_id": self.bpp_id,
-            "bpp_uri": self.bpp_uri,
-            "transaction_id": str(uuid.uuid4()),
-            "message_id": str(uuid.uuid4()),
-            "timestamp": datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')[:-4] + 'Z'
-        }
+        # Pooled keep-alive transport, shared process-wide unless one is passed in
+        self.transport = transport or get_shared_transport()
+        # Search catalogs are identical for every user, so they are shared through a TTL cache
+        self.catalog_cache = catalog_cache or get_catalog_cache()
+        # Request bodies are spliced into pre-serialized per (domain, action) templates
+        self.payloads = BecknPayloadBuilder(bap_id, bap_uri, bpp_id, bpp_uri)
+        # With BECKN_CALLBACK_MODE, ACKed requests wait for their on_* callbacks on this registry
+        self.callbacks = callbacks or callback_registry_from_env()
+
+    def _post(self, url, payload):
+        # Registered before sending, so a callback that beats the ACK is not lost
+        pending = self.callbacks.expect_payload(payload) if self.callbacks else None
+        try:
+            with metrics.timed("beckn_request_seconds", domain=payload.domain, action=payload.action):
+                response = self.transport.post(url, data=payload.body, headers=JSON_HEADERS)
+                response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
+                response = response.json()
+                if pending is not None and is_ack(response):
+                    return self.callbacks.wait(pending)
+            return response
+        finally:
+            if pending is not None:
+                self.callbacks.discard(pending)
+
+    @staticmethod
+    def _search_cache_key(payload):
+        return payload.cache_key
+
+    def _cached_search(self, url, payload):
+        key = self._search_cache_key(payload)
+        return self.catalog_cache.get_or_fetch(key, lambda: self._post(url, payload))
+
+    def discover(self, searches=None, timeout=None):
+        """
+        Runs the independent /search calls of the adoption journey concurrently and merges them into
+        one normalized catalog (see beckn_discovery.merge_catalogs). Each search goes through the
+        catalog cache, so a discovery also warms the cache for the individual search_* calls.
+
+        Args:
+            searches (list): Names from DISCOVERY_SEARCHES to run, all of them by default.
+            timeout (float): Seconds to wait for each search; slower ones are reported under "errors".
+        """
+        with metrics.timed("beckn_discovery_seconds"):
+            futures = self._submit_searches(searches)
+            responses = {}
+            for name, future in futures.items():
+                try:
+                    responses[name] = future.result(timeout=timeout)
+                except Exception as e:
+                    responses[name] = e
+        return merge_catalogs(responses)
+
+    def prefetch_discovery(self, searches=None):
+        """
+        Starts the discovery searches in the background without waiting for them and returns
+        {name: Future}. Used speculatively once the user's location is known, so the catalogs are
+        already cached when the conversation reaches the search stages.
+        """
+        futures = self._submit_searches(searches)
+        for name, future in futures.items():
+            future.add_done_callback(lambda f, name=name: self._prefetch_done(name, f))
+        return futures
+
+    def _submit_searches(self, searches):
+        executor = get_discovery_executor()
+        return {name: executor.submit(getattr(self, DISCOVERY_SEARCHES[name][0])) for name in (searches or DISCOVERY_SEARCHES)}
+
+    def cached_discovery(self, searches=None):
+        """
+        Normalized catalog of the discovery searches that are already in the catalog cache, without
+        any network call. Searches not cached (yet) are simply missing from the result.
+        """
+        responses = {}
+        for name in (searches or DISCOVERY_SEARCHES):
+            _, domain, descriptor = DISCOVERY_SEARCHES[name]
+            value, status = self.catalog_cache.lookup(catalog_key(domain, descriptor, (self.payloads.country_code, DEFAULT_CITY_CODE)))
+            if status != MISS:
+                responses[name] = value
+        return merge_catalogs(responses)
+
+    @staticmethod
+    def _prefetch_done(name, future):
+        error = future.exception()
+        metrics.increment("beckn_discovery_prefetch_total", search=name, outcome="error" if error else "ok")
+        if error:
+            print(f"Speculative {name} search failed: {error}")
 
     def search_connection(self):
         url = f"{self.base_url}/search"
-        context = self._generate_context(action="search")
-        payload = {
-            "context": context,
-            "message": {
-                "intent": {
-                    "item": {
-                        "descriptor": {
-                            "name": "Connection"
-                        }
-                    }
-                }
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
+        payload = self.payloads.search("deg:service", "Connection")
+        return self._cached_search(url, payload)
 
     def select_connection(self, provider_id, item_id):
         url = f"{self.base_url}/select"
-        context = self._generate_context(action="select")
-        payload = {
-            "context": context,
-            "message": {
-                "order": {
-                    "provider": {
-                        "id": provider_id
-                    },
-                    "items": [
-                        {
-                            "id": item_id
-                        }
-                    ]
-                }
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
+        payload = self.payloads.order("deg:service", "select", provider_id, item_id)
+        return self._post(url, payload)
 
     def init_connection(self, provider_id, item_id):
         url = f"{self.base_url}/init"
-        context = self._generate_context(action="init")
-        payload = {
-            "context": context,
-            "message": {
-                "order": {
-                    "provider": {
-                        "id": provider_id
-                    },
-                    "items": [
-                        {
-                            "id": item_id
-                        }
-                    ]
-                }
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
+        payload = self.payloads.order("deg:service", "init", provider_id, item_id)
+        return self._post(url, payload)
 
     def confirm_connection(self, provider_id, item_id, fulfillment_id, customer_name, customer_phone, customer_email):
         url = f"{self.base_url}/confirm"
-        context = self._generate_context(action="confirm")
-        payload = {
-            "context": context,
-            "message": {
-                "order": {
-                    "provider": {
-                        "id": provider_id
-                    },
-                    "items": [
-                        {
-                            "id": item_id
-                        }
-                    ],
-                    "fulfillments": [
-                        {
-                            "id": fulfillment_id,
-                            "customer": {
-                                "person": {
-                                    "name": customer_name
-                                },
-                                "contact": {
-                                    "phone": customer_phone,
-                                    "email": customer_email
-                                }
-                            }
-                        }
-                    ]
-                }
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
+        payload = self.payloads.confirm("deg:service", provider_id, item_id, fulfillment_id, customer_name, customer_phone, customer_email)
+        return self._post(url, payload)
 
     def status_connection(self, order_id):
         url = f"{self.base_url}/status"
-        context = self._generate_context(action="status")
-        payload = {
-            "context": context,
-            "message": {
-                "order_id": order_id
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
+        payload = self.payloads.status("deg:service", order_id)
+        return self._post(url, payload)
 
     def confirm_subsidy(self, provider_id, item_id, fulfillment_id, customer_name, customer_phone, customer_email):
         url = f"{self.base_url}/confirm"
-        context = self._generate_context(action="confirm", domain="deg:schemes")
-        payload = {
-          "context": context,
-          "message": {
-           "order": {
-                    "provider": {
-                        "id": provider_id
-                    },
-                    "items": [
-                        {
-                            "id": item_id
-
-                        }
-                    ],
-                                 "fulfillments": [
-                {
-                  "id": fulfillment_id,
-                  "customer": {
-                    "person": {
-                      "name": customer_name
-                    },
-                    "contact": {
-                      "phone": customer_phone,
-                      "email": customer_email
-                    }
-                  }
-                }
-              ]
-                }
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
-
+        payload = self.payloads.confirm("deg:schemes", provider_id, item_id, fulfillment_id, customer_name, customer_phone, customer_email)
+        return self._post(url, payload)
 
     def search_subsidy(self):
         url = f"{self.base_url}/search"
-        context = self._generate_context(action="search", domain="deg:schemes")
-        payload = {
-            "context": context,
-            "message": {
-                "intent": {
-                    "item": {
-                        "descriptor": {
-                            "name": "incentive"
-                        }
-                    }
-                }
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
+        payload = self.payloads.search("deg:schemes", "incentive")
+        return self._cached_search(url, payload)
 
     def status_subsidy(self, order_id):
         url = f"{self.base_url}/status"
-        context = self._generate_context(action="status", domain="deg:service") # Note: Domain is deg:service in the postman collection for subsidy status
-        payload = {
-          "context": context,
-          "message": {
-                "order_id": order_id
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
+        payload = self.payloads.status("deg:service", order_id) # Note: Domain is deg:service in the postman collection for subsidy status
+        return self._post(url, payload)
 
     def search_dfp(self):
         url = f"{self.base_url}/search"
-        context = self._generate_context(action="search", domain="deg:schemes")
-        payload = {
-            "context": context,
-            "message": {
-                "intent": {
-                    "item": {
-                        "descriptor": {
-                            "name": "Program"
-                        }
-                    }
-                }
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
+        payload = self.payloads.search("deg:schemes", "Program")
+        return self._cached_search(url, payload)
 
     def confirm_dfp(self, provider_id, item_id, fulfillment_id, customer_name, customer_phone, customer_email):
         url = f"{self.base_url}/confirm"
-        context = self._generate_context(action="confirm", domain="deg:schemes")
-        payload = {
-          "context": context,
-          "message": {
-           "order": {
-                    "provider": {
-                        "id": provider_id
-                    },
-                    "items": [
-                        {
-                            "id": item_id
-
-                        }
-                    ],
-                     "fulfillments": [
-                {
-                  "id": fulfillment_id,
-                  "customer": {
-                    "person": {
-                      "name": customer_name
-                    },
-                    "contact": {
-                      "phone": customer_phone,
-                      "email": customer_email
-                    }
-                  }
-                }
-              ]
-                }
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
+        payload = self.payloads.confirm("deg:schemes", provider_id, item_id, fulfillment_id, customer_name, customer_phone, customer_email)
+        return self._post(url, payload)
 
     def status_dfp(self, order_id):
         url = f"{self.base_url}/status"
-        context = self._generate_context(action="status", domain="deg:schemes")
-        payload = {
-          "context": context,
-          "message": {
-            "order_id": order_id
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
+        payload = self.payloads.status("deg:schemes", order_id)
+        return self._post(url, payload)
 
     def search_solar_retail(self):
         url = f"{self.base_url}/search"
-        context = self._generate_context(action="search", domain="deg:retail")
-        payload = {
-            "context": context,
-            "message": {
-                "intent": {
-                    "item": {
-                        "descriptor": {
-                            "name": "solar"
-                        }
-                    }
-                }
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
+        payload = self.payloads.search("deg:retail", "solar")
+        return self._cached_search(url, payload)
 
     def select_solar_retail(self, provider_id, item_id):
         url = f"{self.base_url}/select"
-        context = self._generate_context(action="select", domain="deg:retail")
-        payload = {
-          "context": context,
-          "message": {
-           "order": {
-                    "provider": {
-                        "id": provider_id
-                    },
-                    "items": [
-                        {
-                            "id": item_id
-                        }
-                    ]
-                }
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
-
+        payload = self.payloads.order("deg:retail", "select", provider_id, item_id)
+        return self._post(url, payload)
 
     def init_solar_retail(self, provider_id, item_id):
         url = f"{self.base_url}/init"
-        context = self._generate_context(action="init", domain="deg:retail")
-        payload = {
-          "context": context,
-          "message": {
-           "order": {
-                    "provider": {
-                        "id": provider_id
-                    },
-                    "items": [
-                        {
-                            "id": item_id
-                        }
-                    ]
-                }
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
+        payload = self.payloads.order("deg:retail", "init", provider_id, item_id)
+        return self._post(url, payload)
 
     def confirm_solar_retail(self, provider_id, item_id, fulfillment_id, customer_name, customer_phone, customer_email):
         url = f"{self.base_url}/confirm"
-        context = self._generate_context(action="confirm", domain="deg:retail")
-        payload = {
-          "context": context,
-          "message": {
-           "order": {
-                    "provider": {
-                        "id": provider_id
-                    },
-                    "items": [
-                        {
-                            "id": item_id
-                        }
-                    ],
-                  "fulfillments": [
-                {
-                  "id": fulfillment_id,
-                  "customer": {
-                    "person": {
-                      "name": customer_name
-                    },
-                    "contact": {
-                      "phone": customer_phone,
-                      "email": customer_email
-                    }
-                  }
-                }
-              ]
-                }
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
+        payload = self.payloads.confirm("deg:retail", provider_id, item_id, fulfillment_id, customer_name, customer_phone, customer_email)
+        return self._post(url, payload)
 
     def status_solar_retail(self, order_id):
         url = f"{self.base_url}/status"
-        context = self._generate_context(action="status", domain="deg:retail")
-        payload = {
-          "context": context,
-          "message": {
-            "order_id": order_id
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
+        payload = self.payloads.status("deg:retail", order_id)
+        return self._post(url, payload)
 
     def search_solar_service(self):
         url = f"{self.base_url}/search"
-        context = self._generate_context(action="search", domain="deg:service")
-        payload = {
-            "context": context,
-            "message": {
-                "intent": {
-                    "descriptor": {
-                        "name": "resi"
-                    }
-                }
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
+        payload = self.payloads.search("deg:service", "resi", item_intent=False)
+        return self._cached_search(url, payload)
 
     def select_solar_service(self, provider_id, item_id):
         url = f"{self.base_url}/select"
-        context = self._generate_context(action="select", domain="deg:service")
-        payload = {
-            "context": context,
-            "message": {
-                "order": {
-                    "provider": {
-                        "id": provider_id
-                    },
-                    "items": [
-                        {
-                            "id": item_id
-                        }
-                    ]
-                }
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
+        payload = self.payloads.order("deg:service", "select", provider_id, item_id)
+        return self._post(url, payload)
 
     def init_solar_service(self, provider_id, item_id):
         url = f"{self.base_url}/init"
-        context = self._generate_context(action="init", domain="deg:service")
-        payload = {
-          "context": context,
-          "message": {
-           "order": {
-                    "provider": {
-                        "id": provider_id
-                    },
-                    "items": [
-                        {
-                            "id": item_id
-                        }
-                    ]
-                }
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
+        payload = self.payloads.order("deg:service", "init", provider_id, item_id)
+        return self._post(url, payload)
 
     def confirm_solar_service(self, provider_id, item_id, fulfillment_id, customer_name, customer_phone, customer_email):
         url = f"{self.base_url}/confirm"
-        context = self._generate_context(action="confirm", domain="deg:service")
-        payload = {
-            "context": context,
-            "message": {
-                "order": {
-                    "provider": {
-                        "id": provider_id
-                    },
-                    "items": [
-                        {
-                            "id": item_id
-                        }
-                    ],
-                    "fulfillments": [
-                        {
-                            "id": fulfillment_id,
-                            "customer": {
-                                "person": {
-                                    "name": customer_name
-                                },
-                                "contact": {
-                                    "phone": customer_phone,
-                                    "email": customer_email
-                                }
-                            }
-                        }
-                    ]
-                }
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
+        payload = self.payloads.confirm("deg:service", provider_id, item_id, fulfillment_id, customer_name, customer_phone, customer_email)
+        return self._post(url, payload)
 
     def status_solar_service(self, order_id):
         url = f"{self.base_url}/status"
-        context = self._generate_context(action="status", domain="deg:service")
-        payload = {
-            "context": context,
-            "message": {
-                "order_id": order_id
-            }
-        }
-        response = requests.post(url, json=payload)
-        return response.json()
\ No newline at end of file
+        payload = self.payloads.status("deg:service", order_id)
+        return self._post(url, payload)
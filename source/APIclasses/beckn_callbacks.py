@@ -0,0 +1,283 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from source.metrics import metrics
+
+CALLBACK_ACTIONS = ("on_search", "on_select", "on_init", "on_confirm", "on_status")
+
+# "true": Beckn calls that are only ACKed wait for their on_* callbacks (POSTed to BECKN_BAP_URI/on_*)
+BECKN_CALLBACK_MODE = os.getenv("BECKN_CALLBACK_MODE", "false").lower() == "true"
+# Seconds a select/init/confirm/status call waits for its callback
+BECKN_CALLBACK_TIMEOUT = float(os.getenv("BECKN_CALLBACK_TIMEOUT", "10"))
+# Seconds on_search responses are collected from the BPPs before the merged catalog is returned
+BECKN_SEARCH_WINDOW = float(os.getenv("BECKN_SEARCH_WINDOW", "3"))
+# If the number of BPPs is known, a search completes as soon as that many on_search arrived (0 = unknown)
+BECKN_SEARCH_EXPECTED_BPPS = int(os.getenv("BECKN_SEARCH_EXPECTED_BPPS", "0"))
+
+ACK = {"message": {"ack": {"status": "ACK"}}}
+
+
+def nack(code, message):
+    return {"message": {"ack": {"status": "NACK"}}, "error": {"code": code, "message": message}}
+
+
+def is_ack(response):
+    """
+    True for a bare Beckn acknowledgement, i.e. the actual answer arrives through an on_* callback.
+    """
+    message = response.get("message") if isinstance(response, dict) else None
+    return isinstance(message, dict) and set(message) == {"ack"}
+
+
+def merge_search_responses(responses):
+    """
+    Combines the on_search callbacks of several BPPs into one response shaped like a single
+    on_search: providers and items are concatenated and tagged with the bpp_id/bpp_uri that offers
+    them (later select/init/confirm calls must go to that BPP).
+    """
+    providers = []
+    items = []
+    bpps = []
+    errors = []
+    for response in responses:
+        context = response.get("context") or {}
+        source = {"bpp_id": context.get("bpp_id"), "bpp_uri": context.get("bpp_uri")}
+        bpps.append(source["bpp_id"])
+        if "error" in response:
+            errors.append({**source, "error": response["error"]})
+            continue
+        catalog = (response.get("message") or {}).get("catalog") or {}
+        providers.extend({**provider, **source} for provider in catalog.get("providers") or [])
+        items.extend({**item, **source} for item in catalog.get("items") or [])
+    merged = {
+        "context": responses[0].get("context"),
+        "message": {"catalog": {"providers": providers, "items": items}},
+        "bpps": bpps,
+    }
+    if errors:
+        merged["errors"] = errors
+    return merged
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class PendingRequest:
+    """
+    A Beckn request waiting for its on_* callback(s). Completes when `expected_responses` callbacks
+    arrived or when the deadline passes, whichever comes first.
+    """
+
+    def __init__(self, transaction_id, message_id, action, timeout, expected_responses=None):
+        """
+        Args:
+            transaction_id (str): context.transaction_id of the request.
+            message_id (str): context.message_id of the request; callbacks echo it.
+            action (str): Request action, e.g. "search"; callbacks carry "on_" + action.
+            timeout (float): Seconds from now until the request completes with what has arrived.
+            expected_responses (int): Callbacks that complete the request early; None waits for the deadline.
+        """
+        self.transaction_id = transaction_id
+        self.message_id = message_id
+        self.callback_action = f"on_{action}"
+        self.deadline = time.monotonic() + timeout
+        self.expected_responses = expected_responses
+        self.responses = []
+        self.done = False
+        self._condition = threading.Condition()
+        self._async_waiters = []
+
+    def add(self, body):
+        """
+        Records one callback. Returns False if the request already completed (late callback).
+        """
+        with self._condition:
+            if self.done:
+                return False
+            self.responses.append(body)
+            if self.expected_responses and len(self.responses) >= self.expected_responses:
+                self._finish()
+            return True
+
+    def _finish(self):
+        # Caller holds self._condition
+        self.done = True
+        self._condition.notify_all()
+        for loop, future in self._async_waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+        self._async_waiters = []
+
+    def wait(self):
+        """
+        Blocks the calling thread until the request completes and returns its result().
+        """
+        with self._condition:
+            while not self.done:
+                remaining = self.deadline - time.monotonic()
+                if remaining <= 0:
+                    self._finish()
+                    break
+                self._condition.wait(remaining)
+        return self.result()
+
+    async def wait_async(self):
+        """
+        Same as wait() without blocking the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        future = None
+        with self._condition:
+            if not self.done:
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+        if future is not None:
+            try:
+                await asyncio.wait_for(future, max(0.0, self.deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+        with self._condition:
+            if not self.done:
+                self._finish()
+        return self.result()
+
+    def result(self):
+        """
+        The single callback for select/init/confirm/status, the merged catalog for search, or an
+        {"error": ...} dict when nothing arrived before the deadline.
+        """
+        responses = list(self.responses)
+        if not responses:
+            return {"error": f"No {self.callback_action} callback received before the deadline",
+                    "transaction_id": self.transaction_id, "message_id": self.message_id}
+        if self.callback_action == "on_search":
+            return merge_search_responses(responses)
+        return responses[0]
+
+
+class CallbackRegistry:
+    """
+    Correlates incoming on_* callbacks with the requests waiting for them by message_id (and checks
+    transaction_id and action), so any number of BPPs can answer in parallel while the caller
+    sleeps on a condition instead of polling.
+    """
+
+    def __init__(self, timeout=BECKN_CALLBACK_TIMEOUT, search_window=BECKN_SEARCH_WINDOW,
+                 search_expected_bpps=BECKN_SEARCH_EXPECTED_BPPS, recent_ids=4096):
+        """
+        Args:
+            timeout (float): Default deadline for select/init/confirm/status, in seconds.
+            search_window (float): Default collection window for on_search, in seconds.
+            search_expected_bpps (int): on_search callbacks that end the window early (0 = unknown).
+            recent_ids (int): Completed message ids remembered to tell late callbacks from unknown ones.
+        """
+        self.timeout = timeout
+        self.search_window = search_window
+        self.search_expected_bpps = search_expected_bpps
+        self._pending = {} # message_id -> PendingRequest
+        self._recent = deque(maxlen=recent_ids)
+        self._recent_ids = set()
+        self._lock = threading.Lock()
+        self.counters = {"expected": 0, "matched": 0, "late": 0, "unmatched": 0, "timed_out": 0}
+
+    def expect(self, transaction_id, message_id, action, timeout=None, expected_responses=None):
+        """
+        Registers a request before it is sent, so a fast callback cannot arrive unannounced.
+        """
+        if action == "search":
+            timeout = self.search_window if timeout is None else timeout
+            expected_responses = expected_responses or self.search_expected_bpps or None
+        else:
+            timeout = self.timeout if timeout is None else timeout
+            expected_responses = expected_responses or 1
+        pending = PendingRequest(transaction_id, message_id, action, timeout, expected_responses)
+        with self._lock:
+            self._pending[message_id] = pending
+            self.counters["expected"] += 1
+        return pending
+
+    def expect_payload(self, payload, **kwargs):
+        return self.expect(payload.transaction_id, payload.message_id, payload.action, **kwargs)
+
+    def deliver(self, action, body):
+        """
+        Hands one callback body to the request waiting for it. Returns "matched", "late" or
+        "unmatched".
+        """
+        context = body.get("context") or {}
+        message_id = context.get("message_id")
+        with self._lock:
+            pending = self._pending.get(message_id)
+            known = message_id in self._recent_ids
+        if (pending is not None and pending.transaction_id == context.get("transaction_id")
+                and pending.callback_action == action):
+            outcome = "matched" if pending.add(body) else "late"
+        else:
+            outcome = "late" if known else "unmatched"
+        with self._lock:
+            self.counters[outcome] += 1
+        metrics.increment("beckn_callbacks_total", action=action, outcome=outcome)
+        return outcome
+
+    def discard(self, pending):
+        with self._lock:
+            if self._pending.get(pending.message_id) is pending:
+                del self._pending[pending.message_id]
+                if len(self._recent) == self._recent.maxlen:
+                    self._recent_ids.discard(self._recent[0])
+                self._recent.append(pending.message_id)
+                self._recent_ids.add(pending.message_id)
+
+    def _record_timeout(self, pending):
+        if not pending.responses:
+            with self._lock:
+                self.counters["timed_out"] += 1
+            metrics.increment("beckn_callbacks_total", action=pending.callback_action, outcome="timed_out")
+
+    def wait(self, pending):
+        """
+        Blocks until `pending` completes, unregisters it and returns its result.
+        """
+        try:
+            return pending.wait()
+        finally:
+            self.discard(pending)
+            self._record_timeout(pending)
+
+    async def wait_async(self, pending):
+        try:
+            return await pending.wait_async()
+        finally:
+            self.discard(pending)
+            self._record_timeout(pending)
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "pending": len(self._pending)}
+
+
+_callback_registry = None
+_callback_registry_lock = threading.Lock()
+
+
+def get_callback_registry():
+    """
+    Process-wide registry shared by the Flask /beckn/on_* routes and the Beckn clients.
+    """
+    global _callback_registry
+    if _callback_registry is None:
+        with _callback_registry_lock:
+            if _callback_registry is None:
+                _callback_registry = CallbackRegistry()
+    return _callback_registry
+
+
+def callback_registry_from_env():
+    """
+    The shared registry when BECKN_CALLBACK_MODE is on, otherwise None (plain request/response).
+    """
+    return get_callback_registry() if BECKN_CALLBACK_MODE else None
@@ -0,0 +1,75 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Independent catalog searches of a full adoption journey: name -> (BecknClient search method, domain, descriptor)
+DISCOVERY_SEARCHES = {
+    "solar_retail": ("search_solar_retail", "deg:retail", "solar"),
+    "solar_service": ("search_solar_service", "deg:service", "resi"),
+    "subsidy": ("search_subsidy", "deg:schemes", "incentive"),
+    "dfp": ("search_dfp", "deg:schemes", "Program"),
+    "connection": ("search_connection", "deg:service", "Connection"),
+}
+
+DISCOVERY_MAX_WORKERS = int(os.getenv("DISCOVERY_MAX_WORKERS", str(len(DISCOVERY_SEARCHES))))
+
+
+def normalize_catalog(name, response):
+    """
+    Flattens one /search response into a list of items, each tagged with its search name and domain
+    and carrying its provider. Handles both a flat catalog.items list and items nested under
+    catalog.providers[].items.
+    """
+    domain = DISCOVERY_SEARCHES[name][1] if name in DISCOVERY_SEARCHES else None
+    catalog = ((response or {}).get("message") or {}).get("catalog") or {}
+    providers = catalog.get("providers") or []
+    items = []
+    for item in catalog.get("items") or []:
+        items.append({**item, "category": name, "domain": domain})
+    for provider in providers:
+        provider_ref = {key: value for key, value in provider.items() if key != "items"}
+        for item in provider.get("items") or []:
+            items.append({**item, "provider": item.get("provider") or provider_ref, "category": name, "domain": domain})
+    return items
+
+
+def merge_catalogs(responses):
+    """
+    Merges {search name: /search response or exception} into one normalized catalog:
+
+        {
+            "catalogs": {name: raw response},      # successful searches only
+            "items": [...],                         # normalize_catalog() of every successful search
+            "items_by_category": {name: [...]},
+            "errors": {name: "message"},            # failed searches
+        }
+    """
+    merged = {"catalogs": {}, "items": [], "items_by_category": {}, "errors": {}}
+    for name, response in responses.items():
+        if isinstance(response, Exception):
+            merged["errors"][name] = f"{type(response).__name__}: {response}"
+            continue
+        if isinstance(response, dict) and "error" in response:
+            merged["errors"][name] = str(response["error"])
+            continue
+        items = normalize_catalog(name, response)
+        merged["catalogs"][name] = response
+        merged["items_by_category"][name] = items
+        merged["items"].extend(items)
+    return merged
+
+
+_discovery_executor = None
+_discovery_executor_lock = threading.Lock()
+
+
+def get_discovery_executor():
+    """
+    Thread pool shared by every discovery fan-out in the process, created on first use.
+    """
+    global _discovery_executor
+    if _discovery_executor is None:
+        with _discovery_executor_lock:
+            if _discovery_executor is None:
+                _discovery_executor = ThreadPoolExecutor(max_workers=DISCOVERY_MAX_WORKERS, thread_name_prefix="beckn_discovery")
+    return _discovery_executor
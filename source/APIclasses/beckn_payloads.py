@@ -0,0 +1,177 @@
+import json
+import os
+import time
+import uuid
+
+from source.APIclasses.catalog_cache import catalog_key
+
+try:
+    import orjson
+except ImportError: # orjson is optional, the stdlib encoder is only slower
+    orjson = None
+
+DEFAULT_COUNTRY_CODE = "USA"
+DEFAULT_CITY_CODE = "NANP:628"
+BECKN_VERSION = "1.1.0"
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def _dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def _loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+_timestamp_second = (None, "")
+
+
+def beckn_timestamp(now=None) -> str:
+    """
+    UTC RFC 3339 timestamp with milliseconds, e.g. "2025-05-20T10:15:30.123Z". The part up to the
+    seconds is formatted once per second and reused.
+    """
+    global _timestamp_second
+    now = time.time() if now is None else now
+    second = int(now)
+    cached_second, prefix = _timestamp_second
+    if cached_second != second:
+        prefix = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+        _timestamp_second = (second, prefix)
+    return f"{prefix}.{int((now - second) * 1000):03d}Z"
+
+
+def new_message_ids():
+    """
+    (transaction_id, message_id) as UUID4 strings drawn from a single os.urandom call.
+    """
+    raw = os.urandom(32)
+    return str(uuid.UUID(bytes=raw[:16], version=4)), str(uuid.UUID(bytes=raw[16:], version=4))
+
+
+class BecknPayload:
+    """
+    A serialized Beckn request body plus what is needed to route, label and cache it without
+    parsing the body again.
+    """
+
+    __slots__ = ("domain", "action", "body", "transaction_id", "message_id", "cache_key")
+
+    def __init__(self, domain, action, body, transaction_id, message_id, cache_key=None):
+        self.domain = domain
+        self.action = action
+        self.body = body
+        self.transaction_id = transaction_id
+        self.message_id = message_id
+        self.cache_key = cache_key
+
+    def as_dict(self):
+        return _loads(self.body)
+
+
+class BecknPayloadBuilder:
+    """
+    Builds Beckn request bodies from templates serialized once per (domain, action, city): only the
+    transaction/message ids, the timestamp and the message are spliced in per call. Search intents
+    are fully static and serialized once as well.
+    """
+
+    def __init__(self, bap_id, bap_uri, bpp_id, bpp_uri, version=BECKN_VERSION, country_code=DEFAULT_COUNTRY_CODE):
+        """
+        Args:
+            bap_id (str): Beckn Application Platform ID.
+            bap_uri (str): Beckn Application Platform URI.
+            bpp_id (str): Beckn Provider Platform ID.
+            bpp_uri (str): Beckn Provider Platform URI.
+            version (str): Beckn core version sent in every context.
+            country_code (str): Country code of the context location.
+        """
+        self.bap_id = bap_id
+        self.bap_uri = bap_uri
+        self.bpp_id = bpp_id
+        self.bpp_uri = bpp_uri
+        self.version = version
+        self.country_code = country_code
+        self._context_prefixes = {} # (domain, action, city_code) -> bytes up to the transaction_id value
+        self._search_messages = {} # (descriptor, item_intent) -> serialized intent
+
+    def _context_prefix(self, domain, action, city_code):
+        key = (domain, action, city_code)
+        prefix = self._context_prefixes.get(key)
+        if prefix is None:
+            location = {"country": {"code": self.country_code}}
+            if city_code:
+                location["city"] = {"code": city_code}
+            context = {
+                "domain": domain,
+                "action": action,
+                "location": location,
+                "version": self.version,
+                "bap_id": self.bap_id,
+                "bap_uri": self.bap_uri,
+                "bpp_id": self.bpp_id,
+                "bpp_uri": self.bpp_uri,
+            }
+            # Drop the closing brace so the per-call fields can be appended
+            prefix = b'{"context":' + _dumps(context)[:-1] + b',"transaction_id":"'
+            self._context_prefixes[key] = prefix
+        return prefix
+
+    def build(self, domain, action, message, city_code=DEFAULT_CITY_CODE, cache_key=None):
+        """
+        Returns a BecknPayload for `message`, which may be a dict or already serialized bytes.
+        """
+        transaction_id, message_id = new_message_ids()
+        body = b"".join((
+            self._context_prefix(domain, action, city_code),
+            transaction_id.encode(),
+            b'","message_id":"',
+            message_id.encode(),
+            b'","timestamp":"',
+            beckn_timestamp().encode(),
+            b'"},"message":',
+            message if isinstance(message, bytes) else _dumps(message),
+            b"}",
+        ))
+        return BecknPayload(domain, action, body, transaction_id, message_id, cache_key)
+
+    def search(self, domain, descriptor, city_code=DEFAULT_CITY_CODE, item_intent=True):
+        """
+        Search by intent descriptor name; `item_intent=False` puts the descriptor directly on the
+        intent instead of on intent.item. The payload carries its catalog cache key.
+        """
+        key = (descriptor, item_intent)
+        message = self._search_messages.get(key)
+        if message is None:
+            intent = {"descriptor": {"name": descriptor}}
+            message = self._search_messages[key] = _dumps({"intent": {"item": intent} if item_intent else intent})
+        cache_key = catalog_key(domain, descriptor, (self.country_code, city_code))
+        return self.build(domain, "search", message, city_code, cache_key=cache_key)
+
+    def order(self, domain, action, provider_id, item_id, city_code=DEFAULT_CITY_CODE):
+        """select / init: one item of one provider."""
+        message = {"order": {"provider": {"id": provider_id}, "items": [{"id": item_id}]}}
+        return self.build(domain, action, message, city_code)
+
+    def confirm(self, domain, provider_id, item_id, fulfillment_id, customer_name, customer_phone, customer_email,
+                city_code=DEFAULT_CITY_CODE):
+        message = {"order": {
+            "provider": {"id": provider_id},
+            "items": [{"id": item_id}],
+            "fulfillments": [{
+                "id": fulfillment_id,
+                "customer": {
+                    "person": {"name": customer_name},
+                    "contact": {"phone": customer_phone, "email": customer_email},
+                },
+            }],
+        }}
+        return self.build(domain, "confirm", message, city_code)
+
+    def status(self, domain, order_id, city_code=DEFAULT_CITY_CODE):
+        return self.build(domain, "status", {"order_id": order_id}, city_code)
@@ -0,0 +1,203 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+FRESH = "fresh"
+STALE = "stale"
+MISS = "miss"
+
+
+def catalog_key(domain, descriptor, location=None):
+    """
+    Cache key for a Beckn search: (domain, intent descriptor name, location).
+
+    Args:
+        domain (str): Beckn domain, e.g. "deg:retail".
+        descriptor (str): Intent descriptor name, e.g. "solar".
+        location (tuple): (country code, city code); city code may be None.
+    """
+    return (domain, descriptor, tuple(location) if location else None)
+
+
+def is_cacheable(result):
+    return isinstance(result, dict) and 'error' not in result
+
+
+class CatalogCache:
+    """
+    Shared TTL + LRU cache for Beckn search catalogs with stale-while-revalidate.
+
+    An entry younger than `ttl` is served as-is. Between `ttl` and `ttl + stale_ttl` it is
+    still served, but a single background refresh is started for the key. Older entries are
+    misses. Concurrent misses for the same key share one fetch. Cached catalogs are shared
+    between sessions and must be treated as read-only.
+    """
+
+    def __init__(self, ttl=300.0, stale_ttl=600.0, max_entries=256, refresh_workers=2):
+        """
+        Args:
+            ttl (float): Seconds an entry is considered fresh.
+            stale_ttl (float): Extra seconds a stale entry may be served while it is refreshed.
+            max_entries (int): Size bound; least recently used entries are evicted first.
+                               0 disables caching.
+            refresh_workers (int): Threads used for background revalidation.
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        self._inflight = {} # key -> threading.Event for single-flight misses
+        self._refreshing = set()
+        self._refresh_executor = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="catalog_refresh")
+        self.counters = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "refresh_errors": 0, "evictions": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            ttl=float(os.getenv("CATALOG_CACHE_TTL", "300")),
+            stale_ttl=float(os.getenv("CATALOG_CACHE_STALE_TTL", "600")),
+            max_entries=int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", "256")),
+        )
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def lookup(self, key):
+        """
+        Returns (value, status) where status is FRESH, STALE or MISS, updating the counters.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = now - entry[0]
+                if age < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return entry[1], FRESH
+                if age < self.ttl + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    self.counters["stale_hits"] += 1
+                    return entry[1], STALE
+                del self._entries[key]
+            self.counters["misses"] += 1
+            return None, MISS
+
+    def store(self, key, value):
+        if not self.enabled or not is_cacheable(value):
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def begin_refresh(self, key):
+        """
+        Marks a background refresh for `key` as started. Returns False if one is already running.
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            self.counters["refreshes"] += 1
+            return True
+
+    def end_refresh(self, key, value=None, error=None):
+        if error is None:
+            self.store(key, value)
+        else:
+            print(f"Catalog refresh failed for {key}: {error}")
+        with self._lock:
+            self._refreshing.discard(key)
+            if error is not None:
+                self.counters["refresh_errors"] += 1
+
+    def _refresh(self, key, fetch):
+        try:
+            value = fetch()
+        except Exception as e:
+            self.end_refresh(key, error=e)
+        else:
+            self.end_refresh(key, value)
+
+    def get_or_fetch(self, key, fetch):
+        """
+        Returns the cached catalog for `key`, calling `fetch()` on a miss. Exceptions raised by
+        `fetch` propagate to the caller; results containing an 'error' key are never cached.
+        """
+        if not self.enabled:
+            return fetch()
+
+        while True:
+            value, status = self.lookup(key)
+            if status == FRESH:
+                return value
+            if status == STALE:
+                if self.begin_refresh(key):
+                    self._refresh_executor.submit(self._refresh, key, fetch)
+                return value
+
+            with self._lock:
+                event = self._inflight.get(key)
+                if event is None:
+                    event = threading.Event()
+                    self._inflight[key] = event
+                    leader = True
+                else:
+                    leader = False
+            if leader:
+                break
+            # Another thread is already fetching this key; wait for it and look again
+            event.wait()
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None:
+                return entry[1]
+            # The leader's fetch failed or was not cacheable, fetch ourselves
+            return fetch()
+
+        try:
+            value = fetch()
+            self.store(key, value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def invalidate(self, key=None):
+        """
+        Drops one key, or every entry when `key` is None.
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "entries": len(self._entries), "max_entries": self.max_entries,
+                    "ttl": self.ttl, "stale_ttl": self.stale_ttl}
+
+
+_shared_catalog_cache = None
+_shared_catalog_cache_lock = threading.Lock()
+
+
+def get_catalog_cache():
+    """
+    Return the process-wide catalog cache, creating it from the environment on first use.
+    """
+    global _shared_catalog_cache
+    if _shared_catalog_cache is None:
+        with _shared_catalog_cache_lock:
+            if _shared_catalog_cache is None:
+                _shared_catalog_cache = CatalogCache.from_env()
+    return _shared_catalog_cache
@@ -0,0 +1,251 @@
+import numpy as np
+
+LEVELS = ("transformer", "substation", "utility", "total")
+
+
+def _parse_timestamps(timestamps):
+    # numpy rejects the trailing "Z"; the values are UTC either way
+    return np.array([t[:-1] if t.endswith("Z") else t for t in timestamps], dtype="datetime64[ms]")
+
+
+def _format_time(value):
+    return np.datetime_as_string(value, unit="s") + "Z"
+
+
+def _group_sum(values, offsets, group_count):
+    """
+    Sums consecutive row blocks of `values`: block g is rows offsets[g]:offsets[g + 1]. Empty blocks
+    sum to 0 (np.add.reduceat alone would return the next row for them).
+    """
+    out = np.zeros((group_count,) + values.shape[1:], dtype=values.dtype)
+    sizes = np.diff(offsets)
+    non_empty = sizes > 0
+    if values.shape[0] and non_empty.any():
+        out[non_empty] = np.add.reduceat(values, offsets[:-1][non_empty], axis=0)
+    return out
+
+
+class GridLoads:
+    """
+    Columnar view of the World Engine /grid-loads payload: one row per transformer, one column per
+    timestamp, with transformers stored in tree order so every substation and utility is a
+    contiguous block of rows. Roll-ups, peaks and headroom are computed with whole-array NumPy
+    operations, so thousands of nodes take milliseconds.
+
+        grid = GridLoads.from_payload(world_engine.get_grid_loads())
+        grid.peaks("substation")
+        grid.peak_windows("transformer", threshold=0.9)
+    """
+
+    def __init__(self, timestamps, loads_kw, capacity_kw, meter_count, transformer_ids,
+                 substation_ids, substation_offsets, utility_ids, utility_offsets):
+        """
+        Args:
+            timestamps (np.ndarray): datetime64 time axis, shape (steps,).
+            loads_kw (np.ndarray): Transformer loads, shape (transformers, steps); NaN where missing.
+            capacity_kw (np.ndarray): Transformer capacities, shape (transformers,).
+            meter_count (np.ndarray): Meters per transformer, shape (transformers,).
+            transformer_ids (np.ndarray): Transformer ids in row order.
+            substation_ids (np.ndarray): Substation ids in tree order.
+            substation_offsets (np.ndarray): First transformer row of each substation, plus the row count.
+            utility_ids (np.ndarray): Utility ids in tree order.
+            utility_offsets (np.ndarray): First substation of each utility, plus the substation count.
+        """
+        self.timestamps = timestamps
+        self.loads_kw = loads_kw
+        self.capacity_kw = capacity_kw
+        self.meter_count = meter_count
+        self.transformer_ids = transformer_ids
+        self.substation_ids = substation_ids
+        self.substation_offsets = substation_offsets
+        self.utility_ids = utility_ids
+        self.utility_offsets = utility_offsets
+        self._rollups = {}
+
+    @classmethod
+    def from_payload(cls, payload):
+        """
+        Builds the arrays from {"timestamps": [...], "utilities": [{"id", "substations": [{"id",
+        "transformers": [{"id", "capacity_kw", "meter_count", "loads_kw": [...]}]}]}]}.
+        Series shorter than the time axis are padded with NaN.
+        """
+        timestamps = _parse_timestamps(payload.get("timestamps") or [])
+        steps = len(timestamps)
+        rows, capacities, meters, transformer_ids = [], [], [], []
+        substation_ids, substation_offsets, utility_ids, utility_offsets = [], [], [], []
+        for utility in payload.get("utilities") or []:
+            utility_ids.append(utility.get("id"))
+            utility_offsets.append(len(substation_ids))
+            for substation in utility.get("substations") or []:
+                substation_ids.append(substation.get("id"))
+                substation_offsets.append(len(transformer_ids))
+                for transformer in substation.get("transformers") or []:
+                    transformer_ids.append(transformer.get("id"))
+                    capacities.append(transformer.get("capacity_kw") or np.nan)
+                    meters.append(transformer.get("meter_count") or 0)
+                    rows.append(transformer.get("loads_kw") or [])
+        substation_offsets.append(len(transformer_ids))
+        utility_offsets.append(len(substation_ids))
+
+        if rows and all(len(row) == steps for row in rows):
+            loads = np.array(rows, dtype=np.float64).reshape(len(rows), steps)
+        else:
+            loads = np.full((len(rows), steps), np.nan)
+            for index, row in enumerate(rows):
+                row = row[:steps]
+                loads[index, :len(row)] = np.asarray(row, dtype=np.float64)
+        return cls(
+            timestamps=timestamps,
+            loads_kw=loads,
+            capacity_kw=np.array(capacities, dtype=np.float64),
+            meter_count=np.array(meters, dtype=np.int64),
+            transformer_ids=np.array(transformer_ids),
+            substation_ids=np.array(substation_ids),
+            substation_offsets=np.array(substation_offsets, dtype=np.int64),
+            utility_ids=np.array(utility_ids),
+            utility_offsets=np.array(utility_offsets, dtype=np.int64),
+        )
+
+    # --- Roll-ups ---
+
+    def rollup(self, level="substation"):
+        """
+        Returns (ids, loads_kw, capacity_kw) for `level`: transformer, substation, utility or total.
+        Missing samples count as 0 kW in sums. Results are cached; the arrays are read-only.
+        """
+        if level not in LEVELS:
+            raise ValueError(f"Unknown level '{level}', expected one of {LEVELS}")
+        cached = self._rollups.get(level)
+        if cached is not None:
+            return cached
+        if level == "transformer":
+            result = (self.transformer_ids, self.loads_kw, self.capacity_kw)
+        elif level == "total":
+            loads, capacity = self._substation_sums()
+            result = (np.array(["total"]), loads.sum(axis=0, keepdims=True), capacity.sum(keepdims=True))
+        else:
+            loads, capacity = self._substation_sums()
+            if level == "utility":
+                loads = _group_sum(loads, self.utility_offsets, len(self.utility_ids))
+                capacity = _group_sum(capacity, self.utility_offsets, len(self.utility_ids))
+            result = (self.substation_ids if level == "substation" else self.utility_ids, loads, capacity)
+        for array in result[1:]:
+            array.flags.writeable = False
+        self._rollups[level] = result
+        return result
+
+    def _substation_sums(self):
+        cached = self._rollups.get("_substation_sums")
+        if cached is None:
+            loads = _group_sum(np.nan_to_num(self.loads_kw), self.substation_offsets, len(self.substation_ids))
+            capacity = _group_sum(np.nan_to_num(self.capacity_kw), self.substation_offsets, len(self.substation_ids))
+            cached = self._rollups["_substation_sums"] = (loads, capacity)
+        return cached
+
+    def utilization(self, level="transformer"):
+        """
+        Load divided by capacity, shape (nodes, steps). NaN where the capacity is unknown.
+        """
+        _, loads, capacity = self.rollup(level)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return loads / np.where(capacity > 0, capacity, np.nan)[:, None]
+
+    def headroom(self, level="transformer"):
+        """
+        Spare capacity in kW at every step, shape (nodes, steps); negative when overloaded.
+        """
+        _, loads, capacity = self.rollup(level)
+        return capacity[:, None] - loads
+
+    def min_headroom(self, level="transformer"):
+        """
+        Smallest spare capacity of each node over the whole time axis (capacity - peak), shape (nodes,).
+        """
+        capacity = self.rollup(level)[2]
+        return capacity - self.peaks(level)["peak_kw"]
+
+    # --- Peaks ---
+
+    def peaks(self, level="transformer"):
+        """
+        Peak of every node: {"ids", "peak_kw", "peak_index", "peak_time", "peak_utilization"}.
+        """
+        ids, loads, capacity = self.rollup(level)
+        filled = np.where(np.isnan(loads), -np.inf, loads)
+        peak_index = filled.argmax(axis=1) if loads.shape[1] else np.zeros(len(ids), dtype=np.int64)
+        peak_kw = filled[np.arange(len(ids)), peak_index] if loads.shape[1] else np.full(len(ids), np.nan)
+        peak_kw = np.where(np.isneginf(peak_kw), np.nan, peak_kw) # nodes without any sample
+        with np.errstate(divide="ignore", invalid="ignore"):
+            peak_utilization = peak_kw / np.where(capacity > 0, capacity, np.nan)
+        return {
+            "ids": ids,
+            "peak_kw": peak_kw,
+            "peak_index": peak_index,
+            "peak_time": self.timestamps[peak_index] if len(self.timestamps) else np.array([], dtype="datetime64[ms]"),
+            "peak_utilization": peak_utilization,
+        }
+
+    def peak_windows(self, level="transformer", threshold=0.9):
+        """
+        Contiguous runs of steps where utilization >= threshold, i.e. the windows in which DERs
+        behind the node should be switched. Returns dicts with node id, start/end time (end is the
+        last step inside the run), steps and peak kW, sorted by start time.
+        """
+        ids, loads, _ = self.rollup(level)
+        hot = np.nan_to_num(self.utilization(level), nan=0.0) >= threshold
+        if not hot.size:
+            return []
+        padded = np.zeros((hot.shape[0], hot.shape[1] + 2), dtype=np.int8)
+        padded[:, 1:-1] = hot
+        edges = np.diff(padded, axis=1)
+        nodes, starts = np.nonzero(edges == 1)
+        _, ends = np.nonzero(edges == -1) # same row-major order as the starts
+        if not len(nodes):
+            return []
+        # Window peaks in one pass: fmax-reduce the flattened loads over [start, end) index pairs
+        steps = loads.shape[1]
+        flat = np.append(loads.ravel(), -np.inf) # pad so an end at the very last sample stays a valid index
+        bounds = np.empty(2 * len(nodes), dtype=np.int64)
+        bounds[0::2] = nodes * steps + starts
+        bounds[1::2] = nodes * steps + ends
+        window_peaks = np.fmax.reduceat(flat, bounds)[0::2]
+        order = np.argsort(starts, kind="stable")
+        start_times = np.datetime_as_string(self.timestamps[starts[order]], unit="s")
+        end_times = np.datetime_as_string(self.timestamps[ends[order] - 1], unit="s")
+        return [
+            {"id": node_id, "start": start + "Z", "end": end + "Z", "steps": length, "peak_kw": peak}
+            for node_id, start, end, length, peak in zip(
+                ids[nodes[order]].tolist(), start_times.tolist(), end_times.tolist(),
+                (ends - starts)[order].tolist(), window_peaks[order].tolist())
+        ]
+
+    def most_constrained(self, level="transformer", limit=10):
+        """
+        The `limit` nodes with the least minimum headroom, as [{"id", "min_headroom_kw", "peak_kw", "peak_time"}].
+        """
+        ids = self.rollup(level)[0]
+        headroom = self.min_headroom(level)
+        peaks = self.peaks(level)
+        order = np.argsort(headroom, kind="stable")[:limit]
+        return [{
+            "id": ids[index].item(),
+            "min_headroom_kw": float(headroom[index]),
+            "peak_kw": float(peaks["peak_kw"][index]),
+            "peak_time": _format_time(peaks["peak_time"][index]) if not np.isnan(peaks["peak_kw"][index]) else None,
+        } for index in order]
+
+    def summary(self, threshold=0.9, limit=5):
+        """
+        JSON-friendly overview: sizes, system peak and the most constrained transformers.
+        """
+        total_peak = self.peaks("total")
+        return {
+            "transformers": len(self.transformer_ids),
+            "substations": len(self.substation_ids),
+            "utilities": len(self.utility_ids),
+            "steps": len(self.timestamps),
+            "system_peak_kw": float(total_peak["peak_kw"][0]) if len(self.timestamps) else None,
+            "system_peak_time": _format_time(total_peak["peak_time"][0]) if len(self.timestamps) else None,
+            "transformers_over_threshold": int((np.nan_to_num(self.utilization("transformer"), nan=0.0) >= threshold).any(axis=1).sum()),
+            "most_constrained_transformers": self.most_constrained("transformer", limit),
+        }
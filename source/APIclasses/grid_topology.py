@@ -0,0 +1,238 @@
+import asyncio
+import threading
+import weakref
+
+from source.APIclasses.spatial_index import DEFAULT_TRANSFORMER_MAX_METERS, TransformerSpatialIndex, coordinates_of
+
+
+class GridTopology:
+    """
+    Indexed, read-mostly view of the World Engine utility -> substation -> transformer (-> meter) tree
+    returned by /utility/detailed. All lookups are dict lookups.
+    """
+
+    def __init__(self, payload):
+        self.raw = payload
+        self.utilities = (payload or {}).get('utilities') or []
+        self.substations_by_id = {}
+        self.transformers_by_id = {}
+        self.transformers_by_substation = {} # substation id -> [transformer, ...]
+        self.meters_by_transformer = {} # transformer id -> [meter, ...]
+        self.substation_of_transformer = {} # transformer id -> substation id
+        self.utility_of_substation = {} # substation id -> utility id
+        self.first_transformer_id = None
+        self._default_cursor = 0 # transformers before this position in transformers_by_id are full
+        self._spatial_index = None
+        self._lock = threading.Lock()
+        self._placement_lock = threading.Lock() # choosing a parent and taking its seat is one step
+
+        for utility in self.utilities:
+            for substation in utility.get('substations') or []:
+                substation_id = substation.get('id')
+                self.substations_by_id[substation_id] = substation
+                self.utility_of_substation[substation_id] = utility.get('id')
+                transformers = self.transformers_by_substation.setdefault(substation_id, [])
+                for transformer in substation.get('transformers') or []:
+                    transformer_id = transformer.get('id')
+                    if transformer_id is None:
+                        continue
+                    if self.first_transformer_id is None:
+                        self.first_transformer_id = transformer_id
+                    transformers.append(transformer)
+                    self.transformers_by_id[transformer_id] = transformer
+                    self.substation_of_transformer[transformer_id] = substation_id
+                    self.meters_by_transformer[transformer_id] = list(transformer.get('meters') or [])
+        self.transformer_ids = list(self.transformers_by_id) # tree order
+
+    def transformer(self, transformer_id):
+        return self.transformers_by_id.get(transformer_id)
+
+    def transformers_in_substation(self, substation_id):
+        return self.transformers_by_substation.get(substation_id, [])
+
+    def meters_on_transformer(self, transformer_id):
+        return self.meters_by_transformer.get(transformer_id, [])
+
+    def default_parent_transformer_id(self):
+        """
+        Parent used for a new meter when nothing better is known: the first transformer of the tree
+        that still has headroom, or None when every transformer is at capacity.
+        """
+        # Transformers before the cursor were full when last scanned. release_meter() frees a seat and
+        # moves the cursor back to 0, so the scan runs under the lock or it could undo that reset.
+        with self._lock:
+            cursor = self._default_cursor
+            while cursor < len(self.transformer_ids):
+                transformer_id = self.transformer_ids[cursor]
+                if self.headroom(transformer_id) > 0:
+                    self._default_cursor = cursor
+                    return transformer_id
+                cursor += 1
+            self._default_cursor = cursor
+            return None
+
+    def capacity_of(self, transformer_id):
+        transformer = self.transformers_by_id.get(transformer_id) or {}
+        max_meters = transformer.get('max_meters')
+        return DEFAULT_TRANSFORMER_MAX_METERS if max_meters is None else max_meters
+
+    def headroom(self, transformer_id):
+        """
+        Number of additional meters the transformer can take.
+        """
+        return self.capacity_of(transformer_id) - len(self.meters_by_transformer.get(transformer_id, []))
+
+    @property
+    def spatial_index(self):
+        """
+        k-d tree over transformer positions, built on first use. Transformers without their own
+        coordinates are placed at their substation's position; ones with neither are left out.
+        """
+        if self._spatial_index is None:
+            with self._lock:
+                if self._spatial_index is None:
+                    entries = []
+                    for transformer_id, transformer in self.transformers_by_id.items():
+                        position = coordinates_of(transformer)
+                        if position is None:
+                            substation = self.substations_by_id.get(self.substation_of_transformer.get(transformer_id)) or {}
+                            position = coordinates_of(substation)
+                        if position is not None:
+                            entries.append((transformer_id, position[0], position[1]))
+                    self._spatial_index = TransformerSpatialIndex(entries)
+        return self._spatial_index
+
+    def nearest_transformer_id(self, latitude, longitude):
+        """
+        ID of the nearest transformer to (latitude, longitude) that still has headroom, or None.
+        """
+        transformer_id, _ = self.spatial_index.nearest(latitude, longitude, accept=lambda t: self.headroom(t) > 0)
+        return transformer_id
+
+    def record_meter(self, transformer_id, meter):
+        """
+        Registers a meter created after the topology was loaded, keeping meters_by_transformer current.
+        """
+        with self._lock:
+            self.meters_by_transformer.setdefault(transformer_id, []).append(meter)
+
+    def reserve_meter(self, seat, latitude=None, longitude=None):
+        """
+        Picks the parent for a new meter and records `seat` on it in one step, so concurrent callers
+        never overfill a transformer: the nearest transformer with headroom to (latitude, longitude),
+        else the first one with headroom. Returns the transformer ID, or None when all are full.
+        Swap the seat for the created meter with replace_meter(), or free it with release_meter().
+        """
+        with self._placement_lock:
+            transformer_id = None
+            if latitude is not None and longitude is not None:
+                transformer_id = self.nearest_transformer_id(latitude, longitude)
+            if transformer_id is None:
+                transformer_id = self.default_parent_transformer_id()
+            if transformer_id is not None:
+                self.record_meter(transformer_id, seat)
+            return transformer_id
+
+    def replace_meter(self, transformer_id, seat, meter):
+        """
+        Replaces a seat taken with reserve_meter() by the created meter; records the meter if there is no such seat.
+        """
+        with self._lock:
+            meters = self.meters_by_transformer.setdefault(transformer_id, [])
+            for index, recorded in enumerate(meters):
+                if recorded is seat:
+                    meters[index] = meter
+                    return
+            meters.append(meter)
+
+    def release_meter(self, transformer_id, meter):
+        """
+        Drops a meter recorded with record_meter(), e.g. a seat reserved for a meter whose creation failed.
+        """
+        with self._lock:
+            meters = self.meters_by_transformer.get(transformer_id, [])
+            for index, recorded in enumerate(meters):
+                if recorded is meter:
+                    del meters[index]
+                    self._default_cursor = 0 # the transformer may have headroom again
+                    return
+
+
+class TopologyCache:
+    """
+    Process-wide cache of the World Engine topology: loaded once, shared by every session and
+    thread, and dropped by invalidate() (called when the World Engine data is reset).
+    """
+
+    def __init__(self):
+        self._topology = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._async_locks = weakref.WeakKeyDictionary() # event loop -> asyncio.Lock for aget()
+        self._async_locks_lock = threading.Lock()
+
+    def get(self, fetch, refresh=False):
+        """
+        Returns the cached GridTopology, calling `fetch()` for the raw payload if none is loaded.
+        """
+        topology = self._topology
+        if topology is not None and not refresh:
+            return topology
+        with self._lock:
+            if self._topology is not None and not refresh:
+                return self._topology
+            generation = self._generation
+            topology = GridTopology(fetch())
+            # Only publish if nobody invalidated while we were downloading
+            if generation == self._generation:
+                self._topology = topology
+            return topology
+
+    def _async_lock(self):
+        # asyncio locks belong to one event loop, so there is one per loop using this cache
+        loop = asyncio.get_running_loop()
+        with self._async_locks_lock:
+            lock = self._async_locks.get(loop)
+            if lock is None:
+                lock = self._async_locks[loop] = asyncio.Lock()
+            return lock
+
+    async def aget(self, fetch, refresh=False):
+        """
+        Async variant of get(): `fetch()` returns an awaitable. Like get(), only one caller (per
+        event loop) downloads the topology; the others wait for it and share the result.
+        """
+        topology = self._topology
+        if topology is not None and not refresh:
+            return topology
+        async with self._async_lock():
+            if self._topology is not None and not refresh:
+                return self._topology
+            generation = self._generation
+            topology = GridTopology(await fetch())
+            if generation == self._generation:
+                self._topology = topology
+            return topology
+
+    def peek(self):
+        return self._topology
+
+    def invalidate(self):
+        self._generation += 1
+        self._topology = None
+
+
+_topology_caches = {}
+_topology_caches_lock = threading.Lock()
+
+
+def get_topology_cache(base_url):
+    """
+    Return the shared topology cache for a World Engine base URL.
+    """
+    with _topology_caches_lock:
+        cache = _topology_caches.get(base_url)
+        if cache is None:
+            cache = TopologyCache()
+            _topology_caches[base_url] = cache
+        return cache
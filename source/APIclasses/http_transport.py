@@ -0,0 +1,276 @@
+import asyncio
+import os
+import threading
+import weakref
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from source.metrics import metrics
+
+
+def _endpoint_label(url):
+    # First path segment only ("/meters/12" -> "meters") to keep label cardinality bounded
+    path = urlsplit(url).path.strip("/")
+    return path.split("/", 1)[0] or "/"
+
+
+class HttpTransport:
+    """
+    Connection-pooled, keep-alive HTTP transport shared by the Beckn and World Engine clients.
+
+    A single requests.Session is reused across sessions and threads so repeated calls to the
+    same host skip the TCP+TLS handshake.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=20, pool_block=False,
+                 connect_timeout=3.05, read_timeout=30.0, keep_alive=True, max_retries=0):
+        """
+        Args:
+            pool_connections (int): Number of per-host connection pools to keep cached.
+            pool_maxsize (int): Maximum number of kept-alive connections per host.
+            pool_block (bool): Whether to block when a host's pool is exhausted instead of
+                               opening (and then discarding) an extra connection.
+            connect_timeout (float): Seconds to wait for a connection to be established.
+            read_timeout (float): Seconds to wait for the server to send a response.
+            keep_alive (bool): Whether to keep connections open between requests.
+            max_retries (int): Retries for failed connection attempts (never for reads).
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.timeout = (connect_timeout, read_timeout)
+        self.keep_alive = keep_alive
+
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            max_retries=max_retries,
+        )
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+
+        self._stats_lock = threading.Lock()
+        self._requests_by_host = {}
+        self._errors_by_host = {}
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build a transport from HTTP_POOL_* / HTTP_*_TIMEOUT environment variables.
+        """
+        return cls(
+            pool_connections=int(os.getenv("HTTP_POOL_CONNECTIONS", "10")),
+            pool_maxsize=int(os.getenv("HTTP_POOL_MAXSIZE", "20")),
+            pool_block=os.getenv("HTTP_POOL_BLOCK", "false").lower() == "true",
+            connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05")),
+            read_timeout=float(os.getenv("HTTP_READ_TIMEOUT", "30")),
+            keep_alive=os.getenv("HTTP_KEEP_ALIVE", "true").lower() == "true",
+            max_retries=int(os.getenv("HTTP_MAX_RETRIES", "0")),
+        )
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request through the pooled session, applying the default timeouts.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlsplit(url).netloc
+        with self._stats_lock:
+            self._requests_by_host[host] = self._requests_by_host.get(host, 0) + 1
+        try:
+            with metrics.timed("http_request_seconds", host=host, method=method, endpoint=_endpoint_label(url)):
+                response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            with self._stats_lock:
+                self._errors_by_host[host] = self._errors_by_host.get(host, 0) + 1
+            raise
+        metrics.increment("http_responses_total", host=host, status=response.status_code)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def stats(self):
+        """
+        Pool statistics for sizing: configuration, per-host request/error counts and,
+        for every live host pool, connections opened, requests served and idle connections.
+        """
+        pools = {}
+        pool_manager = self.adapter.poolmanager
+        for key in list(pool_manager.pools.keys()):
+            pool = pool_manager.pools.get(key)
+            if pool is None:
+                continue
+            host = f"{pool.host}:{pool.port}" if pool.port else pool.host
+            pools[host] = {
+                "scheme": pool.scheme,
+                "connections_opened": pool.num_connections,
+                "requests_served": pool.num_requests,
+                # The pool queue is pre-filled with None placeholders; only real entries are idle sockets
+                "idle_connections": sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool is not None else 0,
+                "maxsize": pool.pool.maxsize if pool.pool is not None else self.pool_maxsize,
+            }
+        with self._stats_lock:
+            requests_by_host = dict(self._requests_by_host)
+            errors_by_host = dict(self._errors_by_host)
+        return {
+            "config": {
+                "pool_connections": self.pool_connections,
+                "pool_maxsize": self.pool_maxsize,
+                "pool_block": self.pool_block,
+                "connect_timeout": self.timeout[0],
+                "read_timeout": self.timeout[1],
+                "keep_alive": self.keep_alive,
+            },
+            "requests_by_host": requests_by_host,
+            "errors_by_host": errors_by_host,
+            "pools": pools,
+        }
+
+    def close(self):
+        self.session.close()
+
+
+_shared_transport = None
+_shared_transport_lock = threading.Lock()
+
+
+def get_shared_transport():
+    """
+    Return the process-wide transport, creating it from the environment on first use.
+    """
+    global _shared_transport
+    if _shared_transport is None:
+        with _shared_transport_lock:
+            if _shared_transport is None:
+                _shared_transport = HttpTransport.from_env()
+    return _shared_transport
+
+
+def set_shared_transport(transport):
+    """
+    Replace the process-wide transport (e.g. with a differently sized pool). Returns the old one.
+    """
+    global _shared_transport
+    with _shared_transport_lock:
+        previous = _shared_transport
+        _shared_transport = transport
+    return previous
+
+
+class AsyncHttpTransport:
+    """
+    Non-blocking counterpart of HttpTransport built on httpx.AsyncClient.
+
+    The connection pool of an httpx.AsyncClient belongs to the event loop it is used on, so
+    the shared instance is kept per loop (see get_shared_async_transport).
+    """
+
+    def __init__(self, max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0,
+                 connect_timeout=3.05, read_timeout=30.0):
+        """
+        Args:
+            max_connections (int): Maximum number of concurrent connections across all hosts.
+            max_keepalive_connections (int): Maximum number of idle kept-alive connections.
+            keepalive_expiry (float): Seconds an idle connection is kept before being closed.
+            connect_timeout (float): Seconds to wait for a connection to be established.
+            read_timeout (float): Seconds to wait for the server to send a response.
+        """
+        import httpx  # Optional dependency, only needed for the async clients
+
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = (connect_timeout, read_timeout)
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+        self._requests_by_host = {}
+        self._errors_by_host = {}
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build an async transport from the same environment variables as HttpTransport.
+        """
+        return cls(
+            max_connections=int(os.getenv("HTTP_ASYNC_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("HTTP_POOL_MAXSIZE", "20")),
+            keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30")),
+            connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05")),
+            read_timeout=float(os.getenv("HTTP_READ_TIMEOUT", "30")),
+        )
+
+    async def request(self, method, url, **kwargs):
+        host = urlsplit(url).netloc
+        self._requests_by_host[host] = self._requests_by_host.get(host, 0) + 1
+        try:
+            with metrics.timed("http_request_seconds", host=host, method=method, endpoint=_endpoint_label(url)):
+                response = await self.client.request(method, url, **kwargs)
+        except Exception:
+            self._errors_by_host[host] = self._errors_by_host.get(host, 0) + 1
+            raise
+        metrics.increment("http_responses_total", host=host, status=response.status_code)
+        return response
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def put(self, url, **kwargs):
+        return await self.request("PUT", url, **kwargs)
+
+    async def delete(self, url, **kwargs):
+        return await self.request("DELETE", url, **kwargs)
+
+    def stats(self):
+        return {
+            "config": {
+                "max_connections": self.max_connections,
+                "max_keepalive_connections": self.max_keepalive_connections,
+                "keepalive_expiry": self.keepalive_expiry,
+                "connect_timeout": self.timeout[0],
+                "read_timeout": self.timeout[1],
+            },
+            "requests_by_host": dict(self._requests_by_host),
+            "errors_by_host": dict(self._errors_by_host),
+        }
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_async_transports = weakref.WeakKeyDictionary()
+
+
+def get_shared_async_transport():
+    """
+    Return the async transport shared by everything running on the current event loop.
+    """
+    loop = asyncio.get_running_loop()
+    transport = _async_transports.get(loop)
+    if transport is None:
+        transport = AsyncHttpTransport.from_env()
+        _async_transports[loop] = transport
+    return transport
@@ -0,0 +1,307 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError: # not on Windows: only threads of one process are then kept apart
+    fcntl = None
+
+# Where meter datasets are cached on disk, one sub-directory per World Engine base URL
+METER_STORE_DIR = os.getenv("METER_STORE_DIR", "meter_store")
+# Seconds before a cached dataset is re-synced from the World Engine (new records are appended)
+METER_STORE_MAX_AGE = float(os.getenv("METER_STORE_MAX_AGE", "900"))
+
+TIMESTAMP_COLUMN = "timestamp"
+AGGREGATIONS = {"sum": np.nansum, "mean": np.nanmean, "max": np.nanmax, "min": np.nanmin}
+
+
+def _to_epoch_ms(timestamps):
+    # numpy rejects the trailing "Z"; the values are UTC either way
+    values = np.array([t[:-1] if t.endswith("Z") else t for t in timestamps], dtype="datetime64[ms]")
+    return values.astype(np.int64)
+
+
+def _as_epoch_ms(value):
+    """
+    Accepts None, epoch milliseconds, an ISO-8601 string or a datetime64/datetime.
+    """
+    if value is None or isinstance(value, (int, np.integer)):
+        return value
+    if isinstance(value, str):
+        return int(_to_epoch_ms([value])[0])
+    return int(np.datetime64(value, "ms").astype(np.int64))
+
+
+class MeterDatasetStore:
+    """
+    On-disk columnar cache of World Engine meter datasets.
+
+    Every dataset is a directory of raw little-endian column files (timestamp as int64 epoch ms,
+    every numeric record field as float64) that are only ever appended to, plus one index.json with
+    per-dataset meter id, row count, time range and sync time. Reads memory-map the columns, so a
+    time-range query is a binary search plus array slices that share memory with the page cache:
+    no JSON parsing and no network.
+
+    Several processes (e.g. gunicorn workers) may share a directory: appends to a dataset hold an
+    fcntl lock on that dataset and start from the index entry on disk, and index.json is rewritten
+    under its own lock with only that entry changed.
+    """
+
+    def __init__(self, directory, fetch=None, max_age=METER_STORE_MAX_AGE):
+        """
+        Args:
+            directory (str): Directory holding index.json and one sub-directory per dataset.
+            fetch (callable): fetch(dataset_id) -> World Engine /meter-datasets/{id} response; needed for sync().
+            max_age (float): Seconds before sync() asks the World Engine again for new records.
+        """
+        self.directory = directory
+        self.fetch = fetch
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._dataset_locks = {}
+        self._maps = {} # (dataset_id, column) -> (row count, np.memmap)
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, "index.json")
+        self.index = self._load_index()
+        self.counters = {"hits": 0, "fetches": 0, "appended_rows": 0}
+
+    def _load_index(self):
+        if not os.path.exists(self._index_path):
+            return {}
+        with open(self._index_path) as f:
+            return json.load(f)
+
+    @contextmanager
+    def _file_lock(self, path):
+        """
+        Exclusive lock shared with other processes using the same directory (no-op without fcntl).
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _save_entry(self, key, entry):
+        """
+        Writes one dataset's index entry, keeping the entries other processes wrote in the meantime.
+        """
+        with self._lock, self._file_lock(f"{self._index_path}.lock"):
+            index = self._load_index()
+            index[key] = entry
+            # Write-then-rename so readers never see a torn index
+            tmp_path = f"{self._index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self._index_path)
+            self.index = index
+
+    @contextmanager
+    def _locked_dataset(self, key):
+        """
+        Holds the dataset against other threads and processes. Yields its index entry as on disk.
+        """
+        with self._dataset_lock(key):
+            os.makedirs(os.path.join(self.directory, key), exist_ok=True)
+            with self._file_lock(os.path.join(self.directory, key, ".lock")):
+                entry = self._load_index().get(key)
+                with self._lock:
+                    if entry is None:
+                        self.index.pop(key, None)
+                    else:
+                        self.index[key] = entry
+                yield entry
+
+    def _dataset_lock(self, key):
+        with self._lock:
+            return self._dataset_locks.setdefault(key, threading.Lock())
+
+    def _column_path(self, key, column):
+        return os.path.join(self.directory, key, f"{column}.{'i8' if column == TIMESTAMP_COLUMN else 'f8'}")
+
+    # --- Filling ---
+
+    def append(self, dataset_id, response):
+        """
+        Appends the records of a /meter-datasets/{id} response that are newer than what is stored.
+        Returns the number of rows added.
+        """
+        key = str(dataset_id)
+        with self._locked_dataset(key) as entry:
+            return self._append_locked(key, entry, response)
+
+    def _append_locked(self, key, entry, response):
+        # Caller holds the dataset lock; `entry` is the dataset's index entry as on disk (or None)
+        data = response.get("data", response) if isinstance(response, dict) else {}
+        records = data.get("records") or []
+        entry = entry or {}
+        last = entry.get("end")
+        columns = entry.get("columns") or sorted(
+            name for name, value in (records[0].items() if records else ())
+            if name != TIMESTAMP_COLUMN and isinstance(value, (int, float)) and not isinstance(value, bool)
+        )
+        timestamps = _to_epoch_ms([record[TIMESTAMP_COLUMN] for record in records]) if records else np.array([], dtype=np.int64)
+        order = np.argsort(timestamps, kind="stable")
+        timestamps = timestamps[order]
+        new = timestamps > last if last is not None else np.ones(len(timestamps), dtype=bool)
+        added = int(new.sum())
+
+        if added:
+            # Drop anything past the indexed row count (an append interrupted before the index was saved)
+            for column in [TIMESTAMP_COLUMN] + columns:
+                path = self._column_path(key, column)
+                if os.path.exists(path) and os.path.getsize(path) != entry.get("count", 0) * 8:
+                    os.truncate(path, entry.get("count", 0) * 8)
+            rows = [records[index] for index in order[new]]
+            with open(self._column_path(key, TIMESTAMP_COLUMN), "ab") as f:
+                f.write(timestamps[new].astype("<i8").tobytes())
+            for column in columns:
+                values = np.array([record.get(column, np.nan) for record in rows], dtype="<f8")
+                with open(self._column_path(key, column), "ab") as f:
+                    f.write(values.tobytes())
+        self._save_entry(key, {
+            "meter": data.get("meter", entry.get("meter")),
+            "interval_minutes": data.get("interval_minutes", entry.get("interval_minutes")),
+            "columns": columns,
+            "count": entry.get("count", 0) + added,
+            "start": entry.get("start") if entry.get("start") is not None else (int(timestamps[new][0]) if added else None),
+            "end": int(timestamps[new][-1]) if added else last,
+            "synced_at": time.time(),
+        })
+        with self._lock:
+            self.counters["appended_rows"] += added
+        return added
+
+    def needs_sync(self, dataset_id):
+        """
+        True when the dataset is not cached or was last synced more than max_age seconds ago.
+        """
+        entry = self.index.get(str(dataset_id))
+        return entry is None or time.time() - entry["synced_at"] >= self.max_age
+
+    def sync(self, dataset_id, refresh=False):
+        """
+        Makes sure the dataset is cached and not older than max_age, fetching it from the World
+        Engine only when needed. Returns the dataset's index entry.
+        """
+        key = str(dataset_id)
+        if not refresh and not self.needs_sync(dataset_id):
+            with self._lock:
+                self.counters["hits"] += 1
+            return self.index[key]
+        with self._locked_dataset(key) as entry:
+            # Another thread or process may have synced it while we waited for the lock
+            if not refresh and not self.needs_sync(dataset_id):
+                with self._lock:
+                    self.counters["hits"] += 1
+                return entry
+            if self.fetch is None:
+                raise RuntimeError("MeterDatasetStore has no fetch function to sync from")
+            response = self.fetch(dataset_id)
+            with self._lock:
+                self.counters["fetches"] += 1
+            self._append_locked(key, entry, response)
+            return self.index[key]
+
+    # --- Reading ---
+
+    def _column(self, key, column, count):
+        cached = self._maps.get((key, column))
+        if cached is not None and cached[0] == count:
+            return cached[1]
+        dtype = "<i8" if column == TIMESTAMP_COLUMN else "<f8"
+        array = np.memmap(self._column_path(key, column), dtype=dtype, mode="r", shape=(count,)) if count else np.empty(0, dtype=dtype)
+        self._maps[(key, column)] = (count, array)
+        return array
+
+    def series(self, dataset_id, start=None, end=None, columns=None, sync=True):
+        """
+        Rows with start <= timestamp < end as {"timestamp": int64 epoch ms, column: float64, ...}.
+        The arrays are read-only slices of the memory-mapped columns (no copy).
+
+        Args:
+            dataset_id (int): Meter dataset id.
+            start, end: Range bounds as epoch ms, ISO-8601 strings or datetime64; None is open.
+            columns (list): Value columns to return; all stored ones by default.
+            sync (bool): Fetch/refresh from the World Engine first when the cache is missing or stale.
+        """
+        key = str(dataset_id)
+        entry = self.sync(dataset_id) if sync else self.index.get(key)
+        if entry is None:
+            raise KeyError(f"Meter dataset {dataset_id} is not cached")
+        count = entry["count"]
+        timestamps = self._column(key, TIMESTAMP_COLUMN, count)
+        low = 0 if start is None else int(np.searchsorted(timestamps, _as_epoch_ms(start), side="left"))
+        high = count if end is None else int(np.searchsorted(timestamps, _as_epoch_ms(end), side="left"))
+        result = {TIMESTAMP_COLUMN: timestamps[low:high]}
+        for column in columns or entry["columns"]:
+            if column not in entry["columns"]:
+                raise KeyError(f"Meter dataset {dataset_id} has no column '{column}'")
+            result[column] = self._column(key, column, count)[low:high]
+        return result
+
+    def aggregate(self, dataset_id, column="consumption", start=None, end=None, how="sum", bucket_minutes=None):
+        """
+        Aggregates one column over a time range. With bucket_minutes, returns
+        {"timestamp": bucket starts, column: per-bucket values}; otherwise a single float.
+        """
+        if how not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation '{how}', expected one of {sorted(AGGREGATIONS)}")
+        rows = self.series(dataset_id, start, end, columns=[column])
+        values, timestamps = rows[column], rows[TIMESTAMP_COLUMN]
+        if not bucket_minutes:
+            return float(AGGREGATIONS[how](values)) if len(values) else None
+        if not len(values):
+            return {TIMESTAMP_COLUMN: timestamps[:0], column: values[:0]}
+        width = int(bucket_minutes) * 60_000
+        buckets = timestamps // width
+        # Timestamps are sorted, so every bucket is a contiguous run
+        boundaries = np.flatnonzero(np.diff(buckets)) + 1
+        starts = np.concatenate(([0], boundaries))
+        if how == "sum":
+            reduced = np.add.reduceat(np.nan_to_num(values), starts)
+        elif how == "max":
+            reduced = np.fmax.reduceat(values, starts)
+        elif how == "min":
+            reduced = np.fmin.reduceat(values, starts)
+        else:
+            valid = np.add.reduceat((~np.isnan(values)).astype(np.int64), starts)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                reduced = np.add.reduceat(np.nan_to_num(values), starts) / np.where(valid > 0, valid, np.nan)
+        return {TIMESTAMP_COLUMN: buckets[starts] * width, column: reduced}
+
+    def datasets_for_meter(self, meter_id):
+        with self._lock:
+            return [int(key) if key.isdigit() else key for key, entry in self.index.items() if entry.get("meter") == meter_id]
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "datasets": len(self.index), "rows": sum(entry["count"] for entry in self.index.values())}
+
+
+_meter_stores = {}
+_meter_stores_lock = threading.Lock()
+
+
+def get_meter_store(base_url, fetch=None):
+    """
+    Process-wide MeterDatasetStore for a World Engine base URL, under METER_STORE_DIR.
+    """
+    with _meter_stores_lock:
+        store = _meter_stores.get(base_url)
+        if store is None:
+            directory = os.path.join(METER_STORE_DIR, hashlib.sha1(str(base_url).encode()).hexdigest()[:12])
+            store = _meter_stores[base_url] = MeterDatasetStore(directory, fetch=fetch)
+        elif store.fetch is None:
+            store.fetch = fetch
+        return store
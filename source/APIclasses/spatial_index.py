@@ -0,0 +1,116 @@
+import math
+import os
+
+# A transformer without an explicit `max_meters` accepts this many meters
+DEFAULT_TRANSFORMER_MAX_METERS = int(os.getenv("TRANSFORMER_MAX_METERS", "50"))
+
+
+def _to_unit_vector(latitude, longitude):
+    """
+    Maps a lat/lon pair onto the unit sphere. Straight-line (chord) distance between these
+    vectors grows monotonically with great-circle distance, so a plain 3-d k-d tree gives
+    geographically correct nearest neighbours, including across the antimeridian.
+    """
+    lat = math.radians(latitude)
+    lon = math.radians(longitude)
+    cos_lat = math.cos(lat)
+    return (cos_lat * math.cos(lon), cos_lat * math.sin(lon), math.sin(lat))
+
+
+def chord_to_km(chord_distance, earth_radius_km=6371.0):
+    return 2 * earth_radius_km * math.asin(min(1.0, chord_distance / 2))
+
+
+def coordinates_of(node):
+    """
+    Returns (latitude, longitude) of a World Engine node, or None if it has no usable position.
+    """
+    latitude = node.get('latitude', node.get('lat'))
+    longitude = node.get('longitude', node.get('lng', node.get('lon')))
+    try:
+        return float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None
+
+
+class TransformerSpatialIndex:
+    """
+    k-d tree over transformer positions answering "nearest transformer that still has headroom".
+
+    The tree is stored in flat lists (point, left, right, axis) and is immutable once built;
+    headroom is evaluated at query time through a callback so newly placed meters are taken
+    into account without rebuilding.
+    """
+
+    def __init__(self, entries):
+        """
+        Args:
+            entries (list): (transformer_id, latitude, longitude) tuples.
+        """
+        self.ids = []
+        self.points = []
+        for transformer_id, latitude, longitude in entries:
+            self.ids.append(transformer_id)
+            self.points.append(_to_unit_vector(latitude, longitude))
+        self.left = []
+        self.right = []
+        self.axis = []
+        self.node_point = []
+        self.root = self._build(list(range(len(self.points))), 0)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _build(self, indices, depth):
+        if not indices:
+            return -1
+        axis = depth % 3
+        indices.sort(key=lambda i: self.points[i][axis])
+        median = len(indices) // 2
+        node = len(self.node_point)
+        self.node_point.append(indices[median])
+        self.axis.append(axis)
+        self.left.append(-1)
+        self.right.append(-1)
+        self.left[node] = self._build(indices[:median], depth + 1)
+        self.right[node] = self._build(indices[median + 1:], depth + 1)
+        return node
+
+    def nearest(self, latitude, longitude, accept=None):
+        """
+        Returns (transformer_id, distance_km) of the nearest transformer for which
+        `accept(transformer_id)` is true (any transformer if `accept` is None), or (None, None).
+        """
+        if self.root == -1:
+            return None, None
+        target = _to_unit_vector(latitude, longitude)
+        best_index = -1
+        best_sq = float('inf')
+        points, ids = self.points, self.ids
+        # (node, lower bound of the squared distance from target to anything in that subtree)
+        stack = [(self.root, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            if bound >= best_sq:
+                continue
+            point_index = self.node_point[node]
+            point = points[point_index]
+            dx = point[0] - target[0]
+            dy = point[1] - target[1]
+            dz = point[2] - target[2]
+            sq = dx * dx + dy * dy + dz * dz
+            if sq < best_sq and (accept is None or accept(ids[point_index])):
+                best_sq = sq
+                best_index = point_index
+
+            axis = self.axis[node]
+            diff = target[axis] - point[axis]
+            near, far = (self.left[node], self.right[node]) if diff < 0 else (self.right[node], self.left[node])
+            # Push the far side first so the near side is explored first (LIFO)
+            if far != -1:
+                stack.append((far, max(bound, diff * diff)))
+            if near != -1:
+                stack.append((near, bound))
+        if best_index == -1:
+            return None, None
+        return ids[best_index], chord_to_km(math.sqrt(best_sq))
@@ -1,21 +1,44 @@
-import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
+
+from source.APIclasses.http_transport import get_shared_transport
+from source.APIclasses.grid_topology import get_topology_cache
+from source.APIclasses.grid_loads import GridLoads
+from source.APIclasses.meter_store import get_meter_store
 
 class WorldEngineClient:
-    def __init__(self, base_url):
+    def __init__(self, base_url, transport=None):
         self.base_url = base_url
+        # Pooled keep-alive transport, shared process-wide unless one is passed in
+        self.transport = transport or get_shared_transport()
+        # The utility tree is the same for everyone, so it is downloaded once per process
+        self.topology_cache = get_topology_cache(base_url)
+
+    def _request(self, method, url, **kwargs):
+        response = self.transport.request(method, url, **kwargs)
+        response.raise_for_status() # Raise an exception for bad status codes
+        return response.json()
 
-    def get_utilities_detailed(self):
+    def get_utilities_detailed(self, refresh=False):
         """
         Get detailed data for utilities, substations, and transformers.
+        Served from the process-wide topology cache; pass refresh=True to re-download it.
         """
+        return self.get_topology(refresh=refresh).raw
+
+    def get_topology(self, refresh=False):
+        """
+        Get the indexed GridTopology (transformer by id, transformers by substation,
+        meters by transformer), loading it on first use.
+        """
+        return self.topology_cache.get(self._fetch_utilities_detailed, refresh=refresh)
+
+    def _fetch_utilities_detailed(self):
         url = f"{self.base_url}/utility/detailed"
         headers = {
             "Content-Type": "application/json"
         }
-        response = requests.get(url, headers=headers)
-        response.raise_for_status() # Raise an exception for bad status codes
-        return response.json()
+        return self._request("GET", url, headers=headers)
 
     def reset_data(self):
         """
@@ -25,9 +48,9 @@ class WorldEngineClient:
         headers = {
             "Content-Type": "application/json"
         }
-        response = requests.put(url, headers=headers)
-        response.raise_for_status() # Raise an exception for bad status codes
-        return response.json()
+        result = self._request("PUT", url, headers=headers)
+        self.topology_cache.invalidate()
+        return result
 
     def get_grid_loads(self):
         """
@@ -37,11 +60,16 @@ class WorldEngineClient:
         headers = {
             "Content-Type": "application/json"
         }
-        response = requests.get(url, headers=headers)
-        response.raise_for_status() # Raise an exception for bad status codes
-        return response.json()
+        return self._request("GET", url, headers=headers)
 
-    def create_meter(self, data):
+    def get_grid_load_analytics(self):
+        """
+        Get grid loads as a GridLoads object (NumPy arrays per transformer x time) for roll-ups,
+        peak detection and headroom calculations.
+        """
+        return GridLoads.from_payload(self.get_grid_loads())
+
+    def create_meter(self, data, idempotency_key=None):
         """
         Create a new meter.
 
@@ -60,17 +88,18 @@ class WorldEngineClient:
                                     "longitude": -122.4194,
                                     "pincode": "94103"
                                   }
+            idempotency_key (str): Optional Idempotency-Key header, so a retried create is not applied twice.
         """
         url = f"{self.base_url}/meters"
         headers = {
             "Content-Type": "application/json"
         }
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
         payload = {
             "data": data
         }
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status() # Raise an exception for bad status codes
-        return response.json()
+        return self._request("POST", url, headers=headers, json=payload)
 
     def get_all_meters(self, page=1, pageSize=100, populate_parent=True, populate_energy_resource=True, populate_children=True, populate_appliances=True, sort_children_desc=True):
         """
@@ -101,9 +130,86 @@ class WorldEngineClient:
         if sort_children_desc:
              params["sort[0]"] = "children.code:desc"
 
-        response = requests.get(url, params=params)
-        response.raise_for_status() # Raise an exception for bad status codes
-        return response.json()
+        return self._request("GET", url, params=params)
+
+    @staticmethod
+    def _meter_page_params(page, page_size, populate=(), fields=None, sort="id:asc"):
+        params = {
+            "pagination[page]": page,
+            "pagination[pageSize]": page_size,
+        }
+        for index, relation in enumerate(populate or ()):
+            params[f"populate[{index}]"] = relation
+        for index, field in enumerate(fields or ()):
+            params[f"fields[{index}]"] = field
+        if sort:
+            params["sort[0]"] = sort
+        return params
+
+    def _get_meter_page(self, page, page_size, populate, fields, sort):
+        url = f"{self.base_url}/meters"
+        return self._request("GET", url, params=self._meter_page_params(page, page_size, populate, fields, sort))
+
+    def iter_meter_pages(self, page_size=100, populate=(), fields=None, sort="id:asc", concurrency=1, max_pages=None):
+        """
+        Stream all meters page by page, yielding (meters, pagination meta) in page order. While the
+        caller works on one page the next ones are already being fetched, but never more than
+        `concurrency` pages are in flight or buffered, so memory stays flat however many meters
+        there are. Stopping the iteration early cancels the outstanding requests.
+
+        Args:
+            page_size (int): Meters per request.
+            populate (list): Relations to populate, e.g. ["parent"]; none by default.
+                             Any of "parent", "energyResource", "children", "appliances".
+            fields (list): Only return these meter fields (Strapi fields[]), e.g. ["code", "latitude"].
+            sort (str): Strapi sort; a stable order keeps pages consistent while fetching ahead.
+            concurrency (int): Pages fetched ahead of the one the caller is working on (1 = just the next).
+            max_pages (int): Stop after this many pages.
+        """
+        populate, fields = tuple(populate or ()), tuple(fields or ())
+        window = max(1, concurrency)
+        executor = ThreadPoolExecutor(max_workers=window, thread_name_prefix="meter_pages")
+        in_flight = [] # futures of the pages after the current one, in page order
+        next_page = 1
+        page_count = max_pages
+        exhausted = False
+
+        def top_up():
+            # Keep `window` pages after the current one in flight; without a pageCount, a short page marks the end
+            nonlocal next_page
+            while len(in_flight) < window and not exhausted and (page_count is None or next_page <= page_count):
+                in_flight.append(executor.submit(self._get_meter_page, next_page, page_size, populate, fields, sort))
+                next_page += 1
+
+        try:
+            top_up()
+            while in_flight:
+                response = in_flight.pop(0).result()
+                meters = response.get("data") or []
+                pagination = (response.get("meta") or {}).get("pagination") or {}
+                if pagination.get("pageCount") is not None:
+                    page_count = min(pagination["pageCount"], max_pages or pagination["pageCount"])
+                if len(meters) < page_size:
+                    exhausted = True
+                    for future in in_flight:
+                        future.cancel()
+                    in_flight.clear()
+                # Before yielding, so the next pages download while the caller works on this one
+                top_up()
+                if meters:
+                    yield meters, pagination
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def iter_meters(self, page_size=100, populate=(), fields=None, sort="id:asc", concurrency=1, max_pages=None):
+        """
+        Stream all meters one by one; see iter_meter_pages for the arguments.
+
+            for meter in world_engine.iter_meters(populate=["parent"], fields=["code"], concurrency=4):
+                ...
+        """
+        for meters, _ in self.iter_meter_pages(page_size, populate, fields, sort, concurrency, max_pages):
+            yield from meters
 
     def delete_meter(self, meter_id):
         """
@@ -113,9 +219,7 @@ class WorldEngineClient:
             meter_id (int): The ID of the meter to delete.
         """
         url = f"{self.base_url}/meters/{meter_id}"
-        response = requests.delete(url)
-        response.raise_for_status() # Raise an exception for bad status codes
-        return response.json()
+        return self._request("DELETE", url)
 
     def get_meter_by_id(self, meter_id, populate_parent=True, populate_children=True):
         """
@@ -132,9 +236,7 @@ class WorldEngineClient:
             params["populate[0]"] = "parent"
         if populate_children:
             params["populate[1]"] = "children"
-        response = requests.get(url, params=params)
-        response.raise_for_status() # Raise an exception for bad status codes
-        return response.json()
+        return self._request("GET", url, params=params)
 
 
     def get_meter_historical_data(self, meter_dataset_id):
@@ -145,11 +247,28 @@ class WorldEngineClient:
             meter_dataset_id (int): The ID of the meter dataset to retrieve historical data for.
         """
         url = f"{self.base_url}/meter-datasets/{meter_dataset_id}"
-        response = requests.get(url)
-        response.raise_for_status() # Raise an exception for bad status codes
-        return response.json()
+        return self._request("GET", url)
+
+    @property
+    def meter_store(self):
+        """
+        The on-disk MeterDatasetStore for this World Engine, filled from get_meter_historical_data.
+        """
+        return get_meter_store(self.base_url, fetch=self.get_meter_historical_data)
+
+    def get_meter_series(self, meter_dataset_id, start=None, end=None, columns=None):
+        """
+        Time range of a meter dataset from the local columnar cache, syncing it from the World
+        Engine only when it is missing or older than METER_STORE_MAX_AGE.
+
+        Args:
+            meter_dataset_id (int): The ID of the meter dataset.
+            start, end: Optional range bounds (epoch ms or ISO-8601), end exclusive.
+            columns (list): Value columns to return, e.g. ["consumption"]; all by default.
+        """
+        return self.meter_store.series(meter_dataset_id, start, end, columns=columns)
 
-    def create_energy_resource(self, data):
+    def create_energy_resource(self, data, idempotency_key=None):
         """
         Create a new energy resource (household).
 
@@ -160,17 +279,18 @@ class WorldEngineClient:
                                     "type": "CONSUMER",
                                     "meter": 1361
                                   }
+            idempotency_key (str): Optional Idempotency-Key header, so a retried create is not applied twice.
         """
         url = f"{self.base_url}/energy-resources"
         headers = {
             "Content-Type": "application/json"
         }
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
         payload = {
             "data": data
         }
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status() # Raise an exception for bad status codes
-        return response.json()
+        return self._request("POST", url, headers=headers, json=payload)
 
     def get_energy_resource_by_id(self, energy_resource_id, populate_meter_parent=True, populate_meter_children=True, populate_meter_appliances=True):
         """
@@ -190,9 +310,7 @@ class WorldEngineClient:
             params["populate[1]"] = "meter.children"
         if populate_meter_appliances:
             params["populate[2]"] = "meter.appliances"
-        response = requests.get(url, params=params)
-        response.raise_for_status() # Raise an exception for bad status codes
-        return response.json()
+        return self._request("GET", url, params=params)
 
     def delete_energy_resource(self, energy_resource_id):
         """
@@ -202,29 +320,31 @@ class WorldEngineClient:
             energy_resource_id (int): The ID of the energy resource to delete.
         """
         url = f"{self.base_url}/energy-resources/{energy_resource_id}"
-        response = requests.delete(url)
-        response.raise_for_status() # Raise an exception for bad status codes
-        return response.json()
+        return self._request("DELETE", url)
 
-    def create_der(self, energy_resource_id, appliance_id):
+    def create_der(self, energy_resource_id, appliance_id, switched_on=None, idempotency_key=None):
         """
         Create a new Distributed Energy Resource (DER).
 
         Args:
             energy_resource_id (int): The ID of the energy resource the DER belongs to.
             appliance_id (int): The ID of the appliance associated with the DER.
+            switched_on (bool): Optional initial switching status of the DER.
+            idempotency_key (str): Optional Idempotency-Key header, so a retried create is not applied twice.
         """
         url = f"{self.base_url}/der"
         headers = {
             "Content-Type": "application/json"
         }
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
         payload = {
             "energy_resource": energy_resource_id,
             "appliance": appliance_id
         }
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status() # Raise an exception for bad status codes
-        return response.json()
+        if switched_on is not None:
+            payload["switched_on"] = switched_on
+        return self._request("POST", url, headers=headers, json=payload)
 
     def toggle_der_switching(self, der_id):
         """
@@ -234,6 +354,4 @@ class WorldEngineClient:
             der_id (int): The ID of the DER to toggle.
         """
         url = f"{self.base_url}/toggle-der/{der_id}"
-        response = requests.post(url)
-        response.raise_for_status() # Raise an exception for bad status codes
-        return response.json()
\ No newline at end of file
+        return self._request("POST", url)
\ No newline at end of file
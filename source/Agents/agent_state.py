@@ -1,3 +1,4 @@
+import operator
 from typing import Annotated, List, Tuple, Union, TypedDict, Optional
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langchain_core.messages.tool import ToolMessage
@@ -7,7 +8,7 @@ class AgentState(TypedDict):
     Represents the state of the agentic solar adoption process.
     """
     input: str  # User input for the current turn
-    chat_history: List[Union[AIMessage, HumanMessage, ToolMessage]] # Full conversation history
+    chat_history: Annotated[List[Union[AIMessage, HumanMessage, ToolMessage]], operator.add] # Full conversation history; nodes return only the messages they add
     tool_output: Optional[Union[str, List[dict], dict]]  # Output from the latest tool call
     current_stage: str  # e.g., "welcome", "gather_info", "search_solar", "present_options", "select_solar", "confirm_solar", "search_subsidies", "apply_subsidies", "setup_grid_flexibility", "provide_status", "end", "error"
     user_info: dict  # Stores collected user data (location, bill, etc.)
@@ -24,3 +25,5 @@ class AgentState(TypedDict):
     error_message: Optional[str] # Stores error messages from the current turn
     # Added for LLM context generation:
     latest_tool_output_summary: Optional[str] # Summary description of the latest tool output
+    history_summary: Optional[str] # Rolling summary of chat turns no longer sent to the LLM verbatim
+    summarized_message_count: int # Number of leading chat_history messages covered by history_summary
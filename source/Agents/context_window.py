@@ -0,0 +1,156 @@
+import os
+from typing import List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.messages.tool import ToolMessage
+
+# Number of most recent turns (a turn starts at a HumanMessage) sent to the LLM verbatim
+HISTORY_TURNS = int(os.getenv("AGENT_HISTORY_TURNS", "6"))
+# Hard upper bound on the estimated prompt size of a single LLM call
+PROMPT_TOKEN_BUDGET = int(os.getenv("AGENT_PROMPT_TOKEN_BUDGET", "24000"))
+# Tool payloads outside the current turn are cut to this many characters
+TOOL_PAYLOAD_MAX_CHARS = int(os.getenv("AGENT_TOOL_PAYLOAD_MAX_CHARS", "2000"))
+# The rolling summary keeps only its most recent lines beyond this size
+SUMMARY_MAX_CHARS = int(os.getenv("AGENT_SUMMARY_MAX_CHARS", "4000"))
+
+SUMMARY_LINE_MAX_CHARS = 200
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def _text(content) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return str(content or "")
+
+
+def estimate_tokens(message: BaseMessage) -> int:
+    """
+    Cheap token estimate (~4 characters per token) including tool call arguments.
+    """
+    chars = len(_text(message.content))
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        chars += len(tool_call.get("name", "")) + len(str(tool_call.get("args", "")))
+    return chars // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+
+def turn_starts(history: List[BaseMessage], start: int = 0) -> List[int]:
+    """
+    Indices where a turn begins: every HumanMessage, plus 0 if the history does not start with one.
+    Cutting only at these indices keeps each AIMessage and its ToolMessages together.
+    Only indices >= `start` are returned (and scanned), so already summarized turns cost nothing.
+    """
+    starts = [i for i in range(start, len(history)) if isinstance(history[i], HumanMessage)]
+    if start == 0 and history and (not starts or starts[0] != 0):
+        starts.insert(0, 0)
+    return starts
+
+
+def _shorten(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+def summarize_messages(messages: List[BaseMessage]) -> List[str]:
+    """
+    Extractive one-line-per-message summary; tool payloads are reduced to their outcome.
+    """
+    lines = []
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            lines.append(f"User: {_shorten(_text(message.content), SUMMARY_LINE_MAX_CHARS)}")
+        elif isinstance(message, AIMessage):
+            if message.tool_calls:
+                lines.append(f"Assistant called tools: {', '.join(tool_call.get('name', '?') for tool_call in message.tool_calls)}")
+            text = _text(message.content)
+            if text.strip():
+                lines.append(f"Assistant: {_shorten(text, SUMMARY_LINE_MAX_CHARS)}")
+        elif isinstance(message, ToolMessage):
+            content = _text(message.content)
+            outcome = "error" if '"error"' in content[:200] or content.startswith("Error") else "ok"
+            lines.append(f"Tool result ({outcome}, {len(content)} chars)")
+    return lines
+
+
+def _append_to_summary(summary: Optional[str], lines: List[str]) -> Optional[str]:
+    if not lines:
+        return summary
+    combined = (summary.split("\n") if summary else []) + lines
+    # Drop the oldest lines once the summary grows past its size limit
+    size = sum(len(line) + 1 for line in combined)
+    first = 0
+    while first < len(combined) - 1 and size > SUMMARY_MAX_CHARS:
+        size -= len(combined[first]) + 1
+        first += 1
+    return "\n".join(combined[first:])
+
+
+def _compact_tool_message(message: BaseMessage, max_chars: int) -> BaseMessage:
+    if not isinstance(message, ToolMessage):
+        return message
+    content = _text(message.content)
+    if len(content) <= max_chars:
+        return message
+    return ToolMessage(
+        content=f"{content[:max_chars]}... [truncated {len(content) - max_chars} chars]",
+        tool_call_id=message.tool_call_id,
+    )
+
+
+def build_llm_context(
+    system_prompt: str,
+    history: List[BaseMessage],
+    summary: Optional[str] = None,
+    summarized_count: int = 0,
+    history_turns: int = HISTORY_TURNS,
+    token_budget: int = PROMPT_TOKEN_BUDGET,
+) -> Tuple[List[BaseMessage], Optional[str], int]:
+    """
+    Builds the message list for one LLM call: a single SystemMessage (prompt + rolling summary of
+    older turns) followed by the last `history_turns` turns verbatim, within `token_budget`.
+
+    `summary` and `summarized_count` are the rolling summary carried in the agent state and the
+    number of leading history messages it already covers; they are returned updated so older
+    turns are only summarized once.
+    """
+    if summarized_count > len(history):
+        # History was reset underneath us; start a new summary
+        summary, summarized_count = None, 0
+
+    starts = turn_starts(history, summarized_count) or [summarized_count]
+    keep_from = starts[max(0, len(starts) - history_turns)] if history_turns > 0 else len(history)
+    current_turn_start = starts[-1]
+
+    def compose(keep_from, summary, current_turn_chars):
+        window = []
+        for index in range(keep_from, len(history)):
+            limit = TOOL_PAYLOAD_MAX_CHARS if index < current_turn_start else current_turn_chars
+            window.append(_compact_tool_message(history[index], limit))
+        content = system_prompt
+        if summary:
+            content += f"\nSummary of the earlier conversation:\n{summary}"
+        messages = [SystemMessage(content=content)] + window
+        return messages, sum(estimate_tokens(message) for message in messages)
+
+    summary = _append_to_summary(summary, summarize_messages(history[summarized_count:keep_from]))
+    summarized_count = max(summarized_count, keep_from)
+    current_turn_chars = token_budget * CHARS_PER_TOKEN
+    messages, tokens = compose(keep_from, summary, current_turn_chars)
+
+    # Over budget: fold whole turns into the summary, oldest first, keeping at least the current turn
+    while tokens > token_budget and keep_from < current_turn_start:
+        next_start = next(start for start in starts if start > keep_from)
+        summary = _append_to_summary(summary, summarize_messages(history[keep_from:next_start]))
+        keep_from = summarized_count = next_start
+        messages, tokens = compose(keep_from, summary, current_turn_chars)
+
+    # Still over: shrink tool payloads of the current turn
+    while tokens > token_budget and current_turn_chars > TOOL_PAYLOAD_MAX_CHARS // 4:
+        current_turn_chars //= 2
+        messages, tokens = compose(keep_from, summary, current_turn_chars)
+
+    if tokens > token_budget:
+        print(f"Warning: LLM context still ~{tokens} tokens after compaction (budget {token_budget}).")
+    return messages, summary, summarized_count
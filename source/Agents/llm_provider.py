@@ -0,0 +1,202 @@
+import itertools
+import json
+import os
+import random
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, SystemMessage
+from langchain_core.messages.tool import ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# "vertex" (Gemini on Vertex AI) or "fake" (scripted, offline, deterministic)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "vertex").lower()
+# Simulated model latency for the fake provider, in seconds per call (plus up to FAKE_LLM_JITTER)
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0"))
+FAKE_LLM_JITTER = float(os.getenv("FAKE_LLM_JITTER", "0"))
+
+# Tool call ids only have to be unique and match their ToolMessages; a counter keeps runs reproducible
+_tool_call_ids = itertools.count(1)
+
+STAGE_PATTERN = re.compile(r"We're currently at this stage: ([\w-]+)\.")
+STATE_SUMMARY_PREFIX = "Current process state summary: "
+
+# Text the fake model answers with when a stage has no scripted tool call (or the tool already ran)
+STAGE_REPLIES = {
+    'initial': "Hi, I'm Inergy! I can help you go solar and join a grid flexibility program.",
+    'welcome': "Hi, I'm Inergy! I can help you go solar and join a grid flexibility program. Interested?",
+    'gather_info': "Great! Which city, state and pincode are you in, and what is your average monthly electricity bill?",
+    'search_solar': "Here are the solar options I found for you.",
+    'present_options': "Here are your options. Reply with 'select 1' (or another number) to pick one.",
+    'confirm_solar': "Your solar order is confirmed!",
+    'search_subsidies': "I looked up the subsidies you can apply for.",
+    'apply_subsidies': "Your subsidy application has been submitted.",
+    'setup_grid_flexibility': "Your home is now registered for grid flexibility.",
+    'provide_status': "All done: your solar order, subsidy and grid flexibility setup are complete.",
+    'end': "Thanks for using Inergy, enjoy your solar!",
+    'error': "Something went wrong on our side. Would you like me to try again?",
+}
+
+
+def stage_from_messages(messages: List[BaseMessage]) -> Optional[str]:
+    """
+    Reads the current stage back out of the agent's system prompt.
+    """
+    for message in messages:
+        if isinstance(message, SystemMessage):
+            match = STAGE_PATTERN.search(message.content)
+            if match:
+                return match.group(1)
+    return None
+
+
+def state_summary_from_messages(messages: List[BaseMessage]) -> dict:
+    """
+    Parses the JSON "Current process state summary" the agent puts into the system prompt.
+    """
+    for message in messages:
+        if isinstance(message, SystemMessage):
+            for line in message.content.split("\n"):
+                if line.startswith(STATE_SUMMARY_PREFIX):
+                    try:
+                        return json.loads(line[len(STATE_SUMMARY_PREFIX):])
+                    except ValueError:
+                        return {}
+    return {}
+
+
+def _confirm_solar_calls(summary: dict) -> List[dict]:
+    option = summary.get('selected_solar_option') or {}
+    user_info = summary.get('user_info') or {}
+    return [{'name': 'beckn_solar_retail_confirm', 'args': {
+        'provider_id': (option.get('provider') or {}).get('id'),
+        'item_id': option.get('id'),
+        'fulfillment_id': user_info.get('fulfillment_id') or 'fulfillment-1',
+        'customer_name': user_info.get('customer_name') or 'Test Customer',
+        'customer_phone': user_info.get('customer_phone') or '555-010-0000',
+        'customer_email': user_info.get('customer_email') or 'customer@example.com',
+    }}]
+
+
+def _apply_subsidies_calls(summary: dict) -> List[dict]:
+    if not summary.get('subsidy_search_results_count'):
+        return []
+    # provider_id / item_id are back-filled by call_tool from the first subsidy search result
+    user_info = summary.get('user_info') or {}
+    return [{'name': 'beckn_subsidy_confirm', 'args': {
+        'fulfillment_id': user_info.get('fulfillment_id') or 'fulfillment-1',
+        'customer_name': user_info.get('customer_name') or 'Test Customer',
+        'customer_phone': user_info.get('customer_phone') or '555-010-0000',
+        'customer_email': user_info.get('customer_email') or 'customer@example.com',
+    }}]
+
+
+def _setup_grid_flexibility_calls(summary: dict) -> List[dict]:
+    status = summary.get('world_engine_setup_status') or {}
+    calls = []
+    if not status.get('energy_resource_created'):
+        calls.append({'name': 'world_engine_create_energy_resource', 'args': {'name': "Test Customer's Home"}})
+    if not status.get('meter_created'):
+        calls.append({'name': 'world_engine_create_meter', 'args': {
+            'code': f"METER-{random.Random(json.dumps(summary, sort_keys=True)).randrange(10**6):06d}",
+            'type': 'SMART', 'city': 'San Francisco', 'state': 'California',
+            'latitude': 37.7749, 'longitude': -122.4194, 'pincode': '94103',
+        }})
+    if not status.get('ders_created'):
+        # energy_resource_id is injected by call_tool once the energy resource exists
+        calls.append({'name': 'world_engine_create_der', 'args': {'energy_resource_id': None, 'appliance_id': 1}})
+    return calls
+
+
+# stage -> function(state summary) returning the tool calls the model emits at the start of the stage
+STAGE_TOOL_SCRIPTS: Dict[str, Callable[[dict], List[dict]]] = {
+    'search_solar': lambda summary: [{'name': 'beckn_solar_retail_search', 'args': {}}],
+    'confirm_solar': _confirm_solar_calls,
+    'search_subsidies': lambda summary: [{'name': 'beckn_subsidy_search', 'args': {}}],
+    'apply_subsidies': _apply_subsidies_calls,
+    'setup_grid_flexibility': _setup_grid_flexibility_calls,
+}
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for the Vertex AI chat model. It reads the stage and state summary out of
+    the agent's system prompt and answers like the real model would: the stage's tool calls when the
+    stage calls for them, otherwise a short canned reply. Useful for benchmarks and offline runs.
+    """
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    replies: Dict[str, str] = STAGE_REPLIES
+    tool_scripts: Dict[str, Callable[[dict], List[dict]]] = STAGE_TOOL_SCRIPTS
+    bound_tool_names: Optional[List[str]] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-fake"
+
+    def bind_tools(self, tools, **kwargs):
+        names = [getattr(tool, 'name', None) or getattr(tool, '__name__', str(tool)) for tool in tools]
+        return self.model_copy(update={'bound_tool_names': names})
+
+    def _respond(self, messages: List[BaseMessage]) -> AIMessage:
+        stage = stage_from_messages(messages) or 'welcome'
+        last = messages[-1] if messages else None
+        script = self.tool_scripts.get(stage)
+        # Tool calls only at the start of a stage; after the ToolMessages come back the model talks
+        if script is not None and not isinstance(last, ToolMessage):
+            calls = [call for call in script(state_summary_from_messages(messages))
+                     if self.bound_tool_names is None or call['name'] in self.bound_tool_names]
+            if calls:
+                return AIMessage(content="", tool_calls=[
+                    {'name': call['name'], 'args': call['args'], 'id': f"call_{call['name']}_{next(_tool_call_ids)}"}
+                    for call in calls
+                ])
+        return AIMessage(content=self.replies.get(stage, self.replies['welcome']))
+
+    def _sleep(self):
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        self._sleep()
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any):
+        self._sleep()
+        message = self._respond(messages)
+        if message.tool_calls:
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                {'name': call['name'], 'args': json.dumps(call['args']), 'id': call['id'], 'index': index}
+                for index, call in enumerate(message.tool_calls)
+            ]))
+            if run_manager:
+                run_manager.on_llm_new_token("", chunk=chunk)
+            yield chunk
+            return
+        for index, word in enumerate(message.content.split(" ")):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word if index == 0 else " " + word))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+def create_chat_model(model_name: Optional[str] = None, provider: Optional[str] = None) -> BaseChatModel:
+    """
+    Builds the chat model selected by LLM_PROVIDER. Vertex AI (and its credentials) is only
+    touched when the "vertex" provider is chosen.
+    """
+    provider = (provider or LLM_PROVIDER).lower()
+    if provider == "fake":
+        return ScriptedChatModel(latency=FAKE_LLM_LATENCY, jitter=FAKE_LLM_JITTER)
+    if provider != "vertex":
+        raise ValueError(f"Unknown LLM_PROVIDER '{provider}', expected 'vertex' or 'fake'.")
+
+    from google.cloud import aiplatform
+    from langchain_google_vertexai import ChatVertexAI
+
+    aiplatform.init(project=os.getenv("GCP_PROJECT") or "e-dragon-459817-h0")
+    return ChatVertexAI(model=model_name or os.getenv("LLM_MODEL_NAME"), temperature=0)
@@ -0,0 +1,69 @@
+import os
+import uuid
+from typing import Optional
+
+from langchain_core.messages import AIMessage
+from langchain_core.messages.tool import ToolMessage
+
+# Set AGENT_FAST_PATH=false to always let the LLM emit the tool calls itself
+FAST_PATH_ENABLED = os.getenv("AGENT_FAST_PATH", "true").lower() == "true"
+
+
+def _search_solar(state: dict) -> Optional[tuple]:
+    return 'beckn_solar_retail_search', {}
+
+
+def _search_subsidies(state: dict) -> Optional[tuple]:
+    return 'beckn_subsidy_search', {}
+
+
+def _confirm_solar(state: dict) -> Optional[tuple]:
+    option = state.get('selected_solar_option') or {}
+    user_info = state.get('user_info') or {}
+    args = {
+        'provider_id': (option.get('provider') or {}).get('id'),
+        'item_id': option.get('id'),
+        'customer_name': user_info.get('customer_name'),
+        'customer_phone': user_info.get('customer_phone'),
+        'customer_email': user_info.get('customer_email'),
+    }
+    if any(value is None for value in args.values()):
+        # Something is missing; the LLM has to ask the user for it
+        return None
+    if user_info.get('fulfillment_id'):
+        args['fulfillment_id'] = user_info['fulfillment_id']
+    # Otherwise call_tool generates and stores a fulfillment_id, as it does for LLM-issued calls
+    return 'beckn_solar_retail_confirm', args
+
+
+# Stages whose only job is one predictable tool call: stage -> rule returning (tool name, args) or None
+STAGE_TOOL_RULES = {
+    'search_solar': _search_solar,
+    'search_subsidies': _search_subsidies,
+    'confirm_solar': _confirm_solar,
+}
+
+
+def plan_direct_tool_call(state: dict) -> Optional[AIMessage]:
+    """
+    Returns an AIMessage carrying the stage's tool call when it can be derived from the state alone,
+    so the agent node can skip the LLM round trip that would only emit that call. Returns None when
+    the LLM is needed (unknown stage, missing inputs, or the tool already ran and its result must
+    now be put into words for the user).
+    """
+    if not FAST_PATH_ENABLED:
+        return None
+    rule = STAGE_TOOL_RULES.get(state.get('current_stage'))
+    if rule is None:
+        return None
+    history = state.get('chat_history') or []
+    if history and isinstance(history[-1], ToolMessage):
+        return None
+    planned = rule(state)
+    if planned is None:
+        return None
+    tool_name, tool_args = planned
+    return AIMessage(
+        content="",
+        tool_calls=[{"name": tool_name, "args": tool_args, "id": f"fastpath_{tool_name}_{uuid.uuid4().hex[:8]}"}],
+    )
@@ -0,0 +1,501 @@
+import json
+import re
+from collections import deque
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.messages.tool import ToolMessage
+from langgraph.constants import END
+
+# Keywords that show interest in solar / grid flexibility; handle_user_input uses the same list
+SOLAR_INTEREST_KEYWORDS = ("solar", "rooftop", "incentive", "flexibility program")
+
+# Routes returned by next_node_from_stage (keys of the conditional edge after update_state)
+CONTINUE = "continue_process"
+AWAIT_USER = "awaiting_human_input"
+END_PROCESS = "end_process"
+
+# Kinds of the latest chat message, as used in the routing table
+HUMAN, AGENT_REPLY, AGENT_TOOL_CALLS, TOOL_RESULT, NO_MESSAGE = "human", "agent_reply", "agent_tool_calls", "tool_result", "none"
+
+_message_kinds = {} # message class -> kind, resolved with isinstance once per class
+
+
+def message_kind(message):
+    if message is None:
+        return NO_MESSAGE
+    kind = _message_kinds.get(type(message))
+    if kind is None:
+        if isinstance(message, AIMessage):
+            kind = AGENT_REPLY
+        elif isinstance(message, ToolMessage):
+            kind = TOOL_RESULT
+        elif isinstance(message, HumanMessage):
+            kind = HUMAN
+        else:
+            kind = NO_MESSAGE
+        _message_kinds[type(message)] = kind
+    if kind == AGENT_REPLY and message.tool_calls:
+        return AGENT_TOOL_CALLS
+    return kind
+
+
+def _tool_output(message):
+    # call_tool stores the tool's JSON result itself as the ToolMessage content (or {"error": ...})
+    return json.loads(message.content)
+
+
+# --- Stage handlers ---
+# handler(state, latest_message, updated, hooks) updates `updated` (a shallow copy of state) in place,
+# including updated['current_stage']; leaving it untouched keeps the current stage.
+
+def _initial(state, latest_message, updated, hooks):
+    # This stage is set by handle_user_input. Decide next stage based on initial intent.
+    user_input = latest_message.content.lower()
+    if any(word in user_input for word in SOLAR_INTEREST_KEYWORDS):
+        updated['current_stage'] = 'gather_info'
+    else:
+        updated['current_stage'] = 'welcome' # If initial input is not directly about solar, start with welcome
+
+
+def _welcome(state, latest_message, updated, hooks):
+    if not isinstance(latest_message, HumanMessage):
+        # The agent's own welcome (which mentions solar) is not the user's answer; wait for it.
+        updated['current_stage'] = 'welcome'
+        return
+    # User has seen the welcome message and provided input. Check if it indicates interest in solar.
+    user_input = latest_message.content.lower()
+    if any(word in user_input for word in SOLAR_INTEREST_KEYWORDS + ("yes", "tell me more")):
+        updated['current_stage'] = 'gather_info'
+        print("User expressed interest in solar, transitioning to gather_info.")
+    else:
+        # If not, stay in welcome, the agent will decide how to respond
+        updated['current_stage'] = 'welcome'
+        print("Staying in welcome stage.")
+
+
+def _gather_info(state, latest_message, updated, hooks):
+    if isinstance(latest_message, AIMessage):
+        # Agent responded while in gather_info, means it likely asked for info.
+        # Stay in gather_info to receive user's response.
+        updated['current_stage'] = 'gather_info'
+        print("Agent message received in gather_info, staying in stage.")
+        return
+    if not isinstance(latest_message, HumanMessage):
+        return
+    user_input = latest_message.content.lower()
+    user_info = updated.get('user_info', {}).copy()
+
+    # Attempt to extract key info from user input (simplistic)
+    # In a real application, use proper NER or form filling.
+    # For demo, just mark fields as 'provided' if keywords are present.
+    if 'location' not in user_info:
+        # Look for city/state/pincode keywords
+        if any(word in user_input for word in ['city', 'state', 'pincode', 'location', 'in']):
+            user_info['location'] = "Provided" # Mark as provided
+            print("Attempted to extract location info.") # Debugging
+            if hooks.get('location_detected'):
+                hooks['location_detected']()
+
+    if 'consumption' not in user_info:
+        # Look for bill/consumption keywords
+        if any(word in user_input for word in ['bill', 'consumption', 'usage', 'kwh', '$']):
+            user_info['consumption'] = "Provided" # Mark as provided
+            print("Attempted to extract consumption info.") # Debugging
+
+    if 'customer_name' not in user_info and ('name is' in user_input or 'i am' in user_input):
+        try:
+            # Very basic name extraction after "name is" or "i am"
+            parts = user_input.split('name is') if 'name is' in user_input else user_input.split('i am')
+            if len(parts) > 1:
+                name_part = parts[1].strip()
+                user_info['customer_name'] = name_part.split('.')[0].split(',')[0].title() # Basic extraction
+                print(f"Extracted name: {user_info['customer_name']}")
+        except Exception as e:
+            print(f"Error extracting name: {e}")
+
+    if 'customer_phone' not in user_info:
+        # Basic phone number pattern matching (very simple)
+        phone_match = re.search(r'\d{3}[-.\s]?\d{3}[-.\s]?\d{4}', user_input)
+        if phone_match:
+            user_info['customer_phone'] = phone_match.group(0)
+            print(f"Extracted phone: {user_info['customer_phone']}")
+
+    if 'customer_email' not in user_info:
+        # Basic email pattern matching
+        email_match = re.search(r'\S+@\S+\.\S+', user_input)
+        if email_match:
+            user_info['customer_email'] = email_match.group(0)
+            print(f"Extracted email: {user_info['customer_email']}")
+
+    updated['user_info'] = user_info
+
+    # Decide next stage based on whether BOTH location and consumption are marked as 'Provided'
+    if user_info.get('location') == 'Provided' and user_info.get('consumption') == 'Provided':
+        updated['current_stage'] = 'search_solar'
+        print("Sufficient info gathered, transitioning to search_solar.")
+    else:
+        # Stay in gather_info. The agent will see the state and know to ask for missing info.
+        updated['current_stage'] = 'gather_info'
+        print("Info still incomplete, staying in gather_info.")
+
+
+def _search_solar(state, latest_message, updated, hooks):
+    # Expecting ToolMessage output from call_tool (beckn_solar_retail_search)
+    if not isinstance(latest_message, ToolMessage):
+        return
+    tool_output = _tool_output(latest_message)
+    if 'error' not in tool_output:
+        solar_options = tool_output.get('message', {}).get('catalog', {}).get('items', [])
+        updated['solar_options'] = solar_options
+        if solar_options:
+            updated['current_stage'] = 'present_options'
+            print("Solar options found, transitioning to present_options.")
+        else:
+            updated['current_stage'] = 'welcome' # Go back if no options
+            print("No solar options found, transitioning back to welcome.")
+    else:
+        updated['current_stage'] = 'error'
+        updated['error_message'] = tool_output.get('error', 'Unknown search error')
+        print(f"Search solar error, transitioning to error: {updated['error_message']}")
+
+
+def _parse_solar_selection(user_selection_input, solar_options):
+    """
+    The option picked by "select 2", "select <name>", "2" or "<exact name>", or None.
+    """
+    selected_option = None
+    try:
+        # Attempt to parse selection by number (e.g., "select 1")
+        if "select" in user_selection_input:
+            parts = user_selection_input.split("select")
+            if len(parts) > 1:
+                selection_str = parts[1].strip()
+                try:
+                    selected_index = int(selection_str) - 1
+                    if 0 <= selected_index < len(solar_options):
+                        selected_option = solar_options[selected_index]
+                        print(f"Selected option by number: {selected_index}")
+                except ValueError:
+                    # Try matching by name if not a number
+                    for option in solar_options:
+                        if option.get('descriptor', {}).get('name', '').lower() in selection_str:
+                            selected_option = option
+                            print(f"Selected option by name: {option.get('descriptor', {}).get('name')}")
+                            break
+
+        # Handle cases where the user might just type the option number or name (less robust parsing)
+        if not selected_option:
+            # Check if input is just a number corresponding to an option
+            try:
+                selected_index = int(user_selection_input.strip()) - 1
+                if 0 <= selected_index < len(solar_options):
+                    selected_option = solar_options[selected_index]
+                    print(f"Selected option by number directly: {selected_index}")
+            except ValueError:
+                # Check if input is an exact match for an option name (case-insensitive)
+                for option in solar_options:
+                    if option.get('descriptor', {}).get('name', '').lower() == user_selection_input.strip():
+                        selected_option = option
+                        print(f"Selected option by exact name match: {user_selection_input}")
+                        break
+    except Exception as e:
+        print(f"Error during option selection parsing: {e}") # Debugging
+    return selected_option
+
+
+def _present_options(state, latest_message, updated, hooks):
+    if isinstance(latest_message, AIMessage):
+        # Agent presented options or asked for a selection; stay to receive the user's choice.
+        updated['current_stage'] = 'present_options'
+        print("Agent message received in present_options, staying in stage.")
+        return
+    if not isinstance(latest_message, HumanMessage):
+        return
+    user_selection_input = latest_message.content.lower()
+    selected_option = None
+    if updated.get('solar_options'):
+        selected_option = _parse_solar_selection(user_selection_input, updated['solar_options'])
+
+    if selected_option:
+        updated['selected_solar_option'] = selected_option
+        # The agent will see selected_solar_option in state and know to call the confirm tool.
+        updated['current_stage'] = 'confirm_solar'
+        print(f"Option selected, transitioning to confirm_solar: {selected_option.get('id')}")
+    elif 'cancel' in user_selection_input or 'stop' in user_selection_input:
+        updated['current_stage'] = 'end' # User wants to stop
+        print("User cancelled, transitioning to end.")
+    else:
+        # Invalid selection, stay in present_options. Agent will reprompt.
+        updated['current_stage'] = 'present_options'
+        print("Invalid selection, staying in present_options.")
+
+
+def _confirm_solar(state, latest_message, updated, hooks):
+    # Expecting ToolMessage output from call_tool (beckn_solar_retail_confirm)
+    if not isinstance(latest_message, ToolMessage):
+        return
+    tool_output = _tool_output(latest_message)
+    if 'error' not in tool_output:
+        order = tool_output.get('message', {}).get('order', {})
+        if order:
+            updated['order_id'] = order.get('id')
+            updated['current_stage'] = 'search_subsidies' # Move to subsidy search
+            print(f"Solar confirmed (Order ID: {updated['order_id']}), transitioning to search_subsidies.")
+        else:
+            updated['current_stage'] = 'provide_status' # Confirmation response unexpected
+            print("Solar confirmation response unexpected, transitioning to provide_status.")
+    else:
+        updated['current_stage'] = 'error'
+        updated['error_message'] = tool_output.get('error', 'Unknown confirm error')
+        print(f"Confirm solar error, transitioning to error: {updated['error_message']}")
+
+
+def _search_subsidies(state, latest_message, updated, hooks):
+    # Expecting ToolMessage output from call_tool (beckn_subsidy_search)
+    if not isinstance(latest_message, ToolMessage):
+        return
+    tool_output = _tool_output(latest_message)
+    if 'error' not in tool_output:
+        subsidy_options = tool_output.get('message', {}).get('catalog', {}).get('items', [])
+        updated['subsidy_search_results'] = subsidy_options
+        if subsidy_options:
+            updated['current_stage'] = 'apply_subsidies' # Move to applying
+            print(f"Subsidies found ({len(subsidy_options)}), transitioning to apply_subsidies.")
+        else:
+            updated['current_stage'] = 'setup_grid_flexibility' # Move to next stage if no subsidies
+            print("No subsidies found, transitioning to setup_grid_flexibility.")
+    else:
+        updated['current_stage'] = 'setup_grid_flexibility' # Continue despite error
+        updated['error_message'] = tool_output.get('error', 'Unknown subsidy search error')
+        print(f"Search subsidies error, transitioning to setup_grid_flexibility: {updated['error_message']}")
+
+
+def _apply_subsidies(state, latest_message, updated, hooks):
+    # Expecting ToolMessage output from call_tool (beckn_subsidy_confirm)
+    if not isinstance(latest_message, ToolMessage):
+        return
+    tool_output = _tool_output(latest_message)
+    if 'error' not in tool_output:
+        order = tool_output.get('message', {}).get('order', {})
+        if order:
+            updated['applied_subsidy_order_id'] = order.get('id')
+            updated['current_stage'] = 'setup_grid_flexibility' # Move to grid flexibility setup
+            print(f"Subsidy applied (ID: {updated['applied_subsidy_order_id']}), transitioning to setup_grid_flexibility.")
+        else:
+            updated['current_stage'] = 'setup_grid_flexibility' # Confirmation response unexpected
+            print("Subsidy confirmation response unexpected, transitioning to setup_grid_flexibility.")
+    else:
+        updated['current_stage'] = 'setup_grid_flexibility' # Continue despite error
+        updated['error_message'] = tool_output.get('error', 'Unknown subsidy confirm error')
+        print(f"Apply subsidies error, transitioning to setup_grid_flexibility: {updated['error_message']}")
+
+
+def _trailing_tool_messages(chat_history):
+    """
+    The ToolMessages of the latest call_tool run (one per tool call of the last AIMessage), in order.
+    """
+    index = len(chat_history)
+    while index > 0 and isinstance(chat_history[index - 1], ToolMessage):
+        index -= 1
+    return chat_history[index:]
+
+
+def _setup_grid_flexibility(state, latest_message, updated, hooks):
+    # Processes the results of the World Engine calls; the agent decides which WE tool to call next.
+    if isinstance(latest_message, ToolMessage):
+        # One AIMessage may create the energy resource, meter and DER together: record every result
+        for tool_message in _trailing_tool_messages(state['chat_history']):
+            tool_output = _tool_output(tool_message)
+            tool_name = tool_message.tool_call_id # Use full tool_call_id to infer tool name
+
+            if 'error' in tool_output:
+                # If a WE tool call failed, transition to error
+                updated['current_stage'] = 'error'
+                updated['error_message'] = tool_output.get('error', f'Unknown error from {tool_name}')
+                print(f"WE tool error ({tool_name}), transitioning to error: {updated['error_message']}")
+                return
+
+            # Update state based on which WE tool succeeded
+            if 'world_engine_create_energy_resource' in tool_name and tool_output.get('data'):
+                updated['energy_resource_id'] = tool_output['data'].get('id')
+                print(f"ER created (ID: {updated['energy_resource_id']}).")
+            elif 'world_engine_create_meter' in tool_name and tool_output.get('data'):
+                updated['meter_id'] = tool_output['data'].get('id')
+                print(f"Meter created (ID: {updated['meter_id']}).")
+            elif 'world_engine_create_der' in tool_name and tool_output.get('data'):
+                der_id = tool_output['data'].get('id')
+                if der_id not in updated['der_ids']:
+                    updated['der_ids'] = updated['der_ids'] + [der_id]
+                print(f"DER created (ID: {der_id}).")
+            elif 'world_engine_get_utilities_data' in tool_name and tool_output.get('utilities'):
+                updated['world_engine_data'] = tool_output # Store fetched utility data
+                print("Utility data fetched.")
+
+        # Stay in this stage for the agent to decide the next WE step
+        updated['current_stage'] = 'setup_grid_flexibility'
+        print("Processed WE tool output, staying in setup_grid_flexibility.")
+
+    elif isinstance(latest_message, (HumanMessage, AIMessage)):
+        # The agent determines which WE tool to call next. Stay in this stage.
+        updated['current_stage'] = 'setup_grid_flexibility'
+        print("Processed message in setup_grid_flexibility, staying in stage.")
+
+    # All required WE setup steps complete (checked after the updates above)
+    if updated.get('energy_resource_id') is not None and updated.get('meter_id') is not None and updated.get('der_ids'):
+        updated['current_stage'] = 'provide_status'
+        print("All WE setup steps complete, transitioning to provide_status.")
+
+
+def _provide_status(state, latest_message, updated, hooks):
+    # Status is provided (by agent message), move to end.
+    updated['current_stage'] = 'end'
+    print("Status provided, transitioning to end.")
+
+
+def _stay(state, latest_message, updated, hooks):
+    # error / end: stay until new user input triggers handle_user_input. END: the graph run is over.
+    pass
+
+
+# stage -> {"handler", "next": stages the handler may move to (staying is always allowed),
+#           "awaits_user": an agent reply ends the turn here, "terminal": the graph run ends}
+STAGES = {
+    'initial': {"handler": _initial, "next": ('gather_info', 'welcome')},
+    'welcome': {"handler": _welcome, "next": ('gather_info',), "awaits_user": True},
+    'gather_info': {"handler": _gather_info, "next": ('search_solar',), "awaits_user": True},
+    'search_solar': {"handler": _search_solar, "next": ('present_options', 'welcome', 'error')},
+    'present_options': {"handler": _present_options, "next": ('confirm_solar', 'end'), "awaits_user": True},
+    'confirm_solar': {"handler": _confirm_solar, "next": ('search_subsidies', 'provide_status', 'error')},
+    'search_subsidies': {"handler": _search_subsidies, "next": ('apply_subsidies', 'setup_grid_flexibility')},
+    'apply_subsidies': {"handler": _apply_subsidies, "next": ('setup_grid_flexibility',)},
+    'setup_grid_flexibility': {"handler": _setup_grid_flexibility, "next": ('provide_status', 'error')},
+    'provide_status': {"handler": _provide_status, "next": ('end',), "awaits_user": True},
+    'error': {"handler": _stay, "awaits_user": True},
+    'end': {"handler": _stay, "awaits_user": True},
+    END: {"handler": _stay, "terminal": True},
+}
+
+# Stages a turn can start in: handle_user_input picks one of these from the user's message
+ENTRY_STAGES = ('initial', 'welcome', 'gather_info')
+
+# Stages in which a new user message starts over at an entry stage. In any other stage that waits
+# for the user (gather_info, present_options, provide_status) the message answers that stage.
+RESTART_STAGES = ('initial', 'welcome', 'end', 'error')
+
+
+def stage_for_user_input(current_stage, user_input, table=STAGES):
+    """
+    Stage a turn starts in: the stage that was waiting for this message, or an entry stage picked
+    from the message by keyword when the session is new, at the welcome, finished or in error.
+    """
+    if current_stage not in RESTART_STAGES and (table.get(current_stage) or {}).get("awaits_user"):
+        return current_stage
+    if any(word in user_input.lower() for word in SOLAR_INTEREST_KEYWORDS):
+        return 'gather_info'
+    return 'welcome' # If the input is not directly about solar, start with welcome
+
+
+def validate_stage_table(table, entry_stages=ENTRY_STAGES):
+    """
+    Checks a stage table and returns a list of problems (empty when it is sound): missing handlers,
+    transitions to undefined stages, stages unreachable from the entry stages, and stages with no
+    exit (no transition out, not waiting for the user and not terminal), where a turn would loop
+    between the agent and update_state until the recursion limit.
+    """
+    problems = []
+    for stage, spec in table.items():
+        if not callable(spec.get("handler")):
+            problems.append(f"Stage '{stage}' has no handler")
+        for target in spec.get("next", ()):
+            if target not in table:
+                problems.append(f"Stage '{stage}' moves to undefined stage '{target}'")
+        exits = [target for target in spec.get("next", ()) if target != stage]
+        if not exits and not spec.get("awaits_user") and not spec.get("terminal"):
+            problems.append(f"Stage '{stage}' has no exit")
+    for stage in entry_stages:
+        if stage not in table:
+            problems.append(f"Entry stage '{stage}' is not defined")
+
+    reachable = set(stage for stage in entry_stages if stage in table)
+    queue = deque(reachable)
+    while queue:
+        for target in table[queue.popleft()].get("next", ()):
+            if target in table and target not in reachable:
+                reachable.add(target)
+                queue.append(target)
+    # END is LangGraph's own end marker, not a stage anything transitions to
+    for stage in table:
+        if stage not in reachable and stage != END:
+            problems.append(f"Stage '{stage}' is unreachable from {list(entry_stages)}")
+    return problems
+
+
+def build_routes(table):
+    """
+    Precomputes next_node_from_stage: {(stage, message kind): route}. Pairs not listed continue
+    to the agent node.
+    """
+    routes = {}
+    for stage, spec in table.items():
+        for kind in (HUMAN, AGENT_REPLY, AGENT_TOOL_CALLS, TOOL_RESULT, NO_MESSAGE):
+            if spec.get("terminal"):
+                routes[(stage, kind)] = END_PROCESS
+            elif spec.get("awaits_user") and kind == AGENT_REPLY:
+                routes[(stage, kind)] = AWAIT_USER
+    return routes
+
+
+class StageMachine:
+    """
+    Drives the agent's stages from a declarative table: update_state is one dict lookup plus the
+    stage's handler, and next_node_from_stage is one lookup in a precomputed routing table.
+
+        machine = StageMachine(STAGES, hooks={"location_detected": prefetch_catalogs})
+        workflow.add_node("update_state", machine.update_state)
+        workflow.add_conditional_edges("update_state", machine.next_node_from_stage, {...})
+    """
+
+    def __init__(self, table=STAGES, entry_stages=ENTRY_STAGES, hooks=None):
+        """
+        Args:
+            table (dict): stage -> {"handler", "next", "awaits_user", "terminal"}, see STAGES.
+            entry_stages (tuple): Stages a turn can start in; everything else must be reachable from them.
+            hooks (dict): Optional callbacks for handlers: "location_detected"() when the user's location
+                          is first seen.
+        """
+        problems = validate_stage_table(table, entry_stages)
+        if problems:
+            raise ValueError("Invalid stage table: " + "; ".join(problems))
+        self.table = table
+        self.hooks = hooks or {}
+        self.handlers = {stage: spec["handler"] for stage, spec in table.items()}
+        self.allowed = {stage: frozenset(spec.get("next", ())) | {stage} for stage, spec in table.items()}
+        self.routes = build_routes(table)
+
+    def update_state(self, state):
+        """
+        Runs the current stage's handler on the latest chat message and returns the updated state.
+        chat_history is left out: the handlers never add messages, and with an appending reducer
+        on chat_history returning it would add the whole log again.
+        """
+        latest_message = state['chat_history'][-1]
+        current_stage = state.get('current_stage', 'initial')
+        updated_state = {key: value for key, value in state.items() if key != 'chat_history'}
+        updated_state['error_message'] = None # Clear error message at the start of update_state
+        updated_state['latest_tool_output_summary'] = None # Clear tool output summary
+
+        handler = self.handlers.get(current_stage)
+        if handler is None:
+            print(f"Unknown stage '{current_stage}', leaving it unchanged.")
+            return updated_state
+        handler(state, latest_message, updated_state, self.hooks)
+        if updated_state['current_stage'] not in self.allowed[current_stage]:
+            print(f"Warning: stage '{current_stage}' moved to undeclared stage '{updated_state['current_stage']}'")
+        return updated_state
+
+    def next_node_from_stage(self, state):
+        """
+        Route after update_state: "end_process", "awaiting_human_input" or "continue_process".
+        """
+        history = state['chat_history']
+        return self.routes.get((state.get('current_stage'), message_kind(history[-1] if history else None)), CONTINUE)
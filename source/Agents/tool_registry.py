@@ -0,0 +1,154 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# Default seconds call_tool waits for a tool before reporting it as failed (0 = no limit)
+TOOL_CALL_TIMEOUT = float(os.getenv("TOOL_CALL_TIMEOUT", "60"))
+# Threads that run tool calls with a timeout; sized for many sessions calling tools at once
+TOOL_INVOKE_MAX_WORKERS = int(os.getenv("TOOL_INVOKE_MAX_WORKERS", "64"))
+
+
+class ToolCallError(Exception):
+    """
+    A tool call that was refused before or instead of running: unknown tool, invalid arguments,
+    a failed resolver, the concurrency limit or the timeout. `reason` is used as metrics label.
+    """
+
+    def __init__(self, message, reason="error"):
+        super().__init__(message)
+        self.reason = reason
+
+
+def _format_validation_error(error):
+    return "; ".join(f"{'.'.join(str(part) for part in detail['loc']) or 'args'}: {detail['msg']}" for detail in error.errors())
+
+
+class ToolSpec:
+    """
+    One registered tool with everything call_tool needs to run it, resolved once at start-up.
+    """
+
+    def __init__(self, tool, injectors=(), resolvers=(), on_success=None, on_failure=None, timeout=None, max_concurrency=None):
+        """
+        Args:
+            tool (BaseTool): The LangChain tool; its args_schema validates the arguments.
+            injectors (list): injector(state, args) fills arguments from the agent state in place. Runs
+                              before validation, so it can supply required arguments the LLM left out.
+            resolvers (list): resolver(state, args) runs after validation and may do I/O (e.g. look up
+                              the meter's parent transformer); raises ToolCallError to refuse the call.
+            on_success (callable): on_success(state, args, output) after a call without an "error" key;
+                                   returns a dict of state updates (or None) for call_tool to apply.
+                                   Like injectors and resolvers it may run on a worker thread next to
+                                   other calls, so none of them may modify `state`.
+            on_failure (callable): on_failure(state, args, error) when a call whose arguments were
+                                   prepared is refused, times out, raises or returns an "error" key,
+                                   e.g. to undo what a resolver reserved.
+            timeout (float): Seconds to wait for the tool; None or 0 runs it inline without a limit. Use
+                             None for writes that are not idempotent: a timed-out call keeps running
+                             and may still succeed after the error was reported.
+            max_concurrency (int): Calls of this tool allowed in flight process-wide; None is unlimited.
+        """
+        self.tool = tool
+        self.name = tool.name
+        self.injectors = tuple(injectors)
+        self.resolvers = tuple(resolvers)
+        self.on_success = on_success
+        self.on_failure = on_failure
+        self.timeout = timeout or None
+        self.max_concurrency = max_concurrency
+        self.semaphore = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self.args_schema = tool.args_schema if hasattr(tool.args_schema, "model_validate") else None
+        self.arg_names = frozenset(self.args_schema.model_fields) if self.args_schema is not None else None
+
+
+class ToolRegistry:
+    """
+    Name -> ToolSpec table used by call_tool. prepare() turns an LLM tool call into validated
+    arguments (unknown arguments dropped, state-derived ones injected, types checked against the
+    tool's schema) before any network I/O; invoke() runs it under the tool's concurrency limit
+    and timeout.
+
+        registry = ToolRegistry()
+        registry.register(world_engine_create_der, injectors=[inject_energy_resource_id], max_concurrency=8)
+        spec, args = registry.prepare("world_engine_create_der", {"appliance_id": 1}, state)
+        output = registry.invoke(spec, args)
+    """
+
+    def __init__(self, default_timeout=TOOL_CALL_TIMEOUT, max_workers=TOOL_INVOKE_MAX_WORKERS):
+        self.default_timeout = default_timeout
+        self._specs = {}
+        self._max_workers = max_workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def register(self, tool, **options):
+        """
+        Registers a tool under its name; options are the ToolSpec arguments. Returns the ToolSpec.
+        """
+        options.setdefault("timeout", self.default_timeout)
+        spec = self._specs[tool.name] = ToolSpec(tool, **options)
+        return spec
+
+    def get(self, name):
+        return self._specs.get(name)
+
+    def prepare(self, name, args, state):
+        """
+        Returns (spec, validated args) for a tool call, or raises ToolCallError.
+        """
+        spec = self._specs.get(name)
+        if spec is None:
+            raise ToolCallError(f"Tool '{name}' not found.", reason="unknown_tool")
+        args = dict(args or {})
+        if spec.arg_names is not None:
+            unknown = [key for key in args if key not in spec.arg_names]
+            if unknown:
+                print(f"Ignoring unknown arguments for {name}: {unknown}")
+                for key in unknown:
+                    del args[key]
+        for injector in spec.injectors:
+            injector(state, args)
+        if spec.args_schema is not None:
+            try:
+                args = spec.args_schema.model_validate(args).model_dump()
+            except ValueError as e: # pydantic's ValidationError is a ValueError
+                raise ToolCallError(f"Invalid arguments for {name}: {_format_validation_error(e)}", reason="invalid_args")
+        for resolver in spec.resolvers:
+            resolver(state, args)
+        return spec, args
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="tool_invoke")
+        return self._executor
+
+    def invoke(self, spec, args):
+        """
+        Runs the tool. Waits at most `timeout` seconds for a concurrency slot and then for the
+        result; a call that times out keeps its slot until it really finishes, so the limit holds.
+        A tool without a timeout still waits at most the registry's default for its slot (nothing
+        has been sent yet, so giving up there is safe).
+        """
+        semaphore = spec.semaphore
+        if semaphore is not None and not semaphore.acquire(timeout=spec.timeout or self.default_timeout or None):
+            raise ToolCallError(f"Tool '{spec.name}' is at its limit of {spec.max_concurrency} concurrent calls.", reason="busy")
+        if spec.timeout is None:
+            try:
+                return spec.tool.invoke(args)
+            finally:
+                if semaphore is not None:
+                    semaphore.release()
+        try:
+            future = self._get_executor().submit(spec.tool.invoke, args)
+        except BaseException:
+            if semaphore is not None:
+                semaphore.release()
+            raise
+        if semaphore is not None:
+            future.add_done_callback(lambda _: semaphore.release())
+        try:
+            return future.result(timeout=spec.timeout)
+        except FutureTimeoutError:
+            raise ToolCallError(f"Tool '{spec.name}' did not finish within {spec.timeout:g}s.", reason="timeout")
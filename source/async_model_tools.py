@@ -0,0 +1,170 @@
+import os
+from typing import Optional
+
+import httpx
+from langchain_core.tools import tool
+
+from source.APIclasses.async_clients import AsyncBecknClient, AsyncWorldEngineClient
+
+# Async counterparts of the tools in source/model_tools.py. Names, arguments and docstrings are
+# kept identical so they can be bound to the LLM in place of the sync tools and run with
+# `tool.ainvoke(args)` without tying up a thread per in-flight HTTP call.
+
+BECKN_BASE_URL = os.getenv("BECKN_BASE_URL")
+WORLD_ENGINE_BASE_URL = os.getenv("WORLD_ENGINE_BASE_URL")
+
+beckn_client = AsyncBecknClient(
+    BECKN_BASE_URL,
+    os.getenv("BECKN_BAP_ID"),
+    os.getenv("BECKN_BAP_URI"),
+    os.getenv("BECKN_BPP_ID"),
+    os.getenv("BECKN_BPP_URI"),
+)
+world_engine_client = AsyncWorldEngineClient(WORLD_ENGINE_BASE_URL)
+
+
+async def _call(coroutine):
+    try:
+        return await coroutine
+    except (httpx.HTTPError, ValueError) as e:
+        return {"error": f"API call failed: {e}"}
+
+
+@tool
+async def beckn_connection_search() -> dict:
+    """
+    Triggers the Search API for Beckn Connection to find available services.
+    Requires provider_id, item_id.
+    """
+    return await _call(beckn_client.search_connection())
+
+@tool
+async def beckn_solar_retail_search() -> dict:
+    """
+    Triggers the Search API for Beckn Solar-Retail and Battery-Retail to find solar and battery product and service offerings.
+    Requires provider_id, item_id.
+    """
+    return await _call(beckn_client.search_solar_retail())
+
+@tool
+async def beckn_solar_retail_select(provider_id: str, item_id: str) -> dict:
+    """
+    Triggers the Select API for Beckn Solar-Retail and Battery-Retail to select a specific solar and battery offering.
+    Requires provider_id, item_id.
+    """
+    return await _call(beckn_client.select_solar_retail(provider_id, item_id))
+
+@tool
+async def beckn_solar_retail_init(provider_id: str, item_id: str) -> dict:
+    """
+    Triggers the Init API for Beckn Solar-Retail to initialize the order/process.
+    Requires provider_id, item_id.
+    """
+    return await _call(beckn_client.init_solar_retail(provider_id, item_id))
+
+@tool
+async def beckn_solar_retail_confirm(provider_id: str, item_id: str, fulfillment_id: str, customer_name: str, customer_phone: str, customer_email: str) -> dict:
+    """
+    Triggers the Confirm API for Beckn Solar-Retail to confirm the order/process.
+    Requires provider_id, item_id, fulfillment_id, customer_name, customer_phone, and customer_email.
+    """
+    return await _call(beckn_client.confirm_solar_retail(provider_id, item_id, fulfillment_id, customer_name, customer_phone, customer_email))
+
+@tool
+async def beckn_solar_retail_status(order_id: str) -> dict:
+    """
+    Triggers the Status API for Beckn Solar-Retail to get the status of an order.
+    Requires order_id.
+    """
+    return await _call(beckn_client.status_solar_retail(order_id))
+
+@tool
+async def beckn_subsidy_search() -> dict:
+    """
+    Triggers the Search API for Beckn Subsidy to find available incentives.
+    Requires no parameters.
+    """
+    return await _call(beckn_client.search_subsidy())
+
+@tool
+async def beckn_subsidy_confirm(provider_id: str, item_id: str, fulfillment_id: str, customer_name: str, customer_phone: str, customer_email: str) -> dict:
+    """
+    Triggers the Confirm API for Beckn Subsidy to apply for an incentive.
+    Requires provider_id, item_id, fulfillment_id, customer_name, customer_phone, and customer_email.
+    """
+    return await _call(beckn_client.confirm_subsidy(provider_id, item_id, fulfillment_id, customer_name, customer_phone, customer_email))
+
+
+# World Engine Sandbox API Functions
+@tool
+async def world_engine_get_utilities_data() -> dict:
+    """
+    Retrieves detailed data about utilities, substations, transformers, and meters from the World Engine.
+    """
+    return await _call(world_engine_client.get_utilities_detailed())
+
+@tool
+async def world_engine_create_meter(code: str, type: str, city: str, state: str, latitude: float, longitude: float, pincode: str, parent: Optional[int] = None, energyResource: Optional[int] = None, consumptionLoadFactor: float = 1.0, productionLoadFactor: float = 0.0) -> dict:
+    """
+    Creates a new meter in the World Engine.
+    Requires code, type, city, state, latitude, longitude, pincode.
+    Optional: parent (Transformer ID), energyResource (Energy Resource ID), consumptionLoadFactor, productionLoadFactor.
+    """
+    return await _call(world_engine_client.create_meter({
+        "code": code,
+        "parent": parent,
+        "energyResource": energyResource,
+        "consumptionLoadFactor": consumptionLoadFactor,
+        "productionLoadFactor": productionLoadFactor,
+        "type": type,
+        "city": city,
+        "state": state,
+        "latitude": latitude,
+        "longitude": longitude,
+        "pincode": pincode
+    }))
+
+@tool
+async def world_engine_create_energy_resource(name: str, meter: Optional[int] = None) -> dict:
+    """
+    Creates a new energy resource (e.g., Household) in the World Engine.
+    Requires name and optional: meter (Meter ID).
+    """
+    return await _call(world_engine_client.create_energy_resource({
+        "name": name,
+        "type": 'CUSTOMER',
+        "meter": meter
+    }))
+
+@tool
+async def world_engine_create_der(energy_resource_id: int, appliance_id: int, switched_on: bool = True) -> dict:
+    """
+    Creates a new Distributed Energy Resource (DER) associated with an energy resource (e.g., a solar panel or smart charger for a household).
+    Requires energy_resource_id and appliance_id. Optional: switched_on (default True).
+    """
+    return await _call(world_engine_client.create_der(energy_resource_id, appliance_id, switched_on))
+
+@tool
+async def world_engine_toggle_der_switching(der_id: int) -> dict:
+    """
+    Toggles the switched_on status of a DER in the World Engine.
+    Requires der_id.
+    """
+    return await _call(world_engine_client.toggle_der_switching(der_id))
+
+
+async_tools = [
+    beckn_connection_search,
+    beckn_solar_retail_search,
+    beckn_solar_retail_select,
+    beckn_solar_retail_init,
+    beckn_solar_retail_confirm,
+    beckn_solar_retail_status,
+    beckn_subsidy_search,
+    beckn_subsidy_confirm,
+    world_engine_get_utilities_data,
+    world_engine_create_meter,
+    world_engine_create_energy_resource,
+    world_engine_create_der,
+    world_engine_toggle_der_switching,
+]
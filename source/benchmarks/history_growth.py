@@ -0,0 +1,110 @@
+"""
+Measures how the cost of one chat turn (and of each graph hop within it) changes with the length of
+the conversation so far. A turn that costs the same at 800 prior messages as at 10 means no node
+copies or rescans the whole chat history.
+
+    python -m source.benchmarks.history_growth
+    python -m source.benchmarks.history_growth --lengths 10 100 1000 --repeat 50 --output history.json
+
+Runs the compiled graph in-process against the mock backend with the scripted LLM. Every turn is
+the same gather_info -> search_solar -> present_options walk (7 hops including one tool call),
+played on top of a pre-built history of the given length. --cold-summary starts without the
+rolling summary a live session carries, which exercises summarizing a long history in one go.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+
+DEFAULT_LENGTHS = [10, 50, 100, 200, 400, 800, 1600]
+TURN_MESSAGE = "I live in the city of San Francisco, pincode 94103, and my bill is about $180. I want rooftop solar."
+
+
+def start_backend():
+    from source.benchmarks.mock_backend import MockBackend
+
+    backend = MockBackend().start()
+    backend_url = f"http://127.0.0.1:{backend.server_address[1]}"
+    os.environ["BECKN_BASE_URL"] = backend_url
+    os.environ["WORLD_ENGINE_BASE_URL"] = backend_url
+    for name, value in (("BECKN_BAP_ID", "history-bap"), ("BECKN_BAP_URI", "http://127.0.0.1/bap"),
+                        ("BECKN_BPP_ID", "history-bpp"), ("BECKN_BPP_URI", backend_url)):
+        os.environ.setdefault(name, value)
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["FAKE_LLM_LATENCY"] = "0"
+    os.environ["SPECULATIVE_DISCOVERY"] = "false" # keep background prefetches out of the timings
+    return backend
+
+
+def build_state(initial_state, length, cold_summary=False):
+    """
+    Session state with `length` earlier messages (alternating user / agent) and the next user message as input.
+    With cold_summary the rolling summary is empty, so the turn has to summarize the whole history.
+    """
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    from source.Agents.context_window import build_llm_context
+
+    state = json.loads(json.dumps(initial_state, default=str))
+    state["chat_history"] = [
+        HumanMessage(content=f"Earlier question {index}: what about batteries and net metering?") if index % 2 == 0
+        else AIMessage(content=f"Earlier answer {index}: batteries store midday solar for the evening peak.")
+        for index in range(length)
+    ]
+    if not cold_summary:
+        # A live session carries the rolling summary of its older turns; start from the same point
+        _, state["history_summary"], state["summarized_message_count"] = build_llm_context("", state["chat_history"])
+    state["input"] = TURN_MESSAGE
+    return state
+
+
+def measure(graph, state, repeat):
+    """
+    Returns (hops per turn, best seconds per turn, messages added per turn) over `repeat` turns.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        hops = sum(1 for _ in graph.stream(state, stream_mode="updates"))
+        result = graph.invoke(state)
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            graph.invoke(state)
+            best = min(best, time.perf_counter() - started)
+    return hops, best, len(result["chat_history"]) - len(state["chat_history"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-turn and per-hop graph cost as the chat history grows.")
+    parser.add_argument("--lengths", type=int, nargs="+", default=DEFAULT_LENGTHS, help="prior messages per run")
+    parser.add_argument("--repeat", type=int, default=20, help="turns timed per length (the best is reported)")
+    parser.add_argument("--cold-summary", action="store_true",
+                        help="no rolling summary yet (restored or imported session): every turn summarizes all older messages")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    start_backend()
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as chat_app
+        from source.langgraph_parts import get_app
+        graph = get_app()
+
+    rows = []
+    print(f"{'messages':>8} {'hops':>5} {'added':>6} {'ms/turn':>9} {'us/hop':>9}")
+    for length in args.lengths:
+        hops, seconds, added = measure(graph, build_state(chat_app.LANGGRAPH_INITIAL_STATE, length, args.cold_summary), args.repeat)
+        rows.append({"messages": length, "hops": hops, "messages_added": added,
+                     "seconds_per_turn": seconds, "seconds_per_hop": seconds / hops})
+        print(f"{length:>8} {hops:>5} {added:>6} {seconds * 1000:>9.2f} {seconds / hops * 1e6:>9.1f}")
+    growth = rows[-1]["seconds_per_hop"] / rows[0]["seconds_per_hop"]
+    print(f"per-hop cost at {rows[-1]['messages']} vs {rows[0]['messages']} messages: {growth:.2f}x")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"rows": rows, "per_hop_growth": growth, "config": vars(args)}, f, indent=2)
+    return rows
+
+
+if __name__ == "__main__":
+    main()
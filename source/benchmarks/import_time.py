@@ -0,0 +1,72 @@
+"""
+Measures the cold import time of the app's entry modules and fails when it exceeds the budget.
+
+    python -m source.benchmarks.import_time                      # source.langgraph_parts and app
+    python -m source.benchmarks.import_time --budget-ms 1000 --top 15 source.model_tools
+
+Each module is imported in a fresh interpreter with `-X importtime`, so the numbers include every
+dependency it pulls in. Exit status 1 means at least one module is over budget.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+DEFAULT_MODULES = ["source.langgraph_parts", "app"]
+DEFAULT_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "1500"))
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+# Import only needs these to be set, not reachable
+PLACEHOLDER_ENV = {
+    "BECKN_BASE_URL": "http://127.0.0.1:1",
+    "WORLD_ENGINE_BASE_URL": "http://127.0.0.1:1",
+    "BECKN_BAP_ID": "import-time",
+    "BECKN_BAP_URI": "http://127.0.0.1:1",
+    "BECKN_BPP_ID": "import-time",
+    "BECKN_BPP_URI": "http://127.0.0.1:1",
+}
+
+
+def measure(module, cwd=None):
+    """
+    Imports `module` in a fresh interpreter. Returns (total microseconds, [(cumulative us, depth, name)]).
+    """
+    env = {**PLACEHOLDER_ENV, **os.environ}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    entries = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            entries.append((int(match.group(2)), len(match.group(3)) // 2, match.group(4)))
+    total = next((cumulative for cumulative, depth, name in reversed(entries) if name == module and depth == 0), 0)
+    return total, entries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check cold import time against a budget.")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=10, help="slowest direct dependencies to list per module")
+    args = parser.parse_args(argv)
+
+    over_budget = False
+    for module in args.modules:
+        total, entries = measure(module)
+        status = "OK" if total / 1000 <= args.budget_ms else "OVER BUDGET"
+        over_budget |= status != "OK"
+        print(f"{module}: {total / 1000:.0f} ms (budget {args.budget_ms:.0f} ms) {status}")
+        direct = sorted((entry for entry in entries if entry[1] == 1), reverse=True)[:args.top]
+        for cumulative, _, name in direct:
+            print(f"  {cumulative / 1000:8.1f} ms  {name}")
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
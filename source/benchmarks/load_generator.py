@@ -0,0 +1,336 @@
+"""
+Replays multi-turn conversations against /api/chat with N concurrent sessions and reports per-turn
+latency percentiles, throughput, error rate and peak RSS.
+
+    # Self-contained: starts the mock Beckn/World Engine backend, the scripted LLM and app.py in-process
+    python -m source.benchmarks.load_generator --sessions 200 --concurrency 20 --llm-latency 0.05
+
+    # Against an already running server (pass its PID to sample its RSS)
+    python -m source.benchmarks.load_generator --url http://127.0.0.1:5000 --server-pid 12345
+
+Results can be written with --output for comparison between releases. With the default journey the
+report also checks that every scripted stage, tool call and (in-process) backend endpoint was reached,
+and the run exits non-zero when one was not.
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+try:
+    import psutil
+except ImportError: # psutil is optional, peak RSS then falls back to getrusage for this process
+    psutil = None
+
+# greeting -> gather_info -> search -> present options -> select, which runs confirm -> subsidies ->
+# grid flexibility -> status in one turn (those stages don't wait for the user)
+DEFAULT_CONVERSATION = [
+    "Hi there!",
+    "I'm interested in rooftop solar for my home.",
+    "I live in the city of San Francisco, state California, pincode 94103. My monthly bill is about $180. My name is Alex Doe, 415-555-0199, alex@example.com",
+    "Sounds good, show me the solar options.",
+    "select 1",
+]
+# Stage every turn of DEFAULT_CONVERSATION should end in
+DEFAULT_EXPECTED_STAGES = ["welcome", "gather_info", "present_options", "present_options", "end"]
+# Tools and mock backend endpoints the default journey must reach; a run that misses one is incomplete
+DEFAULT_EXPECTED_TOOLS = (
+    "beckn_solar_retail_search", "beckn_solar_retail_confirm", "beckn_subsidy_search", "beckn_subsidy_confirm",
+    "world_engine_create_energy_resource", "world_engine_create_meter", "world_engine_create_der",
+)
+DEFAULT_EXPECTED_ENDPOINTS = ("POST /search", "POST /confirm", "POST /energy-resources", "POST /meters", "POST /der")
+
+
+def percentile(sorted_values, q):
+    """
+    Nearest-rank percentile of an already sorted list (q in 0..100).
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, int(-(-q * len(sorted_values) // 100))) # ceil(q/100 * n)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def load_conversations(path):
+    """
+    Reads recorded conversations from a JSONL file: one conversation per line, either a list of user
+    messages or {"turns": [...]}.
+    """
+    conversations = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            conversations.append(record["turns"] if isinstance(record, dict) else record)
+    return conversations
+
+
+class RssSampler:
+    """
+    Samples the resident set size of a process in a background thread and keeps the peak.
+    """
+
+    def __init__(self, pid=None, interval=0.05):
+        self.pid = pid or os.getpid()
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        process = psutil.Process(self.pid)
+        while not self._stop.is_set():
+            try:
+                self.peak = max(self.peak, process.memory_info().rss)
+            except psutil.Error:
+                return
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if psutil is not None:
+            self._thread = threading.Thread(target=self._sample, name="rss_sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.peak == 0 and self.pid == os.getpid():
+            # ru_maxrss is KiB on Linux, bytes on macOS
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.peak = max_rss if sys.platform == "darwin" else max_rss * 1024
+        return self.peak
+
+
+class LoadGenerator:
+    def __init__(self, base_url, conversations, sessions=50, concurrency=10, timeout=120.0, think_time=0.0):
+        """
+        Args:
+            base_url (str): Root URL of the app, e.g. "http://127.0.0.1:5000".
+            conversations (list): Conversations (lists of user messages); session i replays
+                                  conversations[i % len(conversations)].
+            sessions (int): Total number of sessions to run.
+            concurrency (int): Sessions running at the same time.
+            timeout (float): Per-request timeout in seconds.
+            think_time (float): Pause between the turns of one session, in seconds.
+        """
+        self.chat_url = f"{base_url.rstrip('/')}/api/chat"
+        self.conversations = conversations
+        self.sessions = sessions
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.think_time = think_time
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def run_session(self, index):
+        """
+        Replays one conversation. Returns a list of (turn index, latency seconds, ok, stage, tool calls),
+        with the stage the turn ended in and the tools it called taken from the response's "debug".
+        A turn that ends in the error stage is not ok.
+        """
+        session_id = f"load-{index}-{uuid.uuid4().hex[:8]}"
+        results = []
+        for turn, message in enumerate(self.conversations[index % len(self.conversations)]):
+            start = time.perf_counter()
+            stage, tool_calls = None, []
+            try:
+                response = self._session().post(self.chat_url, json={"user_message": message, "session_id": session_id},
+                                                timeout=self.timeout)
+                body = response.json()
+                debug = body.get("debug") or {}
+                stage, tool_calls = debug.get("stage"), debug.get("tool_calls") or []
+                ok = response.status_code == 200 and "ai_responses" in body and stage != "error"
+            except (requests.exceptions.RequestException, ValueError):
+                ok = False
+            results.append((turn, time.perf_counter() - start, ok, stage, tool_calls))
+            if self.think_time:
+                time.sleep(self.think_time)
+        return results
+
+    def run(self):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="load_session") as executor:
+            per_session = list(executor.map(self.run_session, range(self.sessions)))
+        elapsed = time.perf_counter() - start
+        return summarize([result for results in per_session for result in results], elapsed)
+
+
+def summarize(results, elapsed):
+    latencies = sorted(latency for _, latency, _, _, _ in results)
+    errors = sum(1 for _, _, ok, _, _ in results if not ok)
+    by_turn = {}
+    stages_by_turn = {}
+    tool_calls = {}
+    for turn, latency, _, stage, called in results:
+        by_turn.setdefault(turn, []).append(latency)
+        stages = stages_by_turn.setdefault(str(turn), {})
+        stages[str(stage)] = stages.get(str(stage), 0) + 1
+        for name in called:
+            tool_calls[name] = tool_calls.get(name, 0) + 1
+
+    def describe(values):
+        values = sorted(values)
+        return {
+            "count": len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "max": values[-1] if values else None,
+        }
+
+    return {
+        "turns": len(results),
+        "errors": errors,
+        "error_rate": errors / len(results) if results else 0.0,
+        "elapsed_seconds": elapsed,
+        "throughput_turns_per_second": len(results) / elapsed if elapsed else 0.0,
+        "latency": describe(latencies),
+        "latency_by_turn": {str(turn): describe(values) for turn, values in sorted(by_turn.items())},
+        "stages_by_turn": stages_by_turn,
+        "tool_calls": tool_calls,
+    }
+
+
+def check_journey(report, expected_stages, expected_tools=(), expected_endpoints=(), backend_requests=None):
+    """
+    Compares a report with the journey a conversation is scripted to take. Returns
+    {"complete", "missing", "off_script"}: "missing" lists expected stages, tools and backend
+    endpoints no session reached (the run did not exercise them, so it is incomplete);
+    "off_script" counts, per turn, sessions that ended the turn in another stage than expected.
+    """
+    reached_stages = {stage for stages in report["stages_by_turn"].values() for stage in stages}
+    missing = [f"stage {stage}" for stage in dict.fromkeys(expected_stages) if stage not in reached_stages]
+    missing += [f"tool {name}" for name in expected_tools if not report["tool_calls"].get(name)]
+    if backend_requests is not None:
+        missing += [f"endpoint {route}" for route in expected_endpoints if not backend_requests.get(route)]
+    off_script = {}
+    for turn, expected in enumerate(expected_stages):
+        stages = report["stages_by_turn"].get(str(turn), {})
+        other = {stage: count for stage, count in stages.items() if stage != expected}
+        if other:
+            off_script[str(turn)] = {"expected": expected, "got": other}
+    return {"complete": not missing, "missing": missing, "off_script": off_script}
+
+
+def start_local_stack(args):
+    """
+    Starts the mock backend and app.py (scripted LLM) in this process. Returns (app base URL, backend).
+    """
+    from source.benchmarks.mock_backend import MockBackend
+
+    backend = MockBackend(beckn_latency=args.backend_latency, world_engine_latency=args.backend_latency,
+                          error_rate=args.backend_error_rate, seed=args.seed)
+    backend_url = f"http://127.0.0.1:{backend.start().server_address[1]}"
+    os.environ["BECKN_BASE_URL"] = backend_url
+    os.environ["WORLD_ENGINE_BASE_URL"] = backend_url
+    for name, value in (("BECKN_BAP_ID", "load-bap"), ("BECKN_BAP_URI", "http://127.0.0.1/bap"),
+                        ("BECKN_BPP_ID", "load-bpp"), ("BECKN_BPP_URI", backend_url)):
+        os.environ.setdefault(name, value)
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["FAKE_LLM_LATENCY"] = str(args.llm_latency)
+    os.environ["CHAT_DEBUG_INFO"] = "true" # journey checks need each turn's end stage and tool calls
+
+    from werkzeug.serving import make_server
+
+    import app as chat_app
+
+    server = make_server("127.0.0.1", 0, chat_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="chat_app", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", backend
+
+
+def print_report(report, peak_rss):
+    latency = report["latency"]
+    print(f"turns: {report['turns']}  errors: {report['errors']} ({report['error_rate']:.2%})")
+    print(f"throughput: {report['throughput_turns_per_second']:.1f} turns/s over {report['elapsed_seconds']:.1f}s")
+    if latency["count"]:
+        print(f"latency p50/p95/p99/max: {latency['p50'] * 1000:.1f} / {latency['p95'] * 1000:.1f} / "
+              f"{latency['p99'] * 1000:.1f} / {latency['max'] * 1000:.1f} ms")
+    for turn, stats in report["latency_by_turn"].items():
+        print(f"  turn {turn:>2}: p50 {stats['p50'] * 1000:8.1f} ms  p95 {stats['p95'] * 1000:8.1f} ms  p99 {stats['p99'] * 1000:8.1f} ms")
+    print(f"peak RSS: {peak_rss / (1024 * 1024):.1f} MiB")
+    for turn, stages in report["stages_by_turn"].items():
+        print(f"  turn {turn:>2} ended in: {', '.join(f'{stage} x{count}' for stage, count in stages.items())}")
+    print(f"tool calls: {', '.join(f'{name} x{count}' for name, count in report['tool_calls'].items()) or 'none'}")
+    if report.get("backend_requests") is not None:
+        print(f"backend requests: {', '.join(f'{route} x{count}' for route, count in report['backend_requests'].items())}")
+    journey = report.get("journey")
+    if journey is not None:
+        for turn, details in journey["off_script"].items():
+            print(f"  turn {turn:>2} off script: expected {details['expected']}, got {details['got']}")
+        print("journey: complete" if journey["complete"] else f"journey: INCOMPLETE, never reached {', '.join(journey['missing'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay conversations against /api/chat and report latency.")
+    parser.add_argument("--url", help="base URL of a running app; omit to start mock backend + app in-process")
+    parser.add_argument("--server-pid", type=int, help="PID of the server whose peak RSS is reported (with --url)")
+    parser.add_argument("--conversations", help="JSONL file of recorded conversations (default: synthetic journey)")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds between turns of one session")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="scripted LLM latency per call (in-process only)")
+    parser.add_argument("--backend-latency", type=float, default=0.0, help="mock backend latency (in-process only)")
+    parser.add_argument("--backend-error-rate", type=float, default=0.0, help="mock backend error rate (in-process only)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--quiet-app", action="store_true", help="silence the app's print() logging (in-process only)")
+    args = parser.parse_args(argv)
+
+    conversations = load_conversations(args.conversations) if args.conversations else [DEFAULT_CONVERSATION]
+
+    backend = None
+    if args.url:
+        base_url = args.url
+        sampler = RssSampler(pid=args.server_pid)
+    else:
+        base_url, backend = start_local_stack(args)
+        sampler = RssSampler()
+    if args.quiet_app and not args.url:
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        sys.stdout = open(os.devnull, "w")
+
+    sampler.start()
+    try:
+        report = LoadGenerator(base_url, conversations, sessions=args.sessions, concurrency=args.concurrency,
+                               timeout=args.timeout, think_time=args.think_time).run()
+    finally:
+        peak_rss = sampler.stop()
+        if sys.stdout is not sys.__stdout__:
+            sys.stdout.close()
+            sys.stdout = sys.__stdout__
+
+    report["peak_rss_bytes"] = peak_rss
+    report["backend_requests"] = backend.stats()["requests"] if backend is not None else None
+    # Recorded conversations have no script to check against
+    report["journey"] = None if args.conversations else check_journey(
+        report, DEFAULT_EXPECTED_STAGES, DEFAULT_EXPECTED_TOOLS, DEFAULT_EXPECTED_ENDPOINTS, report["backend_requests"])
+    report["config"] = {key: value for key, value in vars(args).items() if key not in ("output",)}
+    print_report(report, peak_rss)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    # Non-zero exit when the scripted journey did not reach every stage, tool and endpoint
+    sys.exit(0 if (main().get("journey") or {"complete": True})["complete"] else 1)
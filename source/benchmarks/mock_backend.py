@@ -0,0 +1,601 @@
+"""
+Local stand-in for the Beckn BPP sandbox and the World Engine API, for load tests and offline runs.
+
+    python -m source.benchmarks.mock_backend --port 8090 --retail-items 50 --latency 0.05 --error-rate 0.01
+
+Point both BECKN_BASE_URL and WORLD_ENGINE_BASE_URL at http://127.0.0.1:8090. Catalogs and the grid
+are generated from a seed, so two runs with the same arguments serve identical data.
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import urllib.request
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+try:
+    import orjson
+except ImportError: # orjson is optional, the stdlib encoder is only slower
+    orjson = None
+
+BECKN_ACTIONS = ("search", "select", "init", "confirm", "status")
+BECKN_DOMAINS = ("deg:retail", "deg:service", "deg:schemes")
+
+# Grid centre used for generated substations/transformers (San Francisco, like the client docstrings)
+GRID_CENTER = (37.7749, -122.4194)
+
+
+def _dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def _timestamp(moment=None):
+    return (moment or datetime.utcnow()).strftime('%Y-%m-%dT%H:%M:%S.%fZ')[:-4] + 'Z'
+
+
+class MockBackend:
+    """
+    In-memory Beckn BPP + World Engine. Catalogs are pre-serialized once at start-up so the mock
+    itself stays cheap per request; orders, meters, energy resources and DERs are kept in dicts and
+    reset by PUT /utility/reset.
+    """
+
+    def __init__(self, retail_items=20, service_items=10, scheme_items=10, providers=4,
+                 utilities=1, substations=4, transformers=25, transformer_max_meters=50,
+                 grid_load_points=96, dataset_points=96,
+                 beckn_latency=0.0, world_engine_latency=0.0, jitter=0.0,
+                 error_rate=0.0, error_status=500, callback_bpps=0, seed=0):
+        """
+        Args:
+            retail_items (int): Items in the deg:retail (solar products) catalog.
+            service_items (int): Items in the deg:service (connection / installation) catalog.
+            scheme_items (int): Items in the deg:schemes (subsidies, DFP programs) catalog.
+            providers (int): Providers the items of each catalog are spread across.
+            utilities (int): Utilities in the generated grid.
+            substations (int): Substations per utility.
+            transformers (int): Transformers per substation.
+            transformer_max_meters (int): `max_meters` advertised by every transformer.
+            grid_load_points (int): Time steps per transformer in /grid-loads.
+            dataset_points (int): Records per meter dataset in /meter-datasets/{id}.
+            beckn_latency (float): Seconds added to every Beckn response.
+            world_engine_latency (float): Seconds added to every World Engine response.
+            jitter (float): Up to this many extra seconds, drawn uniformly per request.
+            error_rate (float): Probability (0..1) that a request fails with `error_status`.
+            error_status (int): HTTP status used for injected failures.
+            callback_bpps (int): 0 answers Beckn calls synchronously. N > 0 ACKs them and POSTs the
+                                 answer to context.bap_uri + "/on_<action>" instead, with every
+                                 search answered by N BPPs that each own a share of the providers.
+            seed (int): Seed for catalogs, grid and injected latency/errors.
+        """
+        self.providers = providers
+        self.utilities = utilities
+        self.substations = substations
+        self.transformers = transformers
+        self.transformer_max_meters = transformer_max_meters
+        self.grid_load_points = grid_load_points
+        self.dataset_points = dataset_points
+        self.beckn_latency = beckn_latency
+        self.world_engine_latency = world_engine_latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.callback_bpps = callback_bpps
+        self.seed = seed
+        self.catalog_sizes = {"deg:retail": retail_items, "deg:service": service_items, "deg:schemes": scheme_items}
+
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.counters = {} # "METHOD /route" -> requests served
+        self.injected_errors = 0
+
+        self._catalogs = {domain: self._build_catalog(domain, size) for domain, size in self.catalog_sizes.items()}
+        self._catalog_bytes = {domain: _dumps(catalog) for domain, catalog in self._catalogs.items()}
+        self._items = {domain: {item["id"]: item for item in catalog["items"]} for domain, catalog in self._catalogs.items()}
+        # Callback mode: per domain, the catalog share of each BPP (providers dealt round-robin)
+        self._catalog_shards = {
+            domain: [_dumps(self._catalog_shard(catalog, bpp)) for bpp in range(callback_bpps)]
+            for domain, catalog in self._catalogs.items()
+        }
+        self.callbacks_sent = 0
+        self.callback_failures = 0
+        self.reset()
+
+    # --- Generated data ---
+
+    def _build_catalog(self, domain, size):
+        rng = random.Random(f"{self.seed}:{domain}")
+        short = domain.split(":", 1)[1]
+        providers = [
+            {"id": f"{short}-provider-{p}", "descriptor": {"name": f"{short.title()} Provider {p}"}}
+            for p in range(1, self.providers + 1)
+        ]
+        items = []
+        for i in range(1, size + 1):
+            provider = providers[(i - 1) % len(providers)]
+            items.append({
+                "id": f"{short}-item-{i}",
+                "descriptor": {"name": f"{short.title()} offer {i}", "short_desc": f"Generated {short} offer {i}"},
+                "price": {"currency": "USD", "value": str(round(rng.uniform(50, 15000), 2))},
+                "provider": provider,
+                "fulfillment_ids": [f"{short}-fulfillment-1"],
+                "tags": [{"descriptor": {"code": "capacity_kw"}, "value": str(round(rng.uniform(1, 12), 1))}],
+            })
+        return {"descriptor": {"name": f"Mock {domain} catalog"}, "providers": providers, "items": items}
+
+    def _catalog_shard(self, catalog, bpp):
+        providers = [provider for index, provider in enumerate(catalog["providers"]) if index % self.callback_bpps == bpp]
+        provider_ids = {provider["id"] for provider in providers}
+        items = [item for item in catalog["items"] if item["provider"]["id"] in provider_ids]
+        return {**catalog, "providers": providers, "items": items}
+
+    def _build_grid(self):
+        rng = random.Random(f"{self.seed}:grid")
+        utilities = []
+        transformer_id = 1
+        substation_id = 1
+        for u in range(1, self.utilities + 1):
+            substations = []
+            for _ in range(self.substations):
+                base_lat = GRID_CENTER[0] + rng.uniform(-0.2, 0.2)
+                base_lon = GRID_CENTER[1] + rng.uniform(-0.2, 0.2)
+                transformers = []
+                for _ in range(self.transformers):
+                    transformers.append({
+                        "id": transformer_id,
+                        "name": f"Transformer {transformer_id}",
+                        "latitude": round(base_lat + rng.uniform(-0.02, 0.02), 6),
+                        "longitude": round(base_lon + rng.uniform(-0.02, 0.02), 6),
+                        "max_meters": self.transformer_max_meters,
+                        "capacity_kw": round(rng.uniform(100, 500), 1),
+                        "meters": [],
+                    })
+                    transformer_id += 1
+                substations.append({"id": substation_id, "name": f"Substation {substation_id}", "transformers": transformers})
+                substation_id += 1
+            utilities.append({"id": u, "name": f"Utility {u}", "substations": substations})
+        return {"utilities": utilities}
+
+    def reset(self):
+        with self._lock:
+            self._grid = self._build_grid()
+            self._transformers = {
+                transformer["id"]: transformer
+                for utility in self._grid["utilities"]
+                for substation in utility["substations"]
+                for transformer in substation["transformers"]
+            }
+            self._grid_bytes = None # re-serialized lazily after meters change
+            self._orders = {}
+            self._meters = {}
+            self._energy_resources = {}
+            self._ders = {}
+            self._next_id = {"meter": 1, "energy_resource": 1, "der": 1}
+            self._idempotent_responses = {} # (route, Idempotency-Key) -> (status, body)
+            self.idempotent_replays = 0
+
+    def _new_id(self, kind):
+        identifier = self._next_id[kind]
+        self._next_id[kind] += 1
+        return identifier
+
+    # --- Request plumbing ---
+
+    def _count(self, route):
+        with self._lock:
+            self.counters[route] = self.counters.get(route, 0) + 1
+
+    def _delay(self, base):
+        with self._random_lock:
+            delay = base + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+            fail = self.error_rate > 0 and self._random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        return fail
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": dict(self.counters),
+                "injected_errors": self.injected_errors,
+                "callbacks_sent": self.callbacks_sent,
+                "callback_failures": self.callback_failures,
+                "idempotent_replays": self.idempotent_replays,
+                "orders": len(self._orders),
+                "meters": len(self._meters),
+                "energy_resources": len(self._energy_resources),
+                "ders": len(self._ders),
+            }
+
+    def handle(self, method, path, query, body, headers=None):
+        """
+        Dispatches one request. Returns (status, response body bytes). A POST carrying an
+        Idempotency-Key header that was already answered gets the stored answer again.
+        """
+        route = re.sub(r"/\d+", "/{id}", path.rstrip("/") or "/")
+        self._count(f"{method} {route}")
+
+        if route == "/__mock__/stats":
+            return 200, _dumps(self.stats())
+
+        action = route.lstrip("/")
+        is_beckn = method == "POST" and action in BECKN_ACTIONS
+        # In callback mode the ACK is immediate and beckn_latency delays the on_* callbacks instead
+        base_latency = self.world_engine_latency if not is_beckn else 0.0 if self.callback_bpps else self.beckn_latency
+        if self._delay(base_latency):
+            with self._lock:
+                self.injected_errors += 1
+            return self.error_status, _dumps({"error": {"code": "MOCK_INJECTED", "message": "Injected failure"}})
+
+        idempotency_key = (headers or {}).get("Idempotency-Key") if method == "POST" else None
+        if idempotency_key:
+            with self._lock:
+                replay = self._idempotent_responses.get((route, idempotency_key))
+                if replay is not None:
+                    self.idempotent_replays += 1
+                    return replay
+            status, data = self._dispatch(method, route, path, query, body, action, is_beckn)
+            if status < 500:
+                with self._lock:
+                    self._idempotent_responses[(route, idempotency_key)] = (status, data)
+            return status, data
+        return self._dispatch(method, route, path, query, body, action, is_beckn)
+
+    def _dispatch(self, method, route, path, query, body, action, is_beckn):
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            return 400, _dumps({"error": {"code": "BAD_JSON", "message": "Request body is not valid JSON"}})
+
+        if is_beckn:
+            if self.callback_bpps:
+                return self._beckn_with_callbacks(action, payload)
+            return self._beckn(action, payload)
+        return self._world_engine(method, route, path, query, payload)
+
+    # --- Beckn ---
+
+    def _beckn(self, action, payload):
+        context = dict(payload.get("context") or {})
+        domain = context.get("domain")
+        if domain not in self._catalogs:
+            return 400, _dumps({"error": {"code": "UNKNOWN_DOMAIN", "message": f"Unsupported domain {domain}"}})
+        context["action"] = f"on_{action}"
+        context["timestamp"] = _timestamp()
+        message = payload.get("message") or {}
+
+        if action == "search":
+            # Splice the pre-serialized catalog instead of re-encoding it on every search
+            return 200, b'{"context":' + _dumps(context) + b',"message":{"catalog":' + self._catalog_bytes[domain] + b'}}'
+
+        if action == "status":
+            order_id = (message.get("order_id") or (message.get("order") or {}).get("id"))
+            with self._lock:
+                order = self._orders.get(order_id)
+            if order is None:
+                return 404, _dumps({"context": context, "error": {"code": "ORDER_NOT_FOUND", "message": f"Unknown order {order_id}"}})
+            return 200, _dumps({"context": context, "message": {"order": {**order, "status": "COMPLETE"}}})
+
+        order = message.get("order") or {}
+        provider_id = (order.get("provider") or {}).get("id")
+        items = order.get("items") or []
+        item_id = items[0].get("id") if items else None
+        item = self._items[domain].get(item_id)
+        if item is None or item["provider"]["id"] != provider_id:
+            return 404, _dumps({"context": context, "error": {"code": "ITEM_NOT_FOUND", "message": f"Unknown item {item_id} for provider {provider_id}"}})
+
+        response_order = {
+            "provider": item["provider"],
+            "items": [item],
+            "quote": {"price": item["price"]},
+            "fulfillments": order.get("fulfillments") or [{"id": item["fulfillment_ids"][0]}],
+        }
+        if action == "confirm":
+            response_order["id"] = f"order-{uuid.uuid4().hex[:12]}"
+            response_order["status"] = "ACTIVE"
+            with self._lock:
+                self._orders[response_order["id"]] = response_order
+        return 200, _dumps({"context": context, "message": {"order": response_order}})
+
+    def _beckn_with_callbacks(self, action, payload):
+        """
+        ACKs the request and answers it through on_<action> callbacks to context.bap_uri from
+        background threads: one per BPP for search, a single one otherwise.
+        """
+        context = payload.get("context") or {}
+        bap_uri = context.get("bap_uri")
+        if not bap_uri:
+            return 400, _dumps({"message": {"ack": {"status": "NACK"}}, "error": {"code": "NO_BAP_URI", "message": "context.bap_uri is required"}})
+        status, body = self._beckn(action, payload)
+        if status != 200:
+            return status, body
+        callback_url = f"{bap_uri.rstrip('/')}/on_{action}"
+        if action == "search":
+            answer = json.loads(body)
+            domain = context.get("domain")
+            bodies = []
+            for bpp, shard in enumerate(self._catalog_shards[domain]):
+                bpp_context = {**answer["context"], "bpp_id": f"mock-bpp-{bpp + 1}"}
+                bodies.append(b'{"context":' + _dumps(bpp_context) + b',"message":{"catalog":' + shard + b'}}')
+        else:
+            bodies = [body]
+        for callback_body in bodies:
+            threading.Thread(target=self._send_callback, args=(callback_url, callback_body), daemon=True).start()
+        return 200, _dumps({"message": {"ack": {"status": "ACK"}}})
+
+    def _send_callback(self, url, body):
+        if self._delay(self.beckn_latency): # injected failure: the callback is lost
+            with self._lock:
+                self.callback_failures += 1
+            return
+        request = urllib.request.Request(url, data=body, method="POST", headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                response.read()
+            ok = True
+        except OSError:
+            ok = False
+        with self._lock:
+            if ok:
+                self.callbacks_sent += 1
+            else:
+                self.callback_failures += 1
+
+    # --- World Engine ---
+
+    def _world_engine(self, method, route, path, query, payload):
+        ids = [int(part) for part in re.findall(r"/(\d+)", path)]
+
+        if route == "/utility/detailed" and method == "GET":
+            with self._lock:
+                if self._grid_bytes is None:
+                    self._grid_bytes = _dumps(self._grid)
+                return 200, self._grid_bytes
+        if route == "/utility/reset" and method == "PUT":
+            self.reset()
+            return 200, _dumps({"message": "World Engine data reset"})
+        if route == "/grid-loads" and method == "GET":
+            return 200, _dumps(self._grid_loads())
+
+        if route == "/meters" and method == "POST":
+            return self._create_meter(payload.get("data") or {})
+        if route == "/meters" and method == "GET":
+            return self._list_meters(query)
+        if route == "/meters/{id}":
+            return self._get_or_delete(self._meters, "Meter", ids[0], method)
+        if route == "/meter-datasets/{id}" and method == "GET":
+            return 200, _dumps(self._meter_dataset(ids[0]))
+
+        if route == "/energy-resources" and method == "POST":
+            data = payload.get("data") or {}
+            with self._lock:
+                record = {"id": self._new_id("energy_resource"), "name": data.get("name"),
+                          "type": data.get("type", "CONSUMER"), "meter": data.get("meter")}
+                self._energy_resources[record["id"]] = record
+            return 200, _dumps({"data": record})
+        if route == "/energy-resources/{id}":
+            return self._get_or_delete(self._energy_resources, "Energy resource", ids[0], method)
+
+        if route == "/der" and method == "POST":
+            energy_resource_id = payload.get("energy_resource")
+            with self._lock:
+                if energy_resource_id not in self._energy_resources:
+                    return 404, _dumps({"error": {"message": f"Energy resource {energy_resource_id} not found"}})
+                record = {"id": self._new_id("der"), "energy_resource": energy_resource_id,
+                          "appliance": payload.get("appliance"), "switched_on": payload.get("switched_on", False)}
+                self._ders[record["id"]] = record
+            return 200, _dumps({"data": record})
+        if route == "/toggle-der/{id}" and method == "POST":
+            with self._lock:
+                record = self._ders.get(ids[0])
+                if record is None:
+                    return 404, _dumps({"error": {"message": f"DER {ids[0]} not found"}})
+                record["switched_on"] = not record["switched_on"]
+                return 200, _dumps({"data": dict(record)})
+
+        return 404, _dumps({"error": {"message": f"No mock route for {method} {path}"}})
+
+    def _get_or_delete(self, records, label, record_id, method):
+        with self._lock:
+            record = records.get(record_id)
+            if record is None:
+                return 404, _dumps({"error": {"message": f"{label} {record_id} not found"}})
+            if method == "DELETE":
+                del records[record_id]
+                if records is self._meters:
+                    self._detach_meter(record)
+            return 200, _dumps({"data": dict(record)})
+
+    def _detach_meter(self, meter):
+        transformer = self._transformers.get(meter.get("parent"))
+        if transformer is not None:
+            transformer["meters"] = [m for m in transformer["meters"] if m["id"] != meter["id"]]
+            self._grid_bytes = None
+
+    def _create_meter(self, data):
+        parent = data.get("parent")
+        with self._lock:
+            transformer = self._transformers.get(parent) if parent is not None else None
+            if parent is not None and transformer is None:
+                return 400, _dumps({"error": {"message": f"Parent transformer {parent} not found"}})
+            record = {**data, "id": self._new_id("meter"), "dataset": None}
+            record["dataset"] = record["id"]
+            self._meters[record["id"]] = record
+            if transformer is not None:
+                transformer["meters"].append({"id": record["id"], "code": record.get("code")})
+                self._grid_bytes = None
+        return 200, _dumps({"data": record})
+
+    def _list_meters(self, query):
+        page = max(1, int(query.get("pagination[page]", ["1"])[0]))
+        page_size = max(1, int(query.get("pagination[pageSize]", ["100"])[0]))
+        populate = {value for key, values in query.items() if key.startswith("populate") for value in values}
+        fields = {value for key, values in query.items() if key.startswith("fields") for value in values}
+        with self._lock:
+            meters = sorted(self._meters.values(), key=lambda meter: meter["id"])
+            total = len(meters)
+            window = meters[(page - 1) * page_size:page * page_size]
+            data = []
+            for meter in window:
+                record = {key: value for key, value in meter.items() if key == "id" or key in fields} if fields else dict(meter)
+                if "parent" in populate:
+                    transformer = self._transformers.get(meter.get("parent"))
+                    record["parent"] = {key: value for key, value in transformer.items() if key != "meters"} if transformer else None
+                if "energyResource" in populate:
+                    record["energyResource"] = self._energy_resources.get(meter.get("energyResource"))
+                if "children" in populate:
+                    record["children"] = []
+                if "appliances" in populate:
+                    record["appliances"] = []
+                data.append(record)
+        return 200, _dumps({"data": data, "meta": {"pagination": {
+            "page": page, "pageSize": page_size, "pageCount": math.ceil(total / page_size), "total": total}}})
+
+    def _grid_loads(self):
+        """
+        Per-transformer load series: `timestamps` (15-minute steps) and, for every transformer,
+        `loads_kw` aligned with them. Values depend only on the seed and the transformer id.
+        """
+        start = datetime(2025, 1, 1)
+        timestamps = [_timestamp(start + timedelta(minutes=15 * step)) for step in range(self.grid_load_points)]
+        utilities = []
+        with self._lock:
+            for utility in self._grid["utilities"]:
+                substations = []
+                for substation in utility["substations"]:
+                    transformers = []
+                    for transformer in substation["transformers"]:
+                        rng = random.Random(f"{self.seed}:load:{transformer['id']}")
+                        capacity = transformer["capacity_kw"]
+                        base = capacity * rng.uniform(0.3, 0.6)
+                        peak = capacity * rng.uniform(0.2, 0.6)
+                        loads = [
+                            round(base + peak * max(0.0, math.sin(math.pi * ((step % 96) - 28) / 56)) + rng.uniform(-5, 5), 2)
+                            for step in range(self.grid_load_points)
+                        ]
+                        transformers.append({"id": transformer["id"], "capacity_kw": capacity,
+                                             "meter_count": len(transformer["meters"]), "loads_kw": loads})
+                    substations.append({"id": substation["id"], "transformers": transformers})
+                utilities.append({"id": utility["id"], "substations": substations})
+        return {"timestamps": timestamps, "utilities": utilities}
+
+    def _meter_dataset(self, dataset_id):
+        rng = random.Random(f"{self.seed}:dataset:{dataset_id}")
+        start = datetime(2025, 1, 1)
+        records = [
+            {
+                "timestamp": _timestamp(start + timedelta(minutes=15 * step)),
+                "consumption": round(rng.uniform(0.1, 1.5), 3),
+                "production": round(max(0.0, math.sin(math.pi * ((step % 96) - 24) / 48)) * rng.uniform(0.5, 1.2), 3),
+            }
+            for step in range(self.dataset_points)
+        ]
+        return {"data": {"id": dataset_id, "meter": dataset_id, "interval_minutes": 15, "records": records}}
+
+    # --- Server ---
+
+    def make_server(self, host="127.0.0.1", port=0):
+        """
+        Returns a ThreadingHTTPServer bound to (host, port); port 0 picks a free port.
+        """
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # keep-alive, so client connection pooling is exercised
+
+            def _serve(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                parts = urlsplit(self.path)
+                status, data = backend.handle(self.command, parts.path, parse_qs(parts.query), body, self.headers)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _serve
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        return server
+
+    def start(self, host="127.0.0.1", port=0):
+        """
+        Serves in a daemon thread and returns the server; its base URL is
+        f"http://{host}:{server.server_address[1]}". Call server.shutdown() to stop it.
+        """
+        server = self.make_server(host, port)
+        threading.Thread(target=server.serve_forever, name="mock_backend", daemon=True).start()
+        return server
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Mock Beckn BPP + World Engine server for load testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--retail-items", type=int, default=20, help="items in the deg:retail catalog")
+    parser.add_argument("--service-items", type=int, default=10, help="items in the deg:service catalog")
+    parser.add_argument("--scheme-items", type=int, default=10, help="items in the deg:schemes catalog")
+    parser.add_argument("--providers", type=int, default=4, help="providers per catalog")
+    parser.add_argument("--utilities", type=int, default=1)
+    parser.add_argument("--substations", type=int, default=4, help="substations per utility")
+    parser.add_argument("--transformers", type=int, default=25, help="transformers per substation")
+    parser.add_argument("--transformer-max-meters", type=int, default=50)
+    parser.add_argument("--grid-load-points", type=int, default=96, help="time steps per transformer in /grid-loads")
+    parser.add_argument("--dataset-points", type=int, default=96, help="records per meter dataset")
+    parser.add_argument("--latency", type=float, default=None, help="seconds added to every response (both APIs)")
+    parser.add_argument("--beckn-latency", type=float, default=0.0, help="seconds added to Beckn responses")
+    parser.add_argument("--world-engine-latency", type=float, default=0.0, help="seconds added to World Engine responses")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds per response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failed on purpose")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--callback-bpps", type=int, default=0,
+                        help="answer Beckn calls via on_* callbacks to bap_uri from this many BPPs (0 = synchronous)")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def backend_from_args(args):
+    return MockBackend(
+        retail_items=args.retail_items,
+        service_items=args.service_items,
+        scheme_items=args.scheme_items,
+        providers=args.providers,
+        utilities=args.utilities,
+        substations=args.substations,
+        transformers=args.transformers,
+        transformer_max_meters=args.transformer_max_meters,
+        grid_load_points=args.grid_load_points,
+        dataset_points=args.dataset_points,
+        beckn_latency=args.beckn_latency if args.latency is None else args.latency,
+        world_engine_latency=args.world_engine_latency if args.latency is None else args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        callback_bpps=args.callback_bpps,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    server = backend_from_args(args).make_server(args.host, args.port)
+    print(f"Mock Beckn/World Engine backend listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,412 @@
+"""
+Provisions many households in the World Engine at once: energy resource -> meter (parented to the
+nearest transformer with headroom) -> DERs, for every household of a CSV or JSONL file.
+
+    python -m source.bulk_enrollment households.csv --concurrency 32 --journal enrollment.jsonl
+
+Households run concurrently (steps of one household stay in order). Failed calls are retried with
+backoff, every create carries an Idempotency-Key derived from the household, and each completed
+step is appended to the journal, so re-running with the same journal resumes where it stopped.
+
+Input columns / keys (only latitude and longitude are required):
+    id, name, code, type, city, state, pincode, latitude, longitude, parent,
+    consumption_load_factor, production_load_factor, appliance_ids (";"-separated), switched_on
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from source.APIclasses.world_engine_client import WorldEngineClient
+from source.metrics import metrics
+
+ENROLLMENT_CONCURRENCY = int(os.getenv("ENROLLMENT_CONCURRENCY", "16"))
+ENROLLMENT_MAX_RETRIES = int(os.getenv("ENROLLMENT_MAX_RETRIES", "4"))
+ENROLLMENT_RETRY_BACKOFF = float(os.getenv("ENROLLMENT_RETRY_BACKOFF", "0.2"))
+# Journals of jobs started through the API; posting the same job_id again resumes that job
+ENROLLMENT_JOURNAL_DIR = os.getenv("ENROLLMENT_JOURNAL_DIR", "enrollment_journals")
+# Finished API jobs are reported for this many seconds, and at most this many are kept
+ENROLLMENT_JOB_TTL = float(os.getenv("ENROLLMENT_JOB_TTL", "3600"))
+ENROLLMENT_MAX_FINISHED_JOBS = int(os.getenv("ENROLLMENT_MAX_FINISHED_JOBS", "100"))
+DEFAULT_APPLIANCE_IDS = [1]
+
+STEPS = ("energy_resource", "meter", "ders")
+
+
+def read_households(path):
+    """
+    Reads households from a .csv file (header row) or a JSONL file (one JSON object per line).
+    """
+    with open(path, newline="") as f:
+        if path.lower().endswith(".csv"):
+            return [normalize_household(row) for row in csv.DictReader(f)]
+        return [normalize_household(json.loads(line)) for line in f if line.strip()]
+
+
+def parse_households(text, content_type=""):
+    """
+    Same as read_households for a request body: CSV when the content type says so, else JSONL.
+    """
+    if "csv" in content_type:
+        return [normalize_household(row) for row in csv.DictReader(text.splitlines())]
+    return [normalize_household(json.loads(line)) for line in text.splitlines() if line.strip()]
+
+
+def _optional_float(value, default=None):
+    return default if value in (None, "") else float(value)
+
+
+def normalize_household(record):
+    """
+    Turns one CSV row / JSON object into the household dict the pipeline works with, including a
+    stable idempotency key (from `id` when present, otherwise from the content).
+    """
+    if record.get("latitude") in (None, "") or record.get("longitude") in (None, ""):
+        raise ValueError(f"Household {record.get('id') or record.get('name')!r} needs latitude and longitude")
+    appliance_ids = record.get("appliance_ids")
+    if isinstance(appliance_ids, str):
+        appliance_ids = [int(part) for part in appliance_ids.replace(",", ";").split(";") if part.strip()]
+    switched_on = record.get("switched_on")
+    if isinstance(switched_on, str):
+        switched_on = switched_on.strip().lower() in ("1", "true", "yes") if switched_on.strip() else None
+    identity = record.get("id") or json.dumps(record, sort_keys=True, default=str)
+    key = hashlib.sha1(str(identity).encode()).hexdigest()[:20]
+    return {
+        "key": key,
+        "id": record.get("id") or key,
+        "name": record.get("name") or f"Household {record.get('id') or key}",
+        "code": record.get("code") or f"HH-{key[:12].upper()}",
+        "type": record.get("type") or "SMART",
+        "city": record.get("city"),
+        "state": record.get("state"),
+        "pincode": str(record["pincode"]) if record.get("pincode") not in (None, "") else None,
+        "latitude": float(record["latitude"]),
+        "longitude": float(record["longitude"]),
+        "parent": int(record["parent"]) if record.get("parent") not in (None, "") else None,
+        "consumption_load_factor": _optional_float(record.get("consumption_load_factor"), 1.0),
+        "production_load_factor": _optional_float(record.get("production_load_factor"), 0.0),
+        "appliance_ids": list(appliance_ids) if appliance_ids else list(DEFAULT_APPLIANCE_IDS),
+        "switched_on": switched_on,
+    }
+
+
+def _id_of(response, step):
+    """
+    ID of the record a create call returned. Raises RuntimeError when the response has none, so the
+    household fails instead of journaling the step as done (and sending None on to the next step).
+    """
+    data = response.get("data", response) if isinstance(response, dict) else {}
+    record_id = data.get("id") if isinstance(data, dict) else None
+    if record_id is None:
+        raise RuntimeError(f"{step} response has no data.id: {str(response)[:200]}")
+    return record_id
+
+
+def _step_done(progress, step):
+    """
+    Whether a journaled step finished with its ID(s). Steps journaled without one (by runs before
+    IDs were checked) are redone on resume.
+    """
+    record_id = progress.get(step)
+    if isinstance(record_id, list):
+        return all(item is not None for item in record_id)
+    return record_id is not None
+
+
+class EnrollmentJournal:
+    """
+    Append-only JSONL record of completed steps, one line per step:
+    {"key": ..., "step": "energy_resource" | "meter" | "ders" | "failed", ...}. Loading it gives
+    the progress of every household so a run can resume.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.progress = self._load()
+        self._file = open(path, "a", buffering=1) if path else None
+
+    def _load(self):
+        progress = {}
+        if not self.path or not os.path.exists(self.path):
+            return progress
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue # torn last line of an interrupted run
+                record = progress.setdefault(entry["key"], {})
+                if entry["step"] == "failed":
+                    record["error"] = entry.get("error")
+                else:
+                    record.pop("error", None)
+                    record[entry["step"]] = entry.get("id")
+        return progress
+
+    def get(self, key):
+        with self._lock:
+            return dict(self.progress.get(key) or {})
+
+    def record(self, key, step, **fields):
+        with self._lock:
+            record = self.progress.setdefault(key, {})
+            if step == "failed":
+                record["error"] = fields.get("error")
+            else:
+                record[step] = fields.get("id")
+            if self._file is not None:
+                self._file.write(json.dumps({"key": key, "step": step, "ts": round(time.time(), 3), **fields}) + "\n")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class BulkEnrollment:
+    """
+    Bounded-concurrency enrollment of households into the World Engine.
+    """
+
+    def __init__(self, client, journal=None, concurrency=ENROLLMENT_CONCURRENCY, max_retries=ENROLLMENT_MAX_RETRIES,
+                 retry_backoff=ENROLLMENT_RETRY_BACKOFF):
+        """
+        Args:
+            client (WorldEngineClient): Client used for every call.
+            journal (EnrollmentJournal): Progress journal; an in-memory one when None.
+            concurrency (int): Households provisioned at the same time.
+            max_retries (int): Retries per call for connection errors, 429 and 5xx responses.
+            retry_backoff (float): Base of the exponential backoff between retries, in seconds.
+        """
+        self.client = client
+        self.journal = journal or EnrollmentJournal(None)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._counts_lock = threading.Lock()
+        self.counts = {"total": 0, "done": 0, "skipped": 0, "failed": 0, "retries": 0}
+
+    def _call(self, step, fn):
+        attempt = 0
+        while True:
+            try:
+                with metrics.timed("enrollment_step_seconds", step=step):
+                    return fn()
+            except requests.exceptions.RequestException as e:
+                status = e.response.status_code if getattr(e, "response", None) is not None else None
+                retryable = status is None or status == 429 or status >= 500
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                with self._counts_lock:
+                    self.counts["retries"] += 1
+                time.sleep(self.retry_backoff * (2 ** (attempt - 1)) * (0.5 + random.random()))
+
+    def _place_meter(self, household):
+        """
+        Parent transformer for the household's meter and the seat reserved on it: the given parent
+        (no seat), else the nearest transformer with headroom, else the first one with headroom.
+        The seat is reserved right away so concurrent households don't overfill a transformer;
+        release it with topology.release_meter() if the meter is not created. Raises RuntimeError
+        when every transformer is full.
+        """
+        if household["parent"] is not None:
+            return household["parent"], None
+        seat = {"code": household["code"]}
+        parent = self.client.get_topology().reserve_meter(seat, household["latitude"], household["longitude"])
+        if parent is None:
+            raise RuntimeError("No transformer has headroom for another meter")
+        return parent, seat
+
+    def enroll(self, household):
+        """
+        Runs the missing steps of one household. Returns its journal record.
+        """
+        key = household["key"]
+        progress = self.journal.get(key)
+        if all(_step_done(progress, step) for step in STEPS):
+            with self._counts_lock:
+                self.counts["skipped"] += 1
+            return progress
+        try:
+            energy_resource_id = progress.get("energy_resource")
+            if not _step_done(progress, "energy_resource"):
+                response = self._call("energy_resource", lambda: self.client.create_energy_resource(
+                    {"name": household["name"], "type": "CUSTOMER"}, idempotency_key=f"{key}:energy_resource"))
+                energy_resource_id = _id_of(response, "energy_resource")
+                self.journal.record(key, "energy_resource", id=energy_resource_id)
+
+            if not _step_done(progress, "meter"):
+                parent, seat = self._place_meter(household)
+                data = {
+                    "code": household["code"],
+                    "parent": parent,
+                    "energyResource": energy_resource_id,
+                    "consumptionLoadFactor": household["consumption_load_factor"],
+                    "productionLoadFactor": household["production_load_factor"],
+                    "type": household["type"],
+                    "city": household["city"],
+                    "state": household["state"],
+                    "latitude": household["latitude"],
+                    "longitude": household["longitude"],
+                    "pincode": household["pincode"],
+                }
+                try:
+                    response = self._call("meter", lambda: self.client.create_meter(data, idempotency_key=f"{key}:meter"))
+                except Exception:
+                    if seat is not None:
+                        self.client.get_topology().release_meter(parent, seat)
+                    raise
+                self.journal.record(key, "meter", id=_id_of(response, "meter"), parent=parent)
+
+            if not _step_done(progress, "ders"):
+                der_ids = []
+                for appliance_id in household["appliance_ids"]:
+                    response = self._call("der", lambda: self.client.create_der(
+                        energy_resource_id, appliance_id, household["switched_on"],
+                        idempotency_key=f"{key}:der:{appliance_id}"))
+                    der_ids.append(_id_of(response, "der"))
+                self.journal.record(key, "ders", id=der_ids)
+        except Exception as e:
+            self.journal.record(key, "failed", error=f"{type(e).__name__}: {e}")
+            metrics.increment("enrollment_households_total", outcome="failed")
+            with self._counts_lock:
+                self.counts["failed"] += 1
+            return self.journal.get(key)
+        metrics.increment("enrollment_households_total", outcome="done")
+        with self._counts_lock:
+            self.counts["done"] += 1
+        return self.journal.get(key)
+
+    def run(self, households, on_progress=None):
+        """
+        Enrolls every household with at most `concurrency` in flight. Returns a summary dict.
+
+        Args:
+            households (list): Normalized household dicts (see normalize_household).
+            on_progress (callable): Called with self.counts after each finished household.
+        """
+        with self._counts_lock:
+            self.counts["total"] += len(households)
+        start = time.perf_counter()
+        pending = set()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="enrollment") as executor:
+            for household in households:
+                # Submit lazily so 10k households don't become 10k queued futures at once
+                if len(pending) >= self.concurrency * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    if on_progress:
+                        for _ in finished:
+                            on_progress(self.counts)
+                pending.add(executor.submit(self.enroll, household))
+            for _ in wait(pending).done:
+                if on_progress:
+                    on_progress(self.counts)
+        elapsed = time.perf_counter() - start
+        processed = self.counts["done"] + self.counts["failed"]
+        return {
+            **self.counts,
+            "elapsed_seconds": round(elapsed, 3),
+            "households_per_second": round(processed / elapsed, 1) if elapsed else None,
+        }
+
+
+_jobs = {} # job_id -> {"status", "counts", "summary", "error", "finished_at"}
+_jobs_lock = threading.Lock()
+
+
+def _evict_finished_jobs(now):
+    """
+    Drops finished jobs older than ENROLLMENT_JOB_TTL, then the oldest ones beyond
+    ENROLLMENT_MAX_FINISHED_JOBS; running jobs are kept. Call with _jobs_lock held.
+    """
+    finished = sorted((job["finished_at"], job_id) for job_id, job in _jobs.items() if job.get("finished_at") is not None)
+    excess = len(finished) - ENROLLMENT_MAX_FINISHED_JOBS
+    for index, (finished_at, job_id) in enumerate(finished):
+        if index < excess or now - finished_at > ENROLLMENT_JOB_TTL:
+            del _jobs[job_id]
+
+
+def start_enrollment_job(households, base_url, job_id=None, concurrency=ENROLLMENT_CONCURRENCY):
+    """
+    Runs BulkEnrollment in a background thread with a journal under ENROLLMENT_JOURNAL_DIR and
+    returns the job_id. Raises RuntimeError if that job is already running.
+    """
+    job_id = job_id or hashlib.sha1(os.urandom(16)).hexdigest()[:12]
+    if not job_id.replace("-", "").replace("_", "").isalnum():
+        raise ValueError("job_id may only contain letters, digits, '-' and '_'")
+    with _jobs_lock:
+        _evict_finished_jobs(time.time())
+        if (_jobs.get(job_id) or {}).get("status") == "running":
+            raise RuntimeError(f"Enrollment job {job_id} is already running")
+        os.makedirs(ENROLLMENT_JOURNAL_DIR, exist_ok=True)
+        journal = EnrollmentJournal(os.path.join(ENROLLMENT_JOURNAL_DIR, f"{job_id}.jsonl"))
+        pipeline = BulkEnrollment(WorldEngineClient(base_url), journal=journal, concurrency=concurrency)
+        job = _jobs[job_id] = {"job_id": job_id, "status": "running", "counts": pipeline.counts, "summary": None, "error": None,
+                               "finished_at": None}
+
+    def run():
+        try:
+            job["summary"] = pipeline.run(households)
+            job["status"] = "completed"
+        except Exception as e:
+            job["status"] = "error"
+            job["error"] = f"{type(e).__name__}: {e}"
+        finally:
+            journal.close()
+            job["finished_at"] = time.time()
+
+    threading.Thread(target=run, name=f"enrollment_{job_id}", daemon=True).start()
+    return job_id
+
+
+def get_enrollment_job(job_id):
+    with _jobs_lock:
+        _evict_finished_jobs(time.time())
+        job = _jobs.get(job_id)
+        return None if job is None else {**job, "counts": dict(job["counts"])}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Provision households (energy resource, meter, DERs) in the World Engine.")
+    parser.add_argument("households", help="CSV (with header) or JSONL file of households")
+    parser.add_argument("--journal", help="progress journal (JSONL); re-run with the same file to resume")
+    parser.add_argument("--base-url", default=os.getenv("WORLD_ENGINE_BASE_URL"))
+    parser.add_argument("--concurrency", type=int, default=ENROLLMENT_CONCURRENCY)
+    parser.add_argument("--max-retries", type=int, default=ENROLLMENT_MAX_RETRIES)
+    parser.add_argument("--retry-backoff", type=float, default=ENROLLMENT_RETRY_BACKOFF)
+    args = parser.parse_args(argv)
+    if not args.base_url:
+        parser.error("--base-url or WORLD_ENGINE_BASE_URL is required")
+
+    households = read_households(args.households)
+    journal = EnrollmentJournal(args.journal or f"{args.households}.journal.jsonl")
+    pipeline = BulkEnrollment(WorldEngineClient(args.base_url), journal=journal, concurrency=args.concurrency,
+                              max_retries=args.max_retries, retry_backoff=args.retry_backoff)
+    last_report = [0.0]
+
+    def report(counts):
+        now = time.monotonic()
+        if now - last_report[0] >= 1.0:
+            last_report[0] = now
+            print(f"done {counts['done']}  skipped {counts['skipped']}  failed {counts['failed']}  / {counts['total']}", file=sys.stderr)
+
+    try:
+        summary = pipeline.run(households, on_progress=report)
+    finally:
+        journal.close()
+    print(json.dumps(summary))
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
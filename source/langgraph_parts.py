@@ -1,24 +1,19 @@
 import json
 import operator
 import random
-import uuid
-import datetime
 import os # Import the os module
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Annotated, List, Tuple, Union, TypedDict, Optional
 
 import requests
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.messages.tool import ToolMessage
-from langchain_core.tools import tool
-from langchain_google_vertexai import ChatVertexAI
-from langgraph.graph import StateGraph, END
-from dotenv import load_dotenv # Import load_dotenv
+from langgraph.constants import END # langgraph.graph itself is only imported when the graph is built
 
-# --- Load environment variables from .env file ---
-
-
-from google.cloud import aiplatform
-aiplatform.init(project="e-dragon-459817-h0")
+# Importing this module has no side effects beyond reading the environment: the LLM client is
+# created on first use and the graph is compiled on first access to `app` (or by warm_up()).
 
 # --- Get variables from environment ---
 gcp_project = os.getenv("GCP_PROJECT")
@@ -29,7 +24,6 @@ BECKN_BAP_URI = os.getenv("BECKN_BAP_URI")
 BECKN_BPP_ID = os.getenv("BECKN_BPP_ID")
 BECKN_BPP_URI = os.getenv("BECKN_BPP_URI")
 LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME")
-print (gcp_project, BECKN_BAP_ID)
 bap_id = BECKN_BAP_ID
 bap_uri = BECKN_BAP_URI
 bpp_id = BECKN_BPP_ID
@@ -50,19 +44,29 @@ from source.model_tools import (
     world_engine_create_energy_resource,
     world_engine_create_der,
     world_engine_toggle_der_switching,
-    create_beckn_context
+    create_beckn_context,
+    get_grid_topology,
+    prefetch_catalogs
 )
-
-# Check if essential variables are loaded
-if not all([BECKN_BASE_URL, WORLD_ENGINE_BASE_URL, BECKN_BAP_ID, BECKN_BAP_URI, BECKN_BPP_ID, BECKN_BPP_URI]):
-    raise EnvironmentError("Missing one or more required environment variables. Ensure .env file exists and contains all necessary variables.")
+from source.APIclasses.grid_topology import get_topology_cache
+from source.Agents.context_window import build_llm_context
+from source.Agents.llm_provider import create_chat_model
+from source.Agents.stage_executor import plan_direct_tool_call
+from source.Agents.stage_machine import STAGES, StageMachine, stage_for_user_input
+from source.Agents.tool_registry import ToolCallError, ToolRegistry
+from source.metrics import instrument_node, metrics
+
+def check_environment():
+    """Raises EnvironmentError if a required Beckn / World Engine variable is missing."""
+    if not all([BECKN_BASE_URL, WORLD_ENGINE_BASE_URL, BECKN_BAP_ID, BECKN_BAP_URI, BECKN_BPP_ID, BECKN_BPP_URI]):
+        raise EnvironmentError("Missing one or more required environment variables. Ensure .env file exists and contains all necessary variables.")
 
 class AgentState(TypedDict):
     """
     Represents the state of the agentic solar adoption process.
     """
     input: str  # User input for the current turn
-    chat_history: List[Union[AIMessage, HumanMessage, ToolMessage]] # Full conversation history
+    chat_history: Annotated[List[Union[AIMessage, HumanMessage, ToolMessage]], operator.add] # Full conversation history; nodes return only the messages they add
     tool_output: Optional[Union[str, List[dict], dict]]  # Output from the latest tool call
     current_stage: str  # e.g., "welcome", "gather_info", "search_solar", "present_options", "select_solar", "confirm_solar", "search_subsidies", "apply_subsidies", "setup_grid_flexibility", "provide_status", "end", "error"
     user_info: dict  # Stores collected user data (location, bill, etc.)
@@ -79,9 +83,10 @@ class AgentState(TypedDict):
     error_message: Optional[str] # Stores error messages from the current turn
     # Added for LLM context generation:
     latest_tool_output_summary: Optional[str] # Summary description of the latest tool output
+    history_summary: Optional[str] # Rolling summary of chat turns no longer sent to the LLM verbatim
+    summarized_message_count: int # Number of leading chat_history messages covered by history_summary
 
-# Initialize the LLM and tools
-llm = ChatVertexAI(model=LLM_MODEL_NAME, temperature=0) # Use the specified model
+# Tools bound to the LLM
 tools = [
     beckn_connection_search,
     beckn_solar_retail_search,
@@ -97,7 +102,22 @@ tools = [
     world_engine_create_der,
     world_engine_toggle_der_switching,
 ]
-llm_with_tools = llm.bind_tools(tools)
+_lazy_init_lock = threading.Lock()
+
+def get_llm_with_tools():
+    """
+    Returns the tool-bound chat model, creating the LLM client on first use.
+    LLM_PROVIDER selects Vertex AI (default) or the scripted offline model used for benchmarks.
+    """
+    global llm, llm_with_tools
+    bound = globals().get('llm_with_tools')
+    if bound is None:
+        with _lazy_init_lock:
+            bound = globals().get('llm_with_tools')
+            if bound is None:
+                llm = create_chat_model(LLM_MODEL_NAME)
+                bound = llm_with_tools = llm.bind_tools(tools)
+    return bound
 
 # --- Graph Nodes ---
 
@@ -106,17 +126,13 @@ def handle_user_input(state: AgentState) -> AgentState:
     user_input = state['input']
     print(f"--- handle_user_input ---:\nUser: {user_input}\n")
 
-    # Determine initial stage based on user intent (simple keyword check)
+    # Continue the stage that asked for this message (e.g. present_options gets "select 1"); a new,
+    # finished or failed session starts at an entry stage picked by keyword.
     # This stage is set *before* update_state processes it.
-    initial_stage = 'initial'
-    if "solar" in user_input.lower() or "rooftop" in user_input.lower() or "incentive" in user_input.lower() or "flexibility program" in user_input.lower():
-         initial_stage = 'gather_info'
-    else:
-         initial_stage = 'welcome' # If initial input is not directly about solar, start with welcome
+    initial_stage = stage_for_user_input(state.get('current_stage'), user_input)
 
     return {
-        **state,
-        'chat_history': state['chat_history'] + [HumanMessage(content=user_input)],
+        'chat_history': [HumanMessage(content=user_input)], # appended by the chat_history reducer
         'current_stage': initial_stage,
         'input': None, # Clear input after processing it
     }
@@ -127,7 +143,16 @@ def agent(state: AgentState) -> AgentState:
     (tool call or generate a response) and generate user-facing text.
     """
     print(f"--- agent (Stage: {state['current_stage']}) ---")
-    chat_history = state['chat_history'][:] # Use a copy
+
+    # Tool-only stages with known inputs skip the LLM round trip that would just emit this call;
+    # the LLM is still used afterwards to put the tool result into words for the user.
+    direct_call = plan_direct_tool_call(state)
+    if direct_call is not None:
+        metrics.increment("agent_fast_path_total", stage=state['current_stage'])
+        print(f"Fast path: calling {direct_call.tool_calls[0]['name']} directly for stage {state['current_stage']}")
+        return {'chat_history': [direct_call]}
+
+    chat_history = state['chat_history'] # Read-only here; new messages are returned, not appended
 
     # Construct a dynamic system message for the LLM
     # system_prompt_parts = [
@@ -204,143 +229,265 @@ def agent(state: AgentState) -> AgentState:
          system_prompt_parts.append(f"An error occurred: {state.get('error_message')}. Inform the user about the error and ask how they'd like to proceed (e.g., retry, try something else).")
 
 
-    system_message = SystemMessage(content="\n".join(system_prompt_parts))
+    # Keep the last few turns verbatim and fold older turns / bulky tool payloads into a rolling summary
+    llm_messages, history_summary, summarized_count = build_llm_context(
+        "\n".join(system_prompt_parts),
+        chat_history,
+        summary=state.get('history_summary'),
+        summarized_count=state.get('summarized_message_count') or 0,
+    )
 
-    # Invoke the LLM with the system prompt and chat history
-    response = llm_with_tools.invoke([system_message] + chat_history)
+    # Invoke the LLM with the system prompt and the bounded chat history window
+    with metrics.timed("llm_invoke_seconds", stage=state['current_stage']):
+        response = get_llm_with_tools().invoke(llm_messages)
 
     # The agent's direct response or tool call will be the last message
-    return {'chat_history': state['chat_history'] + [response]}
+    return {
+        'chat_history': [response],
+        'history_summary': history_summary,
+        'summarized_message_count': summarized_count,
+    }
+
+# Tool calls emitted together in one AIMessage run concurrently on this bounded pool
+TOOL_CALL_MAX_WORKERS = int(os.getenv("TOOL_CALL_MAX_WORKERS", "8"))
+tool_call_executor = ThreadPoolExecutor(max_workers=TOOL_CALL_MAX_WORKERS, thread_name_prefix="tool_call")
+
+# Known chains inside one AIMessage: a tool waits for the listed tools if they were emitted alongside it
+# (energy resource -> meter -> DER).
+TOOL_CALL_DEPENDENCIES = {
+    'world_engine_create_meter': ['world_engine_create_energy_resource'],
+    'world_engine_create_der': ['world_engine_create_energy_resource', 'world_engine_create_meter'],
+}
+
+def plan_tool_call_waves(tool_calls: list) -> List[List[int]]:
+    """
+    Groups tool call indices into waves. Calls within a wave are independent and can run
+    concurrently; a wave only starts once every call of the previous waves has finished.
+    """
+    present = {tool_call.get('name') for tool_call in tool_calls}
+    levels = {}
+
+    def level_of(tool_name):
+        if tool_name not in levels:
+            deps = [dep for dep in TOOL_CALL_DEPENDENCIES.get(tool_name, []) if dep in present and dep != tool_name]
+            levels[tool_name] = 1 + max((level_of(dep) for dep in deps), default=-1)
+        return levels[tool_name]
+
+    waves = {}
+    for index, tool_call in enumerate(tool_calls):
+        waves.setdefault(level_of(tool_call.get('name')), []).append(index)
+    return [waves[level] for level in sorted(waves)]
+
+# --- Tool registry: state-derived arguments and side effects per tool ---
+
+def _backfill_confirm_args(state: AgentState, tool_args: dict):
+    # Ensure required user info (name, phone, email, fulfillment_id) is in args; call_tool has already
+    # generated a fulfillment_id if the session had none (see _with_fulfillment_id)
+    user_info = state.get('user_info', {})
+    if 'customer_name' not in tool_args and user_info.get('customer_name'):
+        tool_args['customer_name'] = user_info['customer_name']
+    if 'customer_phone' not in tool_args and user_info.get('customer_phone'):
+        tool_args['customer_phone'] = user_info['customer_phone']
+    if 'customer_email' not in tool_args and user_info.get('customer_email'):
+        tool_args['customer_email'] = user_info['customer_email']
+    if 'fulfillment_id' not in tool_args and user_info.get('fulfillment_id'):
+        tool_args['fulfillment_id'] = user_info['fulfillment_id']
+
+    # Ensure provider_id and item_id are present for confirm based on selected option
+    selected_option = state.get('selected_solar_option') or {}
+    if 'provider_id' not in tool_args and (selected_option.get('provider') or {}).get('id'):
+        tool_args['provider_id'] = selected_option['provider']['id']
+    if 'item_id' not in tool_args and selected_option.get('id'):
+        tool_args['item_id'] = selected_option['id']
+
+def _default_subsidy_item(state: AgentState, tool_args: dict):
+    # For subsidy confirm, if item_id/provider_id is not in args, try using the first subsidy search result
+    if ('provider_id' not in tool_args or 'item_id' not in tool_args) and state.get('subsidy_search_results'):
+        first_subsidy = state['subsidy_search_results'][0]
+        tool_args['provider_id'] = first_subsidy.get('provider', {}).get('id')
+        tool_args['item_id'] = first_subsidy.get('id')
+        print(f"Using first subsidy search result for confirm: Provider ID {tool_args.get('provider_id')}, Item ID {tool_args.get('item_id')}")
+
+def _inject_energy_resource_id(state: AgentState, tool_args: dict):
+    # Ensure energy_resource_id is present from state
+    if tool_args.get('energy_resource_id') is None and state.get('energy_resource_id'):
+        tool_args['energy_resource_id'] = state['energy_resource_id']
+        print(f"Added energy_resource_id to DER args: {state['energy_resource_id']}")
+
+def _resolve_meter_parent(state: AgentState, tool_args: dict):
+    # Find a parent transformer if the LLM did not provide one
+    if tool_args.get('parent') is not None:
+        return
+    # The topology is cached process-wide, so this is an in-memory lookup after the first session
+    try:
+        topology = get_grid_topology()
+    except requests.exceptions.RequestException as e:
+        raise ToolCallError(f"Error fetching utility data to find meter parent: {e}", reason="resolver")
+    latitude, longitude = tool_args.get('latitude'), tool_args.get('longitude')
+    # Nearest transformer with headroom (else the first one with headroom). The call's own args take
+    # the seat right away so concurrent sessions can't overfill it; _record_meter swaps in the created
+    # meter and _release_meter_seat frees the seat if the call fails.
+    transformer_id = topology.reserve_meter(tool_args,
+                                            float(latitude) if latitude is not None else None,
+                                            float(longitude) if longitude is not None else None)
+    if transformer_id is None:
+        raise ToolCallError("No transformer has headroom for another meter.", reason="resolver")
+    tool_args['parent'] = transformer_id
+    print(f"Found and added transformer parent: {transformer_id}")
+
+def _remember_energy_resource(state: AgentState, tool_args: dict, output: dict):
+    # Later waves of the same AIMessage (e.g. the DER) depend on this ID
+    if (output.get('data') or {}).get('id'):
+        return {'energy_resource_id': output['data']['id']}
+
+def _record_meter(state: AgentState, tool_args: dict, output: dict):
+    # Keep the cached topology's meters-by-transformer index current: the created meter takes the
+    # seat _resolve_meter_parent reserved (or is added, when the LLM gave the parent itself)
+    if tool_args.get('parent') is None:
+        return
+    topology = get_topology_cache(WORLD_ENGINE_BASE_URL).peek()
+    if topology is None:
+        return
+    if (output.get('data') or {}).get('id'):
+        topology.replace_meter(tool_args['parent'], tool_args, output['data'])
+    else:
+        topology.release_meter(tool_args['parent'], tool_args)
+
+def _release_meter_seat(state: AgentState, tool_args: dict, error: str):
+    # The meter was not created: give the seat reserved by _resolve_meter_parent back
+    topology = get_topology_cache(WORLD_ENGINE_BASE_URL).peek()
+    if topology is not None and tool_args.get('parent') is not None:
+        topology.release_meter(tool_args['parent'], tool_args)
+
+# World Engine writes allowed in flight at once across all sessions
+WORLD_ENGINE_WRITE_CONCURRENCY = int(os.getenv("WORLD_ENGINE_WRITE_CONCURRENCY", "8"))
+
+# Writes (orders, World Engine records, DER toggles) are not idempotent: one that timed out keeps
+# running and may still succeed, and a retry would duplicate it. They run without a timeout.
+TOOL_OPTIONS = {
+    'beckn_solar_retail_confirm': {'injectors': [_backfill_confirm_args], 'timeout': None},
+    # The subsidy item goes in first; otherwise the solar option's provider/item would be back-filled
+    'beckn_subsidy_confirm': {'injectors': [_default_subsidy_item, _backfill_confirm_args], 'timeout': None},
+    'world_engine_create_energy_resource': {'on_success': _remember_energy_resource, 'max_concurrency': WORLD_ENGINE_WRITE_CONCURRENCY, 'timeout': None},
+    'world_engine_create_meter': {'resolvers': [_resolve_meter_parent], 'on_success': _record_meter, 'on_failure': _release_meter_seat, 'max_concurrency': WORLD_ENGINE_WRITE_CONCURRENCY, 'timeout': None},
+    'world_engine_create_der': {'injectors': [_inject_energy_resource_id], 'max_concurrency': WORLD_ENGINE_WRITE_CONCURRENCY, 'timeout': None},
+    'world_engine_toggle_der_switching': {'max_concurrency': WORLD_ENGINE_WRITE_CONCURRENCY, 'timeout': None},
+}
+
+tool_registry = ToolRegistry()
+for _tool in tools:
+    tool_registry.register(_tool, **TOOL_OPTIONS.get(_tool.name, {}))
+
+# Tools whose calls carry the session's fulfillment_id
+CONFIRM_TOOLS = tuple(name for name, options in TOOL_OPTIONS.items() if _backfill_confirm_args in options.get('injectors', ()))
+
+def _with_fulfillment_id(state: AgentState, tool_calls: list) -> AgentState:
+    """
+    Generates the session's fulfillment_id before the first confirm call that needs one, once per
+    AIMessage: confirms of the same message may run concurrently and must not each make their own.
+    """
+    user_info = state.get('user_info') or {}
+    if user_info.get('fulfillment_id'):
+        return state
+    if not any(tool_call.get('name') in CONFIRM_TOOLS and not (tool_call.get('args') or {}).get('fulfillment_id')
+               for tool_call in tool_calls):
+        return state
+    fulfillment_id = str(random.randint(10000, 99999))
+    print(f"Generated fulfillment_id: {fulfillment_id}")
+    return {**state, 'user_info': {**user_info, 'fulfillment_id': fulfillment_id}} # Store for next turns
+
+def _execute_tool_call(state: AgentState, tool_call: dict) -> Tuple[ToolMessage, str, bool, dict]:
+    """
+    Runs a single tool call through the tool registry. Returns the ToolMessage, a summary
+    fragment for the agent, whether the call failed and the state updates of its on_success hook.
+    Runs on a worker thread next to the other calls of its wave, so it never modifies `state`.
+    """
+    print(f"Attempting to call tool: {tool_call.get('name')} with args {tool_call.get('args')}")
+    tool_name = tool_call.get('name')
+    tool_call_id = tool_call.get('id', 'unknown_id')
+    spec = tool_args = None # set once the call is prepared; on_failure only sees prepared calls
+    try:
+        # Arguments are validated against the tool's schema before any network I/O
+        spec, tool_args = tool_registry.prepare(tool_name, tool_call.get('args'), state)
+        with metrics.timed("tool_call_seconds", tool=tool_name, domain=tool_name.split('_', 1)[0]):
+            output = tool_registry.invoke(spec, tool_args)
+        tool_message = ToolMessage(content=json.dumps(output), tool_call_id=tool_call_id)
+
+        # Generate a brief summary of the output for the agent
+        summary = ""
+        failed = False
+        updates = {}
+        if 'error' not in output:
+            summary += f"Tool '{tool_name}' succeeded. "
+            if isinstance(output, dict):
+                 if output.get('message', {}).get('catalog'):
+                      summary += f"Found {len(output['message']['catalog'].get('items', []))} items."
+                 elif output.get('message', {}).get('order'):
+                      summary += f"Order ID: {output['message']['order'].get('id')}."
+                 elif output.get('data', {}).get('id'):
+                       summary += f"Created item with ID: {output['data'].get('id')}."
+                 else:
+                       summary += "Output data received."
+            else:
+                  summary += "Output received."
+            if spec.on_success is not None and isinstance(output, dict):
+                 updates = spec.on_success(state, tool_args, output) or {}
+        else:
+             summary += f"Tool '{tool_name}' failed: {output.get('error', 'Unknown error')}."
+             failed = True
+             if spec.on_failure is not None:
+                 spec.on_failure(state, tool_args, output.get('error'))
+
+
+        metrics.increment("tool_calls_total", tool=tool_name, outcome="error" if failed else "ok")
+        print(f"Tool '{tool_name}' called successfully.")
+        print(f"Output: {output}\n")
+        return tool_message, summary, failed, updates
+
+    except ToolCallError as e:
+        # Refused before running (unknown tool, bad arguments, no parent transformer) or timed out
+        error_msg = str(e)
+        print(error_msg)
+        metrics.increment("tool_calls_total", tool=str(tool_name), outcome=e.reason)
+        if tool_args is not None and spec.on_failure is not None:
+            spec.on_failure(state, tool_args, error_msg)
+        return ToolMessage(content=json.dumps({"error": error_msg}), tool_call_id=tool_call_id), error_msg, True, {}
+
+    except Exception as e:
+        error_msg = f"Error executing tool {tool_name}: {e}"
+        print(error_msg)
+        metrics.increment("tool_calls_total", tool=str(tool_name), outcome="exception")
+        if tool_args is not None and spec.on_failure is not None:
+            spec.on_failure(state, tool_args, error_msg)
+        # Same shape as any other failed call: the stage handlers json.loads every ToolMessage
+        return ToolMessage(content=json.dumps({"error": error_msg}), tool_call_id=tool_call_id), error_msg, True, {}
 
 def call_tool(state: AgentState) -> AgentState:
-    """Executes the tool call(s) recommended by the agent and adds ToolMessage to history."""
+    """
+    Executes the tool call(s) recommended by the agent and adds ToolMessage to history.
+    Independent calls run concurrently; ToolMessages keep the order of the original tool calls.
+    """
     print("--- call_tool ---")
     last_message = state['chat_history'][-1]
     tool_calls = last_message.tool_calls
-    tool_outputs = []
-    latest_output_summary = ""
-    error_occurred = False
-
-    for tool_call in tool_calls:
-        print(f"Attempting to call tool: {tool_call.get('name')} with args {tool_call.get('args')}")
-        try:
-            tool_name = tool_call.get('name')
-            tool_args = tool_call.get('args', {})
-            tool_call_id = tool_call.get('id')
-
-            # Need to handle the case where the LLM generates arguments that don't match the tool signature
-            # Basic argument validation can be added here if needed
-            # For simplicity, directly invoke the tool
-            tool_function = globals().get(tool_name) # Get function by name
-
-            if tool_function:
-                 # Special handling for `world_engine_create_meter` to find a parent if not provided by LLM
-                 if tool_name == 'world_engine_create_meter' and tool_args.get('parent') is None and state.get('world_engine_data') is None:
-                      print("Attempting to fetch utility data to find meter parent...")
-                      utility_data = world_engine_get_utilities_data.invoke({})
-                      if 'error' not in utility_data and utility_data.get('utilities'):
-                            state['world_engine_data'] = utility_data # Store for future use
-                            # Find a transformer ID (simplistic: take the first one found)
-                            transformer_id = None
-                            if utility_data['utilities'] and utility_data['utilities'][0].get('substations'):
-                                 if utility_data['utilities'][0]['substations'][0].get('transformers'):
-                                      transformer_id = utility_data['utilities'][0]['substations'][0]['transformers'][0].get('id')
-                                      tool_args['parent'] = transformer_id # Add parent to args
-                                      print(f"Found and added transformer parent: {transformer_id}")
-                            if transformer_id is None:
-                                 error_msg = "Could not find a parent transformer for the meter."
-                                 tool_outputs.append(ToolMessage(content=error_msg, tool_call_id=tool_call_id))
-                                 print(error_msg)
-                                 latest_output_summary += error_msg
-                                 error_occurred = True
-                                 continue # Skip this tool call
-
-                      elif 'error' in utility_data:
-                           error_msg = f"Error fetching utility data to find meter parent: {utility_data.get('error', 'Unknown error')}"
-                           tool_outputs.append(ToolMessage(content=error_msg, tool_call_id=tool_call_id))
-                           print(error_msg)
-                           latest_output_summary += error_msg
-                           error_occurred = True
-                           continue # Skip this tool call
-
-
-                 # Special handling for `beckn_solar_retail_confirm` and `beckn_subsidy_confirm`
-                 # Ensure required user info (name, phone, email, fulfillment_id) is in args
-                 if tool_name in ['beckn_solar_retail_confirm', 'beckn_subsidy_confirm']:
-                      user_info = state.get('user_info', {})
-                      # Ensure required fields are present or add from state
-                      if 'customer_name' not in tool_args and user_info.get('customer_name'):
-                           tool_args['customer_name'] = user_info['customer_name']
-                      if 'customer_phone' not in tool_args and user_info.get('customer_phone'):
-                           tool_args['customer_phone'] = user_info['customer_phone']
-                      if 'customer_email' not in tool_args and user_info.get('customer_email'):
-                           tool_args['customer_email'] = user_info['customer_email']
-                      if 'fulfillment_id' not in tool_args and user_info.get('fulfillment_id'):
-                            tool_args['fulfillment_id'] = user_info['fulfillment_id']
-                      elif 'fulfillment_id' not in tool_args:
-                           # Generate a fulfillment_id if not present
-                           fulfillment_id = str(random.randint(10000, 99999))
-                           tool_args['fulfillment_id'] = fulfillment_id
-                           state['user_info']['fulfillment_id'] = fulfillment_id # Store for next turns
-                           print(f"Generated and added fulfillment_id: {fulfillment_id}")
-
-                      # Ensure provider_id and item_id are present for confirm based on selected option
-                      if 'provider_id' not in tool_args and state.get('selected_solar_option', {}).get('provider', {}).get('id'):
-                            tool_args['provider_id'] = state['selected_solar_option']['provider']['id']
-                      if 'item_id' not in tool_args and state.get('selected_solar_option', {}).get('id'):
-                            tool_args['item_id'] = state['selected_solar_option']['id']
-
-                      # For subsidy confirm, if item_id/provider_id is not in args, try using the first subsidy search result
-                      if tool_name == 'beckn_subsidy_confirm' and ('provider_id' not in tool_args or 'item_id' not in tool_args) and state.get('subsidy_search_results'):
-                           first_subsidy = state['subsidy_search_results'][0]
-                           tool_args['provider_id'] = first_subsidy.get('provider', {}).get('id')
-                           tool_args['item_id'] = first_subsidy.get('id')
-                           print(f"Using first subsidy search result for confirm: Provider ID {tool_args.get('provider_id')}, Item ID {tool_args.get('item_id')}")
-
-                 # Special handling for `world_engine_create_der`
-                 # Ensure energy_resource_id is present from state
-                 if tool_name == 'world_engine_create_der' and tool_args.get('energy_resource_id') is None and state.get('energy_resource_id'):
-                      tool_args['energy_resource_id'] = state['energy_resource_id']
-                      print(f"Added energy_resource_id to DER args: {state['energy_resource_id']}")
-
-                 # Invoke the actual tool function
-                 output = tool_function.invoke(tool_args)
-                 tool_outputs.append(ToolMessage(content=json.dumps(output), tool_call_id=tool_call_id))
-
-                 # Generate a brief summary of the output for the agent
-                 if 'error' not in output:
-                     latest_output_summary += f"Tool '{tool_name}' succeeded. "
-                     if isinstance(output, dict):
-                          if output.get('message', {}).get('catalog'):
-                               latest_output_summary += f"Found {len(output['message']['catalog'].get('items', []))} items."
-                          elif output.get('message', {}).get('order'):
-                               latest_output_summary += f"Order ID: {output['message']['order'].get('id')}."
-                          elif output.get('data', {}).get('id'):
-                                latest_output_summary += f"Created item with ID: {output['data'].get('id')}."
-                          else:
-                                latest_output_summary += "Output data received."
-                     else:
-                           latest_output_summary += "Output received."
-                 else:
-                      latest_output_summary += f"Tool '{tool_name}' failed: {output.get('error', 'Unknown error')}."
-                      error_occurred = True
-
-
-                 print(f"Tool '{tool_name}' called successfully.")
-                 print(f"Output: {output}\n")
-            else:
-                 error_msg = f"Tool '{tool_name}' not found."
-                 tool_outputs.append(ToolMessage(content=error_msg, tool_call_id=tool_call_id))
-                 print(error_msg)
-                 latest_output_summary += error_msg
-                 error_occurred = True # Indicate tool not found as error
-
-        except Exception as e:
-            error_msg = f"Error executing tool {tool_call.get('name')}: {e}"
-            tool_outputs.append(ToolMessage(content=error_msg, tool_call_id=tool_call.get('id', 'unknown_id')))
-            print(error_msg)
-            latest_output_summary += error_msg
-            error_occurred = True
+    results = [None] * len(tool_calls)
+    state = _with_fulfillment_id(state, tool_calls)
+
+    for wave in plan_tool_call_waves(tool_calls):
+        if len(wave) == 1:
+            results[wave[0]] = _execute_tool_call(state, tool_calls[wave[0]])
+        else:
+            print(f"Running {len(wave)} tool calls concurrently: {[tool_calls[i].get('name') for i in wave]}")
+            futures = {index: tool_call_executor.submit(_execute_tool_call, state, tool_calls[index]) for index in wave}
+            for index, future in futures.items():
+                results[index] = future.result()
+        # Merge the wave's state updates in tool-call order; the next wave (e.g. the DER) sees them
+        for index in wave:
+            state = {**state, **results[index][3]}
+
+    tool_outputs = [tool_message for tool_message, _, _, _ in results]
+    latest_output_summary = "".join(summary for _, summary, _, _ in results)
+    error_occurred = any(failed for _, _, failed, _ in results)
 
     # Update state with tool outputs and a summary
     # If any error occurred in tool calls, transition to 'error' stage
@@ -349,332 +496,24 @@ def call_tool(state: AgentState) -> AgentState:
          next_stage = 'error'
          state['error_message'] = "One or more tool calls failed." # Generic error message
 
-    return {**state, 'chat_history': state['chat_history'] + tool_outputs, 'tool_output': tool_outputs, 'latest_tool_output_summary': latest_output_summary, 'current_stage': next_stage}
+    return {**state, 'chat_history': tool_outputs, 'tool_output': tool_outputs, 'latest_tool_output_summary': latest_output_summary, 'current_stage': next_stage}
+
+# Stage transitions are table-driven; the table is validated here, at import time.
+# Catalogs don't depend on anything else the user tells us: once the location is known they are
+# all fetched in the background, so the search stages hit a warm catalog cache.
+stage_machine = StageMachine(STAGES, hooks={
+    'location_detected': lambda: prefetch_catalogs(),
+})
 
 def update_state(state: AgentState) -> AgentState:
     """
     Updates the state based on the chat history (user input, tool outputs, agent messages)
-    and decides the next stage of the process.
+    and decides the next stage of the process, using the current stage's handler in the
+    stage table (source/Agents/stage_machine.py).
     Relies on the agent node to generate user-facing responses based on the updated state.
     """
     print(f"--- update_state (Current Stage: {state.get('current_stage')}) ---")
-
-    # The latest entry in chat_history contains the result of the previous node
-    latest_message = state['chat_history'][-1]
-    current_stage = state.get('current_stage', 'initial')
-    updated_state = state.copy()
-    updated_state['error_message'] = None # Clear error message at the start of update_state
-    updated_state['latest_tool_output_summary'] = None # Clear tool output summary
-
-    # Process state updates based on the current stage and latest message
-    if current_stage == 'initial':
-         # This stage is set by handle_user_input. Decide next stage based on initial intent.
-         user_input = state['chat_history'][-1].content.lower() # Get input from history
-         if "solar" in user_input or "rooftop" in user_input or "incentive" in user_input or "flexibility program" in user_input:
-             updated_state['current_stage'] = 'gather_info'
-         else:
-             updated_state['current_stage'] = 'welcome' # If initial input is not directly about solar, start with welcome
-
-    elif current_stage == 'welcome':
-         # User has seen the welcome message and provided input.
-         # Check if their new input indicates interest in solar.
-         user_input = state['chat_history'][-1].content.lower()
-         if "solar" in user_input or "rooftop" in user_input or "incentive" in user_input or "flexibility program" in user_input or "yes" in user_input or "tell me more" in user_input:
-             updated_state['current_stage'] = 'gather_info'
-             print("User expressed interest in solar, transitioning to gather_info.")
-         else:
-             # If not, stay in welcome, the agent will decide how to respond
-             updated_state['current_stage'] = 'welcome' # Stay in welcome stage
-             print("Staying in welcome stage.")
-
-
-    elif current_stage == 'gather_info':
-        # Process latest user input or agent's attempt to gather info
-        # Expecting HumanMessage with user info
-        if isinstance(latest_message, HumanMessage):
-            user_input = latest_message.content.lower()
-            user_info = updated_state.get('user_info', {}).copy()
-
-            # Attempt to extract key info from user input (simplistic)
-            # In a real application, use proper NER or form filling.
-            # For demo, just mark fields as 'provided' if keywords are present.
-            if 'location' not in user_info:
-                 # Look for city/state/pincode keywords
-                 if any(word in user_input for word in ['city', 'state', 'pincode', 'location', 'in']):
-                      user_info['location'] = "Provided" # Mark as provided
-                      print("Attempted to extract location info.") # Debugging
-
-            if 'consumption' not in user_info:
-                 # Look for bill/consumption keywords
-                 if any(word in user_input for word in ['bill', 'consumption', 'usage', 'kwh', '$']):
-                      user_info['consumption'] = "Provided" # Mark as provided
-                      print("Attempted to extract consumption info.") # Debugging
-
-            if 'customer_name' not in user_info and ('name is' in user_input or 'i am' in user_input):
-                 try:
-                      # Very basic name extraction after "name is" or "i am"
-                      parts = user_input.split('name is') if 'name is' in user_input else user_input.split('i am')
-                      if len(parts) > 1:
-                          name_part = parts[1].strip()
-                          user_info['customer_name'] = name_part.split('.')[0].split(',')[0].title() # Basic extraction
-                          print(f"Extracted name: {user_info['customer_name']}")
-                 except Exception as e:
-                      print(f"Error extracting name: {e}")
-
-            if 'customer_phone' not in user_info:
-                 # Basic phone number pattern matching (very simple)
-                 import re
-                 phone_match = re.search(r'\d{3}[-.\s]?\d{3}[-.\s]?\d{4}', user_input)
-                 if phone_match:
-                      user_info['customer_phone'] = phone_match.group(0)
-                      print(f"Extracted phone: {user_info['customer_phone']}")
-
-
-            if 'customer_email' not in user_info:
-                 # Basic email pattern matching
-                 email_match = re.search(r'\S+@\S+\.\S+', user_input)
-                 if email_match:
-                      user_info['customer_email'] = email_match.group(0)
-                      print(f"Extracted email: {user_info['customer_email']}")
-
-
-            updated_state['user_info'] = user_info
-
-            # Decide next stage based on whether required info is present
-            # Check if BOTH location and consumption are marked as 'Provided'
-            if user_info.get('location') == 'Provided' and user_info.get('consumption') == 'Provided':
-                 updated_state['current_stage'] = 'search_solar'
-                 print("Sufficient info gathered, transitioning to search_solar.")
-            else:
-                 # Stay in gather_info. The agent will see the state and know to ask for missing info.
-                 updated_state['current_stage'] = 'gather_info' # Keep stage as gather_info
-                 print("Info still incomplete, staying in gather_info.")
-
-
-        elif isinstance(latest_message, AIMessage):
-            # Agent responded while in gather_info, means it likely asked for info.
-            # Stay in gather_info to receive user's response.
-            updated_state['current_stage'] = 'gather_info'
-            print("Agent message received in gather_info, staying in stage.")
-
-
-    elif current_stage == 'search_solar':
-        # Expecting ToolMessage output from call_tool (beckn_solar_retail_search)
-        if isinstance(latest_message, ToolMessage):
-            tool_output = json.loads(latest_message.content)
-            if 'error' not in tool_output:
-                solar_options = tool_output.get('output', {}).get('message', {}).get('catalog', {}).get('items', []) # Access 'output' key from tool result
-                updated_state['solar_options'] = solar_options
-                if solar_options:
-                     updated_state['current_stage'] = 'present_options'
-                     print("Solar options found, transitioning to present_options.")
-                else:
-                     updated_state['current_stage'] = 'welcome' # Go back if no options
-                     print("No solar options found, transitioning back to welcome.")
-            else:
-                 updated_state['current_stage'] = 'error'
-                 updated_state['error_message'] = tool_output.get('error', 'Unknown search error')
-                 print(f"Search solar error, transitioning to error: {updated_state['error_message']}")
-
-    elif current_stage == 'present_options':
-        # Expecting HumanMessage user input selecting an option.
-        # The agent node will interpret the selection and potentially decide to call confirm_solar.
-        # This node just stays in 'present_options'. The agent's subsequent tool_calls
-        # or message will drive the transition via the next_node_from_stage.
-        # Add parsing for user selection here to update state['selected_solar_option']
-        if isinstance(latest_message, HumanMessage):
-            user_selection_input = latest_message.content.lower()
-            selected_option = None
-
-            if updated_state.get('solar_options'):
-                try:
-                    # Attempt to parse selection by number (e.g., "select 1")
-                    if "select" in user_selection_input:
-                        parts = user_selection_input.split("select")
-                        if len(parts) > 1:
-                            selection_str = parts[1].strip()
-                            try:
-                                selected_index = int(selection_str) - 1
-                                if 0 <= selected_index < len(updated_state['solar_options']):
-                                    selected_option = updated_state['solar_options'][selected_index]
-                                    print(f"Selected option by number: {selected_index}")
-                            except ValueError:
-                                # Try matching by name if not a number
-                                for option in updated_state['solar_options']:
-                                    if option.get('descriptor', {}).get('name', '').lower() in selection_str:
-                                        selected_option = option
-                                        print(f"Selected option by name: {option.get('descriptor', {}).get('name')}")
-                                        break
-
-                    # Handle cases where the user might just type the option number or name (less robust parsing)
-                    if not selected_option:
-                        # Check if input is just a number corresponding to an option
-                        try:
-                            selected_index = int(user_selection_input.strip()) - 1
-                            if 0 <= selected_index < len(updated_state['solar_options']):
-                                selected_option = updated_state['solar_options'][selected_index]
-                                print(f"Selected option by number directly: {selected_index}")
-                        except ValueError:
-                             # Check if input is an exact match for an option name (case-insensitive)
-                             for option in updated_state['solar_options']:
-                                if option.get('descriptor', {}).get('name', '').lower() == user_selection_input.strip():
-                                     selected_option = option
-                                     print(f"Selected option by exact name match: {user_selection_input}")
-                                     break
-
-
-                except Exception as e:
-                     print(f"Error during option selection parsing: {e}") # Debugging
-
-            if selected_option:
-                updated_state['selected_solar_option'] = selected_option
-                # Set next stage to confirm. The agent will see selected_solar_option in state
-                # and know to call the confirm tool.
-                updated_state['current_stage'] = 'confirm_solar'
-                print(f"Option selected, transitioning to confirm_solar: {selected_option.get('id')}")
-
-            elif 'cancel' in user_selection_input or 'stop' in user_selection_input:
-                 updated_state['current_stage'] = 'end' # User wants to stop
-                 print("User cancelled, transitioning to end.")
-            else:
-                 # Invalid selection, stay in present_options. Agent will reprompt.
-                 updated_state['current_stage'] = 'present_options'
-                 print("Invalid selection, staying in present_options.")
-
-
-        elif isinstance(latest_message, AIMessage):
-             # Agent responded while in present_options, means it likely presented options or asked for selection
-             # Stay in present_options to receive user's selection.
-             updated_state['current_stage'] = 'present_options'
-             print("Agent message received in present_options, staying in stage.")
-
-    elif current_stage == 'confirm_solar':
-        # Expecting ToolMessage output from call_tool (beckn_solar_retail_confirm)
-        if isinstance(latest_message, ToolMessage):
-            tool_output = json.loads(latest_message.content)
-            if 'error' not in tool_output:
-                order = tool_output.get('output', {}).get('message', {}).get('order', {}) # Access 'output' key
-                if order:
-                    updated_state['order_id'] = order.get('id')
-                    updated_state['current_stage'] = 'search_subsidies' # Move to subsidy search
-                    print(f"Solar confirmed (Order ID: {updated_state['order_id']}), transitioning to search_subsidies.")
-                else:
-                     updated_state['current_stage'] = 'provide_status' # Confirmation response unexpected
-                     print("Solar confirmation response unexpected, transitioning to provide_status.")
-            else:
-                updated_state['current_stage'] = 'error'
-                updated_state['error_message'] = tool_output.get('error', 'Unknown confirm error')
-                print(f"Confirm solar error, transitioning to error: {updated_state['error_message']}")
-
-
-    elif current_stage == 'search_subsidies':
-        # Expecting ToolMessage output from call_tool (beckn_subsidy_search)
-        if isinstance(latest_message, ToolMessage):
-            tool_output = json.loads(latest_message.content)
-            if 'error' not in tool_output:
-                subsidy_options = tool_output.get('output', {}).get('message', {}).get('catalog', {}).get('items', []) # Access 'output' key
-                updated_state['subsidy_search_results'] = subsidy_options
-                if subsidy_options:
-                    updated_state['current_stage'] = 'apply_subsidies' # Move to applying
-                    print(f"Subsidies found ({len(subsidy_options)}), transitioning to apply_subsidies.")
-                else:
-                    updated_state['current_stage'] = 'setup_grid_flexibility' # Move to next stage if no subsidies
-                    print("No subsidies found, transitioning to setup_grid_flexibility.")
-            else:
-                updated_state['current_stage'] = 'setup_grid_flexibility' # Continue despite error
-                updated_state['error_message'] = tool_output.get('error', 'Unknown subsidy search error')
-                print(f"Search subsidies error, transitioning to setup_grid_flexibility: {updated_state['error_message']}")
-
-    elif current_stage == 'apply_subsidies':
-        # Expecting ToolMessage output from call_tool (beckn_subsidy_confirm)
-        if isinstance(latest_message, ToolMessage):
-            tool_output = json.loads(latest_message.content)
-            if 'error' not in tool_output:
-                order = tool_output.get('output', {}).get('message', {}).get('order', {}) # Access 'output' key
-                if order:
-                    updated_state['applied_subsidy_order_id'] = order.get('id')
-                    updated_state['current_stage'] = 'setup_grid_flexibility' # Move to grid flexibility setup
-                    print(f"Subsidy applied (ID: {updated_state['applied_subsidy_order_id']}), transitioning to setup_grid_flexibility.")
-                else:
-                    updated_state['current_stage'] = 'setup_grid_flexibility' # Confirmation response unexpected
-                    print("Subsidy confirmation response unexpected, transitioning to setup_grid_flexibility.")
-            else:
-                updated_state['current_stage'] = 'setup_grid_flexibility' # Continue despite error
-                updated_state['error_message'] = tool_output.get('error', 'Unknown subsidy confirm error')
-                print(f"Apply subsidies error, transitioning to setup_grid_flexibility: {updated_state['error_message']}")
-
-
-    elif current_stage == 'setup_grid_flexibility':
-        # Expecting ToolMessage outputs from World Engine calls or AIMessage from agent asking for info.
-        # This node processes the results of the WE API calls and decides the *next WE step*
-        # or if WE setup is complete. The agent will be called next to decide which WE tool to call.
-
-        # Process tool outputs from WE calls
-        if isinstance(latest_message, ToolMessage):
-            tool_output = json.loads(latest_message.content)
-            tool_name = latest_message.tool_call_id # Use full tool_call_id to infer tool name
-
-            if 'error' not in tool_output:
-                # Update state based on which WE tool succeeded
-                if 'world_engine_create_energy_resource' in tool_name and tool_output.get('output', {}).get('data'):
-                    updated_state['energy_resource_id'] = tool_output['output']['data'].get('id')
-                    print(f"ER created (ID: {updated_state['energy_resource_id']}).")
-                elif 'world_engine_create_meter' in tool_name and tool_output.get('output', {}).get('data'):
-                    updated_state['meter_id'] = tool_output['output']['data'].get('id')
-                    print(f"Meter created (ID: {updated_state['meter_id']}).")
-                elif 'world_engine_create_der' in tool_name and tool_output.get('output', {}).get('data'):
-                    der_id = tool_output['output']['data'].get('id')
-                    if der_id not in updated_state['der_ids']:
-                         updated_state['der_ids'].append(der_id)
-                    print(f"DER created (ID: {der_id}).")
-                elif 'world_engine_get_utilities_data' in tool_name and tool_output.get('output', {}).get('utilities'):
-                    updated_state['world_engine_data'] = tool_output['output'] # Store fetched utility data
-                    print("Utility data fetched.")
-
-                # After processing a successful WE tool call, stay in this stage for the agent to decide the next WE step
-                updated_state['current_stage'] = 'setup_grid_flexibility'
-                print("Processed WE tool output, staying in setup_grid_flexibility.")
-
-            else:
-                 # If a WE tool call failed, transition to error
-                 updated_state['current_stage'] = 'error'
-                 updated_state['error_message'] = tool_output.get('error', f'Unknown error from {tool_name}')
-                 print(f"WE tool error ({tool_name}), transitioning to error: {updated_state['error_message']}")
-
-        # After processing a Human or AIMessage in this stage
-        elif isinstance(latest_message, (HumanMessage, AIMessage)):
-             # The agent generated a message or user responded,
-             # the stage logic is handled by the agent node determining which WE tool to call next.
-             # Stay in this stage.
-             updated_state['current_stage'] = 'setup_grid_flexibility'
-             print("Processed message in setup_grid_flexibility, staying in stage.")
-
-        # Check if all required WE setup steps are complete based on the updated state
-        # This check should happen *after* potential state updates from tool calls
-        if updated_state.get('energy_resource_id') is not None and updated_state.get('meter_id') is not None and updated_state.get('der_ids'):
-             updated_state['current_stage'] = 'provide_status'
-             print("All WE setup steps complete, transitioning to provide_status.")
-
-
-    elif current_stage == 'provide_status':
-         # Status is provided (by agent message), move to end.
-         updated_state['current_stage'] = 'end'
-         print("Status provided, transitioning to end.")
-
-
-    elif current_stage == 'error':
-       
-        pass # Stay in error stage until new user input triggers handle_user_input
-
-
-    elif current_stage == END:
-        # Process ending, signal END
-        updated_state['current_stage'] = END
-        print("Process ended, transitioning to END.")
-
-    # Note: latest_tool_output_summary is cleared at the start of update_state
-
-    return updated_state
+    return stage_machine.update_state(state)
 
 # --- Define Conditional Edges ---
 
@@ -698,69 +537,91 @@ def should_continue_agent(state: AgentState) -> str:
 
 def next_node_from_stage(state: AgentState) -> str:
     """
-    Decides the next node based on the 'current_stage' and the last message type.
+    Decides the next node based on the 'current_stage' and the last message type: a single
+    lookup in the routing table precomputed from the stage table.
     """
-    current_stage = state.get('current_stage')
-    # Ensure chat_history is not empty before accessing the last element
-    latest_message = state['chat_history'][-1] if state['chat_history'] else None
-    
-    print(f"--- next_node_from_stage (Current Stage: {current_stage}, Last message type: {type(latest_message)}) ---")
-
-    if current_stage == END: # This case means the overall process defined by your stages has reached its conclusion
-        return "end_process"
-
-    # If the last message in the history is an AIMessage generated by the agent
-    # (i.e., it has no tool_calls), and we are in a stage where the agent
-    # has likely just asked a question or presented information and is now
-    # waiting for a user response, the current graph invocation should conclude.
-    if isinstance(latest_message, AIMessage) and not latest_message.tool_calls:
-        # Stages where the agent communicates and then should wait for user input
-        if current_stage in ['welcome', 'gather_info', 'present_options', 'provide_status', 'error']:
-            print(f"Agent has spoken in stage {current_stage}. Current invoke pass will now end to await user input.")
-            return "awaiting_human_input" 
-            
-    # Default behavior: continue processing, likely by going back to the agent node
-    return "continue_process"
+    route = stage_machine.next_node_from_stage(state)
+    print(f"--- next_node_from_stage (Current Stage: {state.get('current_stage')}) -> {route} ---")
+    return route
 
 
 # --- Build the Graph ---
 
-workflow = StateGraph(AgentState)
-
-# Add nodes
-workflow.add_node("handle_user_input", handle_user_input)
-workflow.add_node("agent", agent)
-workflow.add_node("call_tool", call_tool)
-workflow.add_node("update_state", update_state)
-
-# Set the entry point
-workflow.set_entry_point("handle_user_input")
-
-# Define the transitions
-workflow.add_edge("handle_user_input", "update_state")
-
-workflow.add_conditional_edges(
-    "agent",
-    should_continue_agent,
-    {
-        "call_tool_action": "call_tool", # Key now matches the function's output
-        "process_message": "update_state",
-    },
-)
-
-workflow.add_edge("call_tool", "update_state")
-
-# After updating the state, decide the next node based on the current_stage value
-workflow.add_conditional_edges(
-    "update_state",
-    next_node_from_stage, # This function can return "continue_process", "end_process", or "awaiting_human_input"
-    {
-        "continue_process": "agent",  # Continue to the agent node for further processing
-        "end_process": END,           # The entire graph process is finished
-        "awaiting_human_input": END   # The current invoke pass should stop, awaiting user's response
-                                      # The graph will resume on the next invoke with the new input.
-    },
-)
-
-# Compile the graph
-app = workflow.compile()
\ No newline at end of file
+def build_graph():
+    """Builds and compiles the LangGraph workflow."""
+    from langgraph.graph import StateGraph
+
+    workflow = StateGraph(AgentState)
+
+    # Add nodes
+    workflow.add_node("handle_user_input", instrument_node("handle_user_input", handle_user_input))
+    workflow.add_node("agent", instrument_node("agent", agent))
+    workflow.add_node("call_tool", instrument_node("call_tool", call_tool))
+    workflow.add_node("update_state", instrument_node("update_state", update_state))
+
+    # Set the entry point
+    workflow.set_entry_point("handle_user_input")
+
+    # Define the transitions
+    workflow.add_edge("handle_user_input", "update_state")
+
+    workflow.add_conditional_edges(
+        "agent",
+        should_continue_agent,
+        {
+            "call_tool_action": "call_tool", # Key now matches the function's output
+            "process_message": "update_state",
+        },
+    )
+
+    workflow.add_edge("call_tool", "update_state")
+
+    # After updating the state, decide the next node based on the current_stage value
+    workflow.add_conditional_edges(
+        "update_state",
+        next_node_from_stage, # This function can return "continue_process", "end_process", or "awaiting_human_input"
+        {
+            "continue_process": "agent",  # Continue to the agent node for further processing
+            "end_process": END,           # The entire graph process is finished
+            "awaiting_human_input": END   # The current invoke pass should stop, awaiting user's response
+                                          # The graph will resume on the next invoke with the new input.
+        },
+    )
+
+    # Compile the graph
+    return workflow.compile()
+
+
+def get_app():
+    """Returns the compiled graph, compiling it on first use."""
+    global app
+    compiled = globals().get('app')
+    if compiled is None:
+        check_environment()
+        with _lazy_init_lock:
+            compiled = globals().get('app')
+            if compiled is None:
+                compiled = app = build_graph()
+    return compiled
+
+
+def warm_up():
+    """
+    Does the deferred start-up work now (LLM client, tool binding, graph compilation) so the first
+    chat turn does not pay for it. Call it once per worker, e.g. after forking.
+    """
+    start = time.perf_counter()
+    get_app()
+    graph_ready = time.perf_counter()
+    get_llm_with_tools()
+    print(f"Warm-up done: graph {graph_ready - start:.2f}s, LLM client {time.perf_counter() - graph_ready:.2f}s")
+
+
+def __getattr__(name):
+    # `from source.langgraph_parts import app` (and llm / llm_with_tools) build lazily on first access
+    if name == 'app':
+        return get_app()
+    if name in ('llm', 'llm_with_tools'):
+        get_llm_with_tools()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -17,6 +17,8 @@ from dotenv import load_dotenv # Import load_dotenv
 # --- Load environment variables from .env file ---
 load_dotenv()
 
+from source.Agents.stage_machine import STAGES, StageMachine, stage_for_user_input
+
 from google.cloud import aiplatform
 aiplatform.init(project="e-dragon-459817-h0")
 
@@ -523,13 +525,10 @@ def handle_user_input(state: AgentState) -> AgentState:
     user_input = state['input']
     print(f"--- handle_user_input ---:\nUser: {user_input}\n")
 
-    # Determine initial stage based on user intent (simple keyword check)
+    # Continue the stage that asked for this message (e.g. present_options gets "select 1"); a new,
+    # finished or failed session starts at an entry stage picked by keyword.
     # This stage is set *before* update_state processes it.
-    initial_stage = 'initial'
-    if "solar" in user_input.lower() or "rooftop" in user_input.lower() or "incentive" in user_input.lower() or "flexibility program" in user_input.lower():
-         initial_stage = 'gather_info'
-    else:
-         initial_stage = 'welcome' # If initial input is not directly about solar, start with welcome
+    initial_stage = stage_for_user_input(state.get('current_stage'), user_input)
 
     return {
         **state,
@@ -764,334 +763,18 @@ def call_tool(state: AgentState) -> AgentState:
 
     return {**state, 'chat_history': state['chat_history'] + tool_outputs, 'tool_output': tool_outputs, 'latest_tool_output_summary': latest_output_summary, 'current_stage': next_stage}
 
+# Stage transitions are table-driven and shared with source/langgraph_parts.py
+stage_machine = StageMachine(STAGES)
+
 def update_state(state: AgentState) -> AgentState:
     """
     Updates the state based on the chat history (user input, tool outputs, agent messages)
-    and decides the next stage of the process.
+    and decides the next stage of the process, using the current stage's handler in the
+    stage table (source/Agents/stage_machine.py).
     Relies on the agent node to generate user-facing responses based on the updated state.
     """
     print(f"--- update_state (Current Stage: {state.get('current_stage')}) ---")
-
-    # The latest entry in chat_history contains the result of the previous node
-    latest_message = state['chat_history'][-1]
-    current_stage = state.get('current_stage', 'initial')
-    updated_state = state.copy()
-    updated_state['error_message'] = None # Clear error message at the start of update_state
-    updated_state['latest_tool_output_summary'] = None # Clear tool output summary
-
-    # Process state updates based on the current stage and latest message
-    if current_stage == 'initial':
-         # This stage is set by handle_user_input. Decide next stage based on initial intent.
-         user_input = state['chat_history'][-1].content.lower() # Get input from history
-         if "solar" in user_input or "rooftop" in user_input or "incentive" in user_input or "flexibility program" in user_input:
-             updated_state['current_stage'] = 'gather_info'
-         else:
-             updated_state['current_stage'] = 'welcome' # If initial input is not directly about solar, start with welcome
-
-    elif current_stage == 'welcome':
-         # User has seen the welcome message and provided input.
-         # Check if their new input indicates interest in solar.
-         user_input = state['chat_history'][-1].content.lower()
-         if "solar" in user_input or "rooftop" in user_input or "incentive" in user_input or "flexibility program" in user_input or "yes" in user_input or "tell me more" in user_input:
-             updated_state['current_stage'] = 'gather_info'
-             print("User expressed interest in solar, transitioning to gather_info.")
-         else:
-             # If not, stay in welcome, the agent will decide how to respond
-             updated_state['current_stage'] = 'welcome' # Stay in welcome stage
-             print("Staying in welcome stage.")
-
-
-    elif current_stage == 'gather_info':
-        # Process latest user input or agent's attempt to gather info
-        # Expecting HumanMessage with user info
-        if isinstance(latest_message, HumanMessage):
-            user_input = latest_message.content.lower()
-            user_info = updated_state.get('user_info', {}).copy()
-
-            # Attempt to extract key info from user input (simplistic)
-            # In a real application, use proper NER or form filling.
-            # For demo, just mark fields as 'provided' if keywords are present.
-            if 'location' not in user_info:
-                 # Look for city/state/pincode keywords
-                 if any(word in user_input for word in ['city', 'state', 'pincode', 'location', 'in']):
-                      user_info['location'] = "Provided" # Mark as provided
-                      print("Attempted to extract location info.") # Debugging
-
-            if 'consumption' not in user_info:
-                 # Look for bill/consumption keywords
-                 if any(word in user_input for word in ['bill', 'consumption', 'usage', 'kwh', '$']):
-                      user_info['consumption'] = "Provided" # Mark as provided
-                      print("Attempted to extract consumption info.") # Debugging
-
-            if 'customer_name' not in user_info and ('name is' in user_input or 'i am' in user_input):
-                 try:
-                      # Very basic name extraction after "name is" or "i am"
-                      parts = user_input.split('name is') if 'name is' in user_input else user_input.split('i am')
-                      if len(parts) > 1:
-                          name_part = parts[1].strip()
-                          user_info['customer_name'] = name_part.split('.')[0].split(',')[0].title() # Basic extraction
-                          print(f"Extracted name: {user_info['customer_name']}")
-                 except Exception as e:
-                      print(f"Error extracting name: {e}")
-
-            if 'customer_phone' not in user_info:
-                 # Basic phone number pattern matching (very simple)
-                 import re
-                 phone_match = re.search(r'\d{3}[-.\s]?\d{3}[-.\s]?\d{4}', user_input)
-                 if phone_match:
-                      user_info['customer_phone'] = phone_match.group(0)
-                      print(f"Extracted phone: {user_info['customer_phone']}")
-
-
-            if 'customer_email' not in user_info:
-                 # Basic email pattern matching
-                 email_match = re.search(r'\S+@\S+\.\S+', user_input)
-                 if email_match:
-                      user_info['customer_email'] = email_match.group(0)
-                      print(f"Extracted email: {user_info['customer_email']}")
-
-
-            updated_state['user_info'] = user_info
-
-            # Decide next stage based on whether required info is present
-            # Check if BOTH location and consumption are marked as 'Provided'
-            if user_info.get('location') == 'Provided' and user_info.get('consumption') == 'Provided':
-                 updated_state['current_stage'] = 'search_solar'
-                 print("Sufficient info gathered, transitioning to search_solar.")
-            else:
-                 # Stay in gather_info. The agent will see the state and know to ask for missing info.
-                 updated_state['current_stage'] = 'gather_info' # Keep stage as gather_info
-                 print("Info still incomplete, staying in gather_info.")
-
-
-        elif isinstance(latest_message, AIMessage):
-            # Agent responded while in gather_info, means it likely asked for info.
-            # Stay in gather_info to receive user's response.
-            updated_state['current_stage'] = 'gather_info'
-            print("Agent message received in gather_info, staying in stage.")
-
-
-    elif current_stage == 'search_solar':
-        # Expecting ToolMessage output from call_tool (beckn_solar_retail_search)
-        if isinstance(latest_message, ToolMessage):
-            tool_output = json.loads(latest_message.content)
-            if 'error' not in tool_output:
-                solar_options = tool_output.get('output', {}).get('message', {}).get('catalog', {}).get('items', []) # Access 'output' key from tool result
-                updated_state['solar_options'] = solar_options
-                if solar_options:
-                     updated_state['current_stage'] = 'present_options'
-                     print("Solar options found, transitioning to present_options.")
-                else:
-                     updated_state['current_stage'] = 'welcome' # Go back if no options
-                     print("No solar options found, transitioning back to welcome.")
-            else:
-                 updated_state['current_stage'] = 'error'
-                 updated_state['error_message'] = tool_output.get('error', 'Unknown search error')
-                 print(f"Search solar error, transitioning to error: {updated_state['error_message']}")
-
-    elif current_stage == 'present_options':
-        # Expecting HumanMessage user input selecting an option.
-        # The agent node will interpret the selection and potentially decide to call confirm_solar.
-        # This node just stays in 'present_options'. The agent's subsequent tool_calls
-        # or message will drive the transition via the next_node_from_stage.
-        # Add parsing for user selection here to update state['selected_solar_option']
-        if isinstance(latest_message, HumanMessage):
-            user_selection_input = latest_message.content.lower()
-            selected_option = None
-
-            if updated_state.get('solar_options'):
-                try:
-                    # Attempt to parse selection by number (e.g., "select 1")
-                    if "select" in user_selection_input:
-                        parts = user_selection_input.split("select")
-                        if len(parts) > 1:
-                            selection_str = parts[1].strip()
-                            try:
-                                selected_index = int(selection_str) - 1
-                                if 0 <= selected_index < len(updated_state['solar_options']):
-                                    selected_option = updated_state['solar_options'][selected_index]
-                                    print(f"Selected option by number: {selected_index}")
-                            except ValueError:
-                                # Try matching by name if not a number
-                                for option in updated_state['solar_options']:
-                                    if option.get('descriptor', {}).get('name', '').lower() in selection_str:
-                                        selected_option = option
-                                        print(f"Selected option by name: {option.get('descriptor', {}).get('name')}")
-                                        break
-
-                    # Handle cases where the user might just type the option number or name (less robust parsing)
-                    if not selected_option:
-                        # Check if input is just a number corresponding to an option
-                        try:
-                            selected_index = int(user_selection_input.strip()) - 1
-                            if 0 <= selected_index < len(updated_state['solar_options']):
-                                selected_option = updated_state['solar_options'][selected_index]
-                                print(f"Selected option by number directly: {selected_index}")
-                        except ValueError:
-                             # Check if input is an exact match for an option name (case-insensitive)
-                             for option in updated_state['solar_options']:
-                                if option.get('descriptor', {}).get('name', '').lower() == user_selection_input.strip():
-                                     selected_option = option
-                                     print(f"Selected option by exact name match: {user_selection_input}")
-                                     break
-
-
-                except Exception as e:
-                     print(f"Error during option selection parsing: {e}") # Debugging
-
-            if selected_option:
-                updated_state['selected_solar_option'] = selected_option
-                # Set next stage to confirm. The agent will see selected_solar_option in state
-                # and know to call the confirm tool.
-                updated_state['current_stage'] = 'confirm_solar'
-                print(f"Option selected, transitioning to confirm_solar: {selected_option.get('id')}")
-
-            elif 'cancel' in user_selection_input or 'stop' in user_selection_input:
-                 updated_state['current_stage'] = 'end' # User wants to stop
-                 print("User cancelled, transitioning to end.")
-            else:
-                 # Invalid selection, stay in present_options. Agent will reprompt.
-                 updated_state['current_stage'] = 'present_options'
-                 print("Invalid selection, staying in present_options.")
-
-
-        elif isinstance(latest_message, AIMessage):
-             # Agent responded while in present_options, means it likely presented options or asked for selection
-             # Stay in present_options to receive user's selection.
-             updated_state['current_stage'] = 'present_options'
-             print("Agent message received in present_options, staying in stage.")
-
-    elif current_stage == 'confirm_solar':
-        # Expecting ToolMessage output from call_tool (beckn_solar_retail_confirm)
-        if isinstance(latest_message, ToolMessage):
-            tool_output = json.loads(latest_message.content)
-            if 'error' not in tool_output:
-                order = tool_output.get('output', {}).get('message', {}).get('order', {}) # Access 'output' key
-                if order:
-                    updated_state['order_id'] = order.get('id')
-                    updated_state['current_stage'] = 'search_subsidies' # Move to subsidy search
-                    print(f"Solar confirmed (Order ID: {updated_state['order_id']}), transitioning to search_subsidies.")
-                else:
-                     updated_state['current_stage'] = 'provide_status' # Confirmation response unexpected
-                     print("Solar confirmation response unexpected, transitioning to provide_status.")
-            else:
-                updated_state['current_stage'] = 'error'
-                updated_state['error_message'] = tool_output.get('error', 'Unknown confirm error')
-                print(f"Confirm solar error, transitioning to error: {updated_state['error_message']}")
-
-
-    elif current_stage == 'search_subsidies':
-        # Expecting ToolMessage output from call_tool (beckn_subsidy_search)
-        if isinstance(latest_message, ToolMessage):
-            tool_output = json.loads(latest_message.content)
-            if 'error' not in tool_output:
-                subsidy_options = tool_output.get('output', {}).get('message', {}).get('catalog', {}).get('items', []) # Access 'output' key
-                updated_state['subsidy_search_results'] = subsidy_options
-                if subsidy_options:
-                    updated_state['current_stage'] = 'apply_subsidies' # Move to applying
-                    print(f"Subsidies found ({len(subsidy_options)}), transitioning to apply_subsidies.")
-                else:
-                    updated_state['current_stage'] = 'setup_grid_flexibility' # Move to next stage if no subsidies
-                    print("No subsidies found, transitioning to setup_grid_flexibility.")
-            else:
-                updated_state['current_stage'] = 'setup_grid_flexibility' # Continue despite error
-                updated_state['error_message'] = tool_output.get('error', 'Unknown subsidy search error')
-                print(f"Search subsidies error, transitioning to setup_grid_flexibility: {updated_state['error_message']}")
-
-    elif current_stage == 'apply_subsidies':
-        # Expecting ToolMessage output from call_tool (beckn_subsidy_confirm)
-        if isinstance(latest_message, ToolMessage):
-            tool_output = json.loads(latest_message.content)
-            if 'error' not in tool_output:
-                order = tool_output.get('output', {}).get('message', {}).get('order', {}) # Access 'output' key
-                if order:
-                    updated_state['applied_subsidy_order_id'] = order.get('id')
-                    updated_state['current_stage'] = 'setup_grid_flexibility' # Move to grid flexibility setup
-                    print(f"Subsidy applied (ID: {updated_state['applied_subsidy_order_id']}), transitioning to setup_grid_flexibility.")
-                else:
-                    updated_state['current_stage'] = 'setup_grid_flexibility' # Confirmation response unexpected
-                    print("Subsidy confirmation response unexpected, transitioning to setup_grid_flexibility.")
-            else:
-                updated_state['current_stage'] = 'setup_grid_flexibility' # Continue despite error
-                updated_state['error_message'] = tool_output.get('error', 'Unknown subsidy confirm error')
-                print(f"Apply subsidies error, transitioning to setup_grid_flexibility: {updated_state['error_message']}")
-
-
-    elif current_stage == 'setup_grid_flexibility':
-        # Expecting ToolMessage outputs from World Engine calls or AIMessage from agent asking for info.
-        # This node processes the results of the WE API calls and decides the *next WE step*
-        # or if WE setup is complete. The agent will be called next to decide which WE tool to call.
-
-        # Process tool outputs from WE calls
-        if isinstance(latest_message, ToolMessage):
-            tool_output = json.loads(latest_message.content)
-            tool_name = latest_message.tool_call_id # Use full tool_call_id to infer tool name
-
-            if 'error' not in tool_output:
-                # Update state based on which WE tool succeeded
-                if 'world_engine_create_energy_resource' in tool_name and tool_output.get('output', {}).get('data'):
-                    updated_state['energy_resource_id'] = tool_output['output']['data'].get('id')
-                    print(f"ER created (ID: {updated_state['energy_resource_id']}).")
-                elif 'world_engine_create_meter' in tool_name and tool_output.get('output', {}).get('data'):
-                    updated_state['meter_id'] = tool_output['output']['data'].get('id')
-                    print(f"Meter created (ID: {updated_state['meter_id']}).")
-                elif 'world_engine_create_der' in tool_name and tool_output.get('output', {}).get('data'):
-                    der_id = tool_output['output']['data'].get('id')
-                    if der_id not in updated_state['der_ids']:
-                         updated_state['der_ids'].append(der_id)
-                    print(f"DER created (ID: {der_id}).")
-                elif 'world_engine_get_utilities_data' in tool_name and tool_output.get('output', {}).get('utilities'):
-                    updated_state['world_engine_data'] = tool_output['output'] # Store fetched utility data
-                    print("Utility data fetched.")
-
-                # After processing a successful WE tool call, stay in this stage for the agent to decide the next WE step
-                updated_state['current_stage'] = 'setup_grid_flexibility'
-                print("Processed WE tool output, staying in setup_grid_flexibility.")
-
-            else:
-                 # If a WE tool call failed, transition to error
-                 updated_state['current_stage'] = 'error'
-                 updated_state['error_message'] = tool_output.get('error', f'Unknown error from {tool_name}')
-                 print(f"WE tool error ({tool_name}), transitioning to error: {updated_state['error_message']}")
-
-        # After processing a Human or AIMessage in this stage
-        elif isinstance(latest_message, (HumanMessage, AIMessage)):
-             # The agent generated a message or user responded,
-             # the stage logic is handled by the agent node determining which WE tool to call next.
-             # Stay in this stage.
-             updated_state['current_stage'] = 'setup_grid_flexibility'
-             print("Processed message in setup_grid_flexibility, staying in stage.")
-
-        # Check if all required WE setup steps are complete based on the updated state
-        # This check should happen *after* potential state updates from tool calls
-        if updated_state.get('energy_resource_id') is not None and updated_state.get('meter_id') is not None and updated_state.get('der_ids'):
-             updated_state['current_stage'] = 'provide_status'
-             print("All WE setup steps complete, transitioning to provide_status.")
-
-
-    elif current_stage == 'provide_status':
-         # Status is provided (by agent message), move to end.
-         updated_state['current_stage'] = 'end'
-         print("Status provided, transitioning to end.")
-
-
-    elif current_stage == 'error':
-        # Error occurred, decide next step (e.g., return to welcome)
-        # Agent will generate the error message.
-        # After the agent provides the error message, the next user input
-        # will trigger handle_user_input, restarting the flow to 'welcome' or 'gather_info'.
-        # We don't need to explicitly change the stage here based on message type.
-        pass # Stay in error stage until new user input triggers handle_user_input
-
-
-    elif current_stage == END:
-        # Process ending, signal END
-        updated_state['current_stage'] = END
-        print("Process ended, transitioning to END.")
-
-    # Note: latest_tool_output_summary is cleared at the start of update_state
-
-    return updated_state
+    return stage_machine.update_state(state)
 
 # --- Define Conditional Edges ---
 
@@ -1115,29 +798,12 @@ def should_continue_agent(state: AgentState) -> str:
 
 def next_node_from_stage(state: AgentState) -> str:
     """
-    Decides the next node based on the 'current_stage' and the last message type.
+    Decides the next node based on the 'current_stage' and the last message type: a single
+    lookup in the routing table precomputed from the stage table.
     """
-    current_stage = state.get('current_stage')
-    # Ensure chat_history is not empty before accessing the last element
-    latest_message = state['chat_history'][-1] if state['chat_history'] else None
-    
-    print(f"--- next_node_from_stage (Current Stage: {current_stage}, Last message type: {type(latest_message)}) ---")
-
-    if current_stage == END: # This case means the overall process defined by your stages has reached its conclusion
-        return "end_process"
-
-    # If the last message in the history is an AIMessage generated by the agent
-    # (i.e., it has no tool_calls), and we are in a stage where the agent
-    # has likely just asked a question or presented information and is now
-    # waiting for a user response, the current graph invocation should conclude.
-    if isinstance(latest_message, AIMessage) and not latest_message.tool_calls:
-        # Stages where the agent communicates and then should wait for user input
-        if current_stage in ['welcome', 'gather_info', 'present_options', 'provide_status', 'error']:
-            print(f"Agent has spoken in stage {current_stage}. Current invoke pass will now end to await user input.")
-            return "awaiting_human_input" 
-            
-    # Default behavior: continue processing, likely by going back to the agent node
-    return "continue_process"
+    route = stage_machine.next_node_from_stage(state)
+    print(f"--- next_node_from_stage (Current Stage: {state.get('current_stage')}) -> {route} ---")
+    return route
 
 
 # --- Build the Graph ---
@@ -1,17 +1,13 @@
-import json
-import operator
-import random
-import uuid
-import datetime
 import os # Import the os module
-from typing import Annotated, List, Tuple, Union, TypedDict, Optional
+from typing import Optional
 
 import requests
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
-from langchain_core.messages.tool import ToolMessage
 from langchain_core.tools import tool
-from langchain_google_vertexai import ChatVertexAI
-from langgraph.graph import StateGraph, END
+
+from source.APIclasses.http_transport import get_shared_transport
+from source.APIclasses.becknAPI import BecknClient
+from source.APIclasses.beckn_payloads import BecknPayloadBuilder
+from source.APIclasses.grid_topology import get_topology_cache
 
 
 BECKN_BASE_URL = os.getenv("BECKN_BASE_URL")
@@ -24,43 +20,53 @@ bap_id = BECKN_BAP_ID
 bap_uri = BECKN_BAP_URI
 bpp_id = BECKN_BPP_ID
 bpp_uri = BECKN_BPP_URI
-print ([BECKN_BASE_URL, WORLD_ENGINE_BASE_URL, BECKN_BAP_ID, BECKN_BAP_URI, BECKN_BPP_ID, BECKN_BPP_URI])
 
 # if not all([BECKN_BASE_URL, WORLD_ENGINE_BASE_URL, BECKN_BAP_ID, BECKN_BAP_URI, BECKN_BPP_ID, BECKN_BPP_URI]):
 #     raise EnvironmentError("Missing one or more required environment variables. Ensure .env file exists and contains all necessary variables.")
 
+# Beckn request bodies are spliced into templates serialized once per (domain, action)
+beckn_payloads = BecknPayloadBuilder(bap_id, bap_uri, bpp_id, bpp_uri)
+
+# Start every discovery search as soon as the user's location is known (see prefetch_catalogs)
+SPECULATIVE_DISCOVERY = os.getenv("SPECULATIVE_DISCOVERY", "true").lower() == "true"
+_beckn_client = None
+
+def get_beckn_client() -> BecknClient:
+    """
+    Process-wide BecknClient sharing the transport and catalog cache with the tools below.
+    """
+    global _beckn_client
+    if _beckn_client is None:
+        _beckn_client = BecknClient(BECKN_BASE_URL, bap_id, bap_uri, bpp_id, bpp_uri)
+    return _beckn_client
+
+def prefetch_catalogs():
+    """
+    Speculatively runs all discovery searches in the background so the search stages find their
+    catalogs in the cache. Returns {name: Future}, or None when SPECULATIVE_DISCOVERY is off.
+    """
+    if not SPECULATIVE_DISCOVERY:
+        return None
+    return get_beckn_client().prefetch_discovery()
+
+def _post_beckn(payload) -> dict:
+    # Every Beckn tool goes through the shared client: one place for the transport, the on_*
+    # callback wait (BECKN_CALLBACK_MODE) and the request metrics
+    return get_beckn_client()._post(f"{BECKN_BASE_URL}/{payload.action}", payload)
+
+def _search_beckn(payload) -> dict:
+    # Same intent for every user: served from the shared catalog cache
+    return get_beckn_client()._cached_search(f"{BECKN_BASE_URL}/{payload.action}", payload)
+
 @tool
 def beckn_connection_search() -> dict:
     """
     Triggers the Search API for Beckn Connection to find available services.
     Requires provider_id, item_id.
     """
-    url = f"{BECKN_BASE_URL}/search"
-    headers = { "Content-Type": "application/json" }
-    transaction_id = str(uuid.uuid4())
-    message_id = str(uuid.uuid4())
-    timestamp = datetime.datetime.now().isoformat()
-
-    payload = {
-        "context": {
-            "domain": "deg:service",
-            "action": "search",
-            "location": { "country": { "code": "USA" } }, # Assuming USA for now, could be parameterized
-            "version": "1.1.0",
-            "bap_id": bap_id,
-            "bap_uri": bap_uri,
-            "bpp_id": bpp_id,
-            "bpp_uri": bpp_uri,
-            "transaction_id": transaction_id,
-            "message_id": message_id,
-            "timestamp": timestamp
-        },
-        "message": { "intent": { "item": { "descriptor": { "name": "Connection" } } } }
-    }
+    payload = beckn_payloads.search("deg:service", "Connection", city_code=None) # No city in the connection search
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
-        return response.json()
+        return _search_beckn(payload)
     except requests.exceptions.RequestException as e:
         return {"error": f"API call failed: {e}"}
 
@@ -70,73 +76,21 @@ def beckn_solar_retail_search() -> dict:
     Triggers the Search API for Beckn Solar-Retail and Battery-Retail to find solar and battery product and service offerings.
     Requires provider_id, item_id.
     """
-    url = f"{BECKN_BASE_URL}/search"
-    headers = { "Content-Type": "application/json" }
-    transaction_id = str(uuid.uuid4())
-    message_id = str(uuid.uuid4())
-    timestamp = datetime.datetime.now().isoformat()
-
-    payload = {
-        "context": {
-            "domain": "deg:retail",
-            "action": "search",
-            "location": { "country": { "code": "USA" }, "city": { "code": "NANP:628" } }, # Assuming specific city for now
-            "version": "1.1.0",
-            "bap_id": bap_id,
-            "bap_uri": bap_uri,
-            "bpp_id": bpp_id,
-            "bpp_uri": bpp_uri,
-            "transaction_id": transaction_id,
-            "message_id": message_id,
-            "timestamp": timestamp
-        },
-        "message": { "intent": { "item": { "descriptor": { "name": "solar" } } } }
-    }
+    payload = beckn_payloads.search("deg:retail", "solar")
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()
+        return _search_beckn(payload)
     except requests.exceptions.RequestException as e:
         return {"error": f"API call failed: {e}"}
 
-
 @tool
 def beckn_solar_retail_select(provider_id: str, item_id: str) -> dict:
     """
     Triggers the Select API for Beckn Solar-Retail and Battery-Retail to select a specific solar and battery offering.
     Requires provider_id, item_id.
     """
-    url = f"{BECKN_BASE_URL}/select"
-    headers = { "Content-Type": "application/json" }
-    transaction_id = str(uuid.uuid4())
-    message_id = str(uuid.uuid4())
-    timestamp = datetime.datetime.now().isoformat()
-
-    payload = {
-      "context": {
-        "domain": "deg:retail",
-        "action": "select",
-        "location": { "country": { "code": "USA" }, "city": { "code": "NANP:628" } },
-        "version": "1.1.0",
-        "bap_id": bap_id,
-        "bap_uri": bap_uri,
-        "bpp_id": bpp_id,
-        "bpp_uri": bpp_uri,
-        "transaction_id": transaction_id,
-        "message_id": message_id,
-        "timestamp": timestamp
-      },
-      "message": {
-       "order": {
-                "provider": { "id": provider_id },
-                "items": [ { "id": item_id } ]
-            }
-        }
-    }
+    payload = beckn_payloads.order("deg:retail", "select", provider_id, item_id)
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()
+        return _post_beckn(payload)
     except requests.exceptions.RequestException as e:
         return {"error": f"API call failed: {e}"}
 
@@ -146,37 +100,9 @@ def beckn_solar_retail_init(provider_id: str, item_id: str) -> dict:
     Triggers the Init API for Beckn Solar-Retail to initialize the order/process.
     Requires provider_id, item_id.
     """
-    url = f"{BECKN_BASE_URL}/init"
-    headers = { "Content-Type": "application/json" }
-    transaction_id = str(uuid.uuid4())
-    message_id = str(uuid.uuid4())
-    timestamp = datetime.datetime.now().isoformat()
-
-    payload = {
-      "context": {
-        "domain": "deg:retail",
-        "action": "init",
-        "location": { "country": { "code": "USA" }, "city": { "code": "NANP:628" } },
-        "version": "1.1.0",
-        "bap_id": bap_id,
-        "bap_uri": bap_uri,
-        "bpp_id": bpp_id,
-        "bpp_uri": bpp_uri,
-        "transaction_id": transaction_id,
-        "message_id": message_id,
-        "timestamp": timestamp
-      },
-      "message": {
-       "order": {
-                "provider": { "id": provider_id },
-                "items": [ { "id": item_id } ]
-            }
-        }
-    }
+    payload = beckn_payloads.order("deg:retail", "init", provider_id, item_id)
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()
+        return _post_beckn(payload)
     except requests.exceptions.RequestException as e:
         return {"error": f"API call failed: {e}"}
 
@@ -186,46 +112,9 @@ def beckn_solar_retail_confirm(provider_id: str, item_id: str, fulfillment_id: s
     Triggers the Confirm API for Beckn Solar-Retail to confirm the order/process.
     Requires provider_id, item_id, fulfillment_id, customer_name, customer_phone, and customer_email.
     """
-    url = f"{BECKN_BASE_URL}/confirm"
-    headers = { "Content-Type": "application/json" }
-    transaction_id = str(uuid.uuid4())
-    message_id = str(uuid.uuid4())
-    timestamp = datetime.datetime.now().isoformat()
-
-    payload = {
-      "context": {
-        "domain": "deg:retail",
-        "action": "confirm",
-        "location": { "country": { "code": "USA" }, "city": { "code": "NANP:628" } },
-        "version": "1.1.0",
-        "bap_id": bap_id,
-        "bap_uri": bap_uri,
-        "bpp_id": bpp_id,
-        "bpp_uri": bpp_uri,
-        "transaction_id": transaction_id,
-        "message_id": message_id,
-        "timestamp": timestamp
-      },
-      "message": {
-       "order": {
-                "provider": { "id": provider_id },
-                "items": [ { "id": item_id } ],
-                  "fulfillments": [
-                {
-                  "id": fulfillment_id,
-                  "customer": {
-                    "person": { "name": customer_name },
-                    "contact": { "phone": customer_phone, "email": customer_email }
-                  }
-                }
-              ]
-            }
-        }
-    }
+    payload = beckn_payloads.confirm("deg:retail", provider_id, item_id, fulfillment_id, customer_name, customer_phone, customer_email)
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()
+        return _post_beckn(payload)
     except requests.exceptions.RequestException as e:
         return {"error": f"API call failed: {e}"}
 
@@ -235,32 +124,9 @@ def beckn_solar_retail_status(order_id: str) -> dict:
     Triggers the Status API for Beckn Solar-Retail to get the status of an order.
     Requires order_id.
     """
-    url = f"{BECKN_BASE_URL}/status"
-    headers = { "Content-Type": "application/json" }
-    transaction_id = str(uuid.uuid4())
-    message_id = str(uuid.uuid4())
-    timestamp = datetime.datetime.now().isoformat()
-
-    payload = {
-      "context": {
-        "domain": "deg:retail",
-        "action": "status",
-        "location": { "country": { "code": "USA" }, "city": { "code": "NANP:628" } },
-        "version": "1.1.0",
-        "bap_id": bap_id,
-        "bap_uri": bap_uri,
-        "bpp_id": bpp_id,
-        "bpp_uri": bpp_uri,
-        "transaction_id": transaction_id,
-        "message_id": message_id,
-        "timestamp": timestamp
-      },
-      "message": { "order_id": order_id }
-    }
+    payload = beckn_payloads.status("deg:retail", order_id)
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()
+        return _post_beckn(payload)
     except requests.exceptions.RequestException as e:
         return {"error": f"API call failed: {e}"}
 
@@ -270,82 +136,21 @@ def beckn_subsidy_search() -> dict:
     Triggers the Search API for Beckn Subsidy to find available incentives.
     Requires no parameters.
     """
-    url = f"{BECKN_BASE_URL}/search"
-    headers = { "Content-Type": "application/json" }
-    transaction_id = str(uuid.uuid4())
-    message_id = str(uuid.uuid4())
-    timestamp = datetime.datetime.now().isoformat()
-
-    payload = {
-        "context": {
-            "domain": "deg:schemes",
-            "action": "search",
-            "location": { "country": { "code": "USA" }, "city": { "code": "NANP:628" } }, # Assuming specific city for now
-            "version": "1.1.0",
-            "bap_id": bap_id,
-            "bap_uri": bap_uri,
-            "bpp_id": bpp_id,
-            "bpp_uri": bpp_uri,
-            "transaction_id": transaction_id,
-            "message_id": message_id, # Note: message_id was missing in original JSON for this search
-            "timestamp": timestamp
-        },
-        "message": { "intent": { "item": { "descriptor": { "name": "incentive" } } } }
-    }
+    payload = beckn_payloads.search("deg:schemes", "incentive")
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()
+        return _search_beckn(payload)
     except requests.exceptions.RequestException as e:
         return {"error": f"API call failed: {e}"}
 
-
 @tool
 def beckn_subsidy_confirm(provider_id: str, item_id: str, fulfillment_id: str, customer_name: str, customer_phone: str, customer_email: str) -> dict:
     """
     Triggers the Confirm API for Beckn Subsidy to apply for an incentive.
     Requires provider_id, item_id, fulfillment_id, customer_name, customer_phone, and customer_email.
     """
-    url = f"{BECKN_BASE_URL}/confirm"
-    headers = { "Content-Type": "application/json" }
-    transaction_id = str(uuid.uuid4())
-    message_id = str(uuid.uuid4())
-    timestamp = datetime.datetime.now().isoformat()
-
-    payload = {
-      "context": {
-        "domain": "deg:schemes",
-        "action": "confirm",
-        "location": { "country": { "code": "USA" }, "city": { "code": "NANP:628" } },
-        "version": "1.1.0",
-        "bap_id": bap_id,
-        "bap_uri": bap_uri,
-        "bpp_id": bpp_id,
-        "bpp_uri": bpp_uri,
-        "transaction_id": transaction_id,
-        "message_id": message_id,
-        "timestamp": timestamp
-      },
-      "message": {
-       "order": {
-                "provider": { "id": provider_id },
-                "items": [ { "id": item_id } ],
-                 "fulfillments": [
-                {
-                  "id": fulfillment_id,
-                  "customer": {
-                    "person": { "name": customer_name },
-                    "contact": { "phone": customer_phone, "email": customer_email }
-                  }
-                }
-              ]
-            }
-        }
-    }
+    payload = beckn_payloads.confirm("deg:schemes", provider_id, item_id, fulfillment_id, customer_name, customer_phone, customer_email)
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()
+        return _post_beckn(payload)
     except requests.exceptions.RequestException as e:
         return {"error": f"API call failed: {e}"}
 
@@ -360,15 +165,25 @@ def world_engine_get_utilities_data() -> dict:
     """
     Retrieves detailed data about utilities, substations, transformers, and meters from the World Engine.
     """
-    url = f"{WORLD_ENGINE_BASE_URL}/utility/detailed"
-    headers = { "Content-Type": "application/json" }
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        return response.json()
+        return get_grid_topology().raw
     except requests.exceptions.RequestException as e:
         return {"error": f"API call failed: {e}"}
 
+def _fetch_utilities_data() -> dict:
+    url = f"{WORLD_ENGINE_BASE_URL}/utility/detailed"
+    headers = { "Content-Type": "application/json" }
+    response = get_shared_transport().get(url, headers=headers)
+    response.raise_for_status()
+    return response.json()
+
+def get_grid_topology(refresh: bool = False):
+    """
+    Returns the process-wide, indexed World Engine topology, downloading it only on first use.
+    Raises requests.exceptions.RequestException if the download fails.
+    """
+    return get_topology_cache(WORLD_ENGINE_BASE_URL).get(_fetch_utilities_data, refresh=refresh)
+
 @tool
 def world_engine_create_meter(code: str, type: str, city: str, state: str, latitude: float, longitude: float, pincode: str, parent: Optional[int] = None, energyResource: Optional[int] = None, consumptionLoadFactor: float = 1.0, productionLoadFactor: float = 0.0) -> dict:
     """
@@ -394,7 +209,7 @@ def world_engine_create_meter(code: str, type: str, city: str, state: str, latit
         }
     }
     try:
-        response = requests.post(url, headers=headers, json=payload)
+        response = get_shared_transport().post(url, headers=headers, json=payload)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -416,7 +231,7 @@ def world_engine_create_energy_resource(name: str, meter: Optional[int] = None)
         }
     }
     try:
-        response = requests.post(url, headers=headers, json=payload)
+        response = get_shared_transport().post(url, headers=headers, json=payload)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -436,7 +251,7 @@ def world_engine_create_der(energy_resource_id: int, appliance_id: int, switched
         "switched_on": switched_on
     }
     try:
-        response = requests.post(url, headers=headers, json=payload)
+        response = get_shared_transport().post(url, headers=headers, json=payload)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -451,7 +266,7 @@ def world_engine_toggle_der_switching(der_id: int) -> dict:
     url = f"{WORLD_ENGINE_BASE_URL}/toggle-der/{der_id}"
     headers = { "Content-Type": "application/json" }
     try:
-        response = requests.post(url, headers=headers)
+        response = get_shared_transport().post(url, headers=headers)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -0,0 +1,239 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional
+
+from langchain_core.messages import BaseMessage, messages_from_dict, message_to_dict
+
+try:
+    import orjson
+except ImportError: # orjson is optional, the stdlib encoder is only slower
+    orjson = None
+
+MESSAGES_MARKER = "__messages__"
+# Seconds a session is kept after its last use, for both backends (SESSION_TTL overrides it)
+DEFAULT_SESSION_TTL = 3600.0
+
+
+def _dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=str)
+    return json.dumps(obj, separators=(",", ":"), default=str).encode()
+
+
+def _loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _encode_value(value):
+    if isinstance(value, list) and any(isinstance(item, BaseMessage) for item in value):
+        return {MESSAGES_MARKER: [
+            message_to_dict(item) if isinstance(item, BaseMessage) else {"type": "__raw__", "data": item}
+            for item in value
+        ]}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and MESSAGES_MARKER in value and len(value) == 1:
+        decoded = []
+        for item in value[MESSAGES_MARKER]:
+            if item.get("type") == "__raw__":
+                decoded.append(item["data"])
+            else:
+                decoded.extend(messages_from_dict([item]))
+        return decoded
+    return value
+
+
+def serialize_state(state: dict) -> bytes:
+    """
+    Compact, process-independent encoding of an AgentState: LangChain messages are turned into
+    plain dicts, the whole state is JSON-encoded and zlib-compressed.
+    """
+    return zlib.compress(_dumps({key: _encode_value(value) for key, value in state.items()}), 3)
+
+
+def deserialize_state(data: bytes) -> dict:
+    return {key: _decode_value(value) for key, value in _loads(zlib.decompress(data)).items()}
+
+
+class SessionStore(ABC):
+    """
+    Interface for chat session persistence. Implementations store serialized AgentState by session id;
+    one that does not implement get/put/delete cannot be instantiated.
+    """
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def put(self, session_id: str, state: dict) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        ...
+
+    def stats(self) -> dict:
+        return {}
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    In-process LRU store with TTL and a byte budget. States are kept serialized, so the budget
+    reflects real memory use and each session costs a few KB instead of live message objects.
+    """
+
+    def __init__(self, max_sessions=10000, ttl=DEFAULT_SESSION_TTL, max_bytes=256 * 1024 * 1024):
+        """
+        Args:
+            max_sessions (int): Maximum number of sessions kept.
+            ttl (float): Seconds of inactivity after which a session expires.
+            max_bytes (int): Upper bound on the total size of all serialized sessions.
+        """
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict() # session_id -> (last_access, serialized state)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+
+    def _drop(self, session_id):
+        _, data = self._sessions.pop(session_id)
+        self._bytes -= len(data)
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            if now - entry[0] > self.ttl:
+                self._drop(session_id)
+                self.counters["expired"] += 1
+                self.counters["misses"] += 1
+                return None
+            self._sessions[session_id] = (now, entry[1])
+            self._sessions.move_to_end(session_id)
+            self.counters["hits"] += 1
+            data = entry[1]
+        return deserialize_state(data)
+
+    def put(self, session_id, state):
+        data = serialize_state(state)
+        with self._lock:
+            if session_id in self._sessions:
+                self._drop(session_id)
+            self._sessions[session_id] = (time.monotonic(), data)
+            self._bytes += len(data)
+            # Evict least recently used sessions until both limits hold (the newest one always stays)
+            while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes):
+                self._drop(next(iter(self._sessions)))
+                self.counters["evicted"] += 1
+
+    def delete(self, session_id):
+        with self._lock:
+            if session_id in self._sessions:
+                self._drop(session_id)
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "sessions": len(self._sessions), "bytes": self._bytes,
+                    "max_sessions": self.max_sessions, "max_bytes": self.max_bytes, "ttl": self.ttl}
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Disk-backed store shared by every worker process on the host (SQLite in WAL mode).
+    Sessions survive restarts and expire after `ttl` seconds of inactivity.
+    """
+
+    def __init__(self, path="sessions.db", ttl=DEFAULT_SESSION_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " session_id TEXT PRIMARY KEY,"
+                " data BLOB NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions(updated_at)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id):
+        row = self._connection().execute(
+            "SELECT data, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        if time.time() - row[1] > self.ttl:
+            self.delete(session_id)
+            return None
+        return deserialize_state(row[0])
+
+    def put(self, session_id, state):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(session_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                (session_id, serialize_state(state), time.time()),
+            )
+
+    def delete(self, session_id):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def purge_expired(self):
+        """
+        Deletes every session idle for longer than the TTL. Returns the number removed.
+        """
+        with self._connection() as conn:
+            return conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,)).rowcount
+
+    def stats(self):
+        count, total = self._connection().execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM sessions").fetchone()
+        return {"sessions": count, "bytes": total, "ttl": self.ttl, "path": self.path}
+
+
+def create_session_store() -> SessionStore:
+    """
+    Builds the session store selected by SESSION_STORE ("memory" or "sqlite").
+    """
+    backend = os.getenv("SESSION_STORE", "memory").lower()
+    ttl = float(os.getenv("SESSION_TTL", str(DEFAULT_SESSION_TTL)))
+    if backend == "sqlite":
+        return SQLiteSessionStore(
+            path=os.getenv("SESSION_DB_PATH", "sessions.db"),
+            ttl=ttl,
+        )
+    if backend != "memory":
+        raise ValueError(f"Unknown SESSION_STORE '{backend}', expected 'memory' or 'sqlite'.")
+    return InMemorySessionStore(
+        max_sessions=int(os.getenv("SESSION_MAX_COUNT", "10000")),
+        ttl=ttl,
+        max_bytes=int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024))),
+    )